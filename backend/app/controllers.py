@@ -5,13 +5,30 @@ One controller per model to handle creating, updating and deleting.
 All controllers should be derived from the Base class.
 The Base contains attributes and functions common to all controllers.
 """
+import functools
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 import bottle
+import requests
 import common.responses as responses
+from common import deadlines, metrics
+from common.admission import limiter_stats
+from common.cache import TTLCache, DiskCache, SingleFlight, cache_stats, \
+    coalesced_stats
+from common.jobs import Job, JobQueue, job_stats
+from common.popularity import PopularityTracker, popularity_stats
+from common.projection import parse_fields, project_stream, project_text
+from common.startup import is_ready, startup_stats
+from common.subscriptions import Subscriptions, subscription_stats
 from common.utils import request_args, validate_state, \
-    get_ts, rfc3339, generate_signature, generate_state
+    rfc3339, generate_signature, generate_state, hash_token, \
+    get_signature_payload, get_signer, token_expires_at
 import settings
 from app import services
-from webargs import fields
 from http.cookies import Morsel
 
 
@@ -36,6 +53,130 @@ class Base(object):
         """
         self._app = app
 
+    @staticmethod
+    def _fields() -> dict:
+        """Returns the fields selected with the `fields` query parameter.
+
+        :return: Selection tree, None if all fields are wanted.
+        :rtype: dict
+        :raise ValueError: If the parameter is invalid.
+        """
+        spec = bottle.request.query.get('fields')
+
+        return parse_fields(spec) if spec else None
+
+    @staticmethod
+    def _project(body: str, tree: dict) -> str:
+        """Returns the selected fields of a JSON response body.
+
+        :param body: The response body.
+        :type body: str
+        :param tree: Selection tree, None for all fields.
+        :type tree: dict
+        :return: The projected body, unchanged if it isn't JSON.
+        :rtype: str
+        """
+        if tree is None:
+            return body
+
+        try:
+            return json.dumps(project_text(body, tree))
+        except ValueError:
+            return body
+
+
+class LazyController(object):
+    """Creates a controller on first use.
+
+    Route callbacks are taken with `action`, which doesn't create the
+    controller, so its caches, pools and threads are only set up when the
+    first request needs them.
+    """
+
+    def __init__(self, cls: type):
+        """Initialise LazyController class.
+
+        :param cls: The controller class.
+        :type cls: type
+        """
+        self._cls = cls
+        self._app = None
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def set_app(self, app: bottle.Bottle):
+        """Sets the Bottle app for the controller.
+
+        :param app: The Bottle application.
+        :type app: bottle.Bottle
+        :return: None
+        :rtype: None
+        """
+        self._app = app
+
+        if self._instance is not None:
+            self._instance.set_app(app)
+
+    def get(self) -> Base:
+        """Returns the controller, created on the first call.
+
+        :return: The controller.
+        :rtype: Base
+        """
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._cls(self._app)
+
+        return self._instance
+
+    def action(self, name: str):
+        """Returns a route callback calling an action of the controller.
+
+        :param name: Name of the action.
+        :type name: str
+        :return: The callback, with the attributes of the action, e.g. its
+            request arguments.
+        :rtype: callable
+        """
+
+        @functools.wraps(getattr(self._cls, name))
+        def callback(*args, **kwargs):
+            return getattr(self.get(), name)(*args, **kwargs)
+
+        return callback
+
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
+
+
+class UpstreamErrorPlugin(object):
+    """Bottle plugin turning failed upstream requests into error responses.
+
+    Timeouts are answered with 504, open circuits with 503 and other
+    failures with 502.
+    """
+    name = 'upstream_errors'
+    api = 2
+
+    def apply(self, callback, route):
+        def wrapper(*args, **kwargs):
+            try:
+                return callback(*args, **kwargs)
+            except services.UpstreamError as e:
+                headers = {}
+
+                if getattr(e, 'retry_after', None):
+                    headers['Retry-After'] = str(max(int(e.retry_after), 1))
+
+                return responses.JSONResponse(
+                    body={'message': str(e)},
+                    status=e.status,
+                    headers=headers
+                )
+
+        return wrapper
+
 
 class Status(Base):
     """Status controller.
@@ -45,14 +186,62 @@ class Status(Base):
 
     @staticmethod
     def health_check() -> dict:
-        """Returns an empty response.
+        """Returns the circuit breaker states of the upstream APIs.
 
-        Used for API health check endpoint.
+        Used for API health check endpoint. The status is always 200, an
+        unavailable upstream doesn't make the application unhealthy.
 
-        :return: An empty response.
+        :return: Circuit state by API name.
         :rtype: dict
         """
-        return responses.JSONResponse({})
+        return responses.JSONResponse({
+            'upstreams': {name: stats['state'] for name, stats
+                          in services.breaker_stats().items()}
+        })
+
+    @staticmethod
+    def ready() -> responses.JSONResponse:
+        """Returns whether the process is ready to serve requests.
+
+        Used for the readiness probe. The status is 503 until the startup
+        warm-up has finished.
+
+        :return: Readiness and startup timings.
+        :rtype: responses.JSONResponse
+        """
+        return responses.JSONResponse(startup_stats(),
+                                      status=200 if is_ready() else 503)
+
+    @staticmethod
+    def stats() -> responses.JSONResponse:
+        """Returns runtime statistics of the application.
+
+        :return: Upstream connection pool, cache and admission control
+            statistics.
+        :rtype: responses.JSONResponse
+        """
+        return responses.JSONResponse({
+            'pools': services.pool_stats(),
+            'breakers': services.breaker_stats(),
+            'caches': cache_stats(),
+            'coalesced': coalesced_stats(),
+            'subscriptions': subscription_stats(),
+            'limiters': limiter_stats(),
+            'jobs': job_stats(),
+            'popularity': popularity_stats(),
+            'startup': startup_stats()
+        })
+
+    @staticmethod
+    def metrics() -> responses.TextResponse:
+        """Returns the metrics in the Prometheus text format.
+
+        :return: Request and upstream call metrics.
+        :rtype: responses.TextResponse
+        """
+        return responses.TextResponse(
+            metrics.render(),
+            headers={'Content-Type': 'text/plain; version=0.0.4'})
 
 
 class Login(Base):
@@ -64,6 +253,19 @@ class Login(Base):
     def __init__(self, app: bottle.Bottle = None):
         super().__init__(app)
         self._login_service = services.Request('login')
+        # Nonces of the OAuth states that have been used already by this
+        # worker process, see settings.OAUTH_STATE_NONCES.
+        self._state_nonces = TTLCache(
+            'oauth_state_nonces',
+            maxsize=settings.OAUTH_STATE_NONCES,
+            ttl=settings.OAUTH_STATE_EXPIRES_IN)
+        # /me responses and the expiry times of the issued tokens, by the
+        # hashed value of the Authorization cookie.
+        self._me_cache = TTLCache('me', **settings.ME_CACHE)
+        self._token_expiry = TTLCache(
+            'token_expiry',
+            maxsize=settings.ME_CACHE['maxsize'],
+            ttl=settings.ME_CACHE['ttl'])
         self._login_authorization_uri = f'{settings.LOGIN_APP_URL}' \
             f'?grant_type={settings.GRANT_TYPES["authorization"]}' \
             f'&response_type={settings.RESPONSE_TYPE}' \
@@ -100,7 +302,8 @@ class Login(Base):
 
             response_state = data.get('state', '')
             ok = validate_state(response_state, settings.OAUTH_STATE_SALT,
-                                settings.OAUTH_STATE_EXPIRES_IN)
+                                settings.OAUTH_STATE_EXPIRES_IN,
+                                nonce_store=self._state_nonces)
 
             if not ok:
                 response = responses.JSONResponse(
@@ -120,8 +323,14 @@ class Login(Base):
             # In bottle starting from 0.13-dev
             Morsel._reserved.setdefault('samesite', 'SameSite')
 
+            token = f'Bearer {data["access_token"]}'
+            self._token_expiry.set(
+                hash_token(token),
+                time.monotonic() + data['expires_in'],
+                ttl=data['expires_in'])
+
             response.set_cookie('Authorization',
-                                f'Bearer {data["access_token"]}',
+                                token,
                                 max_age=data['expires_in'],
                                 httponly=True,
                                 secure=settings.SSL_ENABLED,
@@ -135,19 +344,65 @@ class Login(Base):
     def me(self) -> responses.JSONResponse:
         """Pass request to login app
 
+        Responses are cached per token, never longer than the token is
+        valid according to its `exp` claim or, if it was issued by this
+        process, its expiry.
+
         :return: Access token data.
         :rtype: responses.JSONResponse
         """
+        token = bottle.request.get_cookie('Authorization')
+        key = hash_token(token)
+
+        cached = self._me_cache.get(key)
+        if cached is not None:
+            return responses.JSONResponse(body=cached, status=200)
+
+        ttl = self._me_ttl(key, token) if token else 0
+        stream = settings.STREAM_RESPONSES and ttl <= 0
 
         response = self._login_service.get(
             '/me',
-            authorization_token=bottle.request.get_cookie(
-                'Authorization')
+            authorization_token=token,
+            stream=stream,
+            hedge=True
         )
 
+        if stream:
+            return responses.ProxyResponse(
+                response, chunk_size=settings.STREAM_CHUNK_SIZE)
+
+        if response.status_code == 200 and ttl > 0:
+            self._me_cache.set(key, response.text, ttl=ttl,
+                               size=len(response.content))
+
         return responses.JSONResponse(body=response.text,
                                       status=response.status_code)
 
+    def _me_ttl(self, key: str, token: str) -> float:
+        """Returns the cache TTL of a /me response.
+
+        :param key: Hashed Authorization cookie value.
+        :type key: str
+        :param token: Authorization cookie value.
+        :type token: str
+        :return: The default TTL, shortened to the token's remaining
+            lifetime if it is known from its `exp` claim or because it was
+            issued by this process.
+        :rtype: float
+        """
+        ttl = self._me_cache.ttl
+        expires_at = token_expires_at(token)
+        expires = self._token_expiry.get(key)
+
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+
+        if expires is not None:
+            ttl = min(ttl, expires - time.monotonic())
+
+        return ttl
+
     def login(self) -> responses.JSONResponse:
         """Generate uri and send it to the client
 
@@ -155,9 +410,7 @@ class Login(Base):
         :rtype: responses.JSONResponse
         """
 
-        encoded_state = generate_state({
-            'ts': get_ts()
-        }, settings.OAUTH_STATE_SALT)
+        encoded_state = generate_state(settings.OAUTH_STATE_SALT)
 
         uri = f'{self._login_authorization_uri}&state={encoded_state}'
 
@@ -169,6 +422,9 @@ class Login(Base):
         :return: Logout response.
         :rtype: responses.JSONResponse
         """
+        key = hash_token(bottle.request.get_cookie('Authorization'))
+        self._me_cache.delete(key)
+        self._token_expiry.delete(key)
 
         response = responses.JSONResponse(
             body={'message': 'Logout'},
@@ -189,22 +445,149 @@ class Identity(Base):
     def __init__(self, app: bottle.Bottle = None):
         super().__init__(app)
         self._identity_service = services.Request('identity')
+        self._cache = TTLCache('identity', **settings.IDENTITY_CACHE)
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.IDENTITY_BATCH_WORKERS)
 
     def read(self, id: str) -> responses.JSONResponse:
         """Returns one identity.
 
+        Identities are cached per user. Stale entries are revalidated with
+        a conditional request if the API returned an ETag or Last-Modified
+        header for them. The `fields` query parameter selects the returned
+        fields, e.g. `@id,data.name`.
+
         :param id: The identity's ID.
         :type id: str
         :return: The found identity.
         :rtype: responses.JSONResponse
         """
+        try:
+            tree = self._fields()
+        except ValueError as e:
+            return responses.JSONResponse(body={'message': str(e)},
+                                          status=400)
+
+        status, body = self._read(
+            bottle.request.get_cookie('Authorization'), id)
+
+        if status == 200:
+            body = self._project(body, tree)
+
+        return responses.JSONResponse(body=body, status=status)
+
+    @request_args(lambda fields: {
+        'ids': fields.List(fields.Str(), required=True)
+    })
+    def batch(self, args: dict) -> responses.JSONResponse:
+        """Returns many identities at once.
+
+        The identities are requested concurrently, at most
+        IDENTITY_BATCH_CONCURRENCY at once per request, so a large batch
+        can't hold up the batches of other requests. Repeated IDs are only
+        requested once.
+
+        :param args: The arguments passed.
+            ids: List of identity IDs.
+        :type args: dict
+        :return: Status and body of each identity by ID.
+        :rtype: responses.JSONResponse
+        """
+        if len(args['ids']) > settings.IDENTITY_BATCH_MAX_IDS:
+            return responses.JSONResponse(
+                body={'message': f'Too many ids, max '
+                                 f'{settings.IDENTITY_BATCH_MAX_IDS}'},
+                status=400
+            )
+
+        ids = list(OrderedDict.fromkeys(args['ids']))
+
+        token = bottle.request.get_cookie('Authorization')
+        deadline = deadlines.current()
+
+        def lookup(id):
+            try:
+                with deadlines.scope(deadline):
+                    return self._read(token, id)
+            except services.UpstreamError as e:
+                return e.status, json.dumps({'message': str(e)})
+
+        queue = iter(ids)
+        pending = {}
+        found = {}
+
+        def submit():
+            # At most IDENTITY_BATCH_CONCURRENCY lookups in flight at once.
+            id = next(queue, None)
+
+            if id is not None:
+                pending[self._executor.submit(lookup, id)] = id
+
+        for _ in range(settings.IDENTITY_BATCH_CONCURRENCY):
+            submit()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                found[pending.pop(future)] = future.result()
+                submit()
+
+        results = {}
+        for id in ids:
+            status, body = found[id]
+
+            try:
+                body = json.loads(body)
+            except ValueError:
+                pass
+
+            results[id] = {'status': status, 'body': body}
+
+        return responses.JSONResponse(body=results)
+
+    def _read(self, token: str, id: str) -> tuple:
+        """Returns one identity from the cache or the identity API.
+
+        :param token: Value of the Authorization cookie.
+        :type token: str
+        :param id: The identity's ID.
+        :type id: str
+        :return: Status code and body of the response.
+        :rtype: tuple
+        """
+        key = (hash_token(token), id)
+
+        cached, fresh = self._cache.lookup(key)
+        if fresh:
+            return 200, cached['body']
+
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
 
         response = self._identity_service.get(
             f'/{id}',
-            authorization_token=bottle.request.get_cookie('Authorization'))
+            headers=headers,
+            authorization_token=token,
+            hedge=True)
 
-        return responses.JSONResponse(body=response.text,
-                                      status=response.status_code)
+        if response.status_code == 304 and cached is not None:
+            self._cache.refresh(key)
+            return 200, cached['body']
+
+        if response.status_code == 200 and \
+                'no-store' not in response.headers.get('Cache-Control', ''):
+            self._cache.set(key, {
+                'body': response.text,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }, size=len(response.content))
+
+        return response.status_code, response.text
 
 
 class Broker(Base):
@@ -216,14 +599,57 @@ class Broker(Base):
     def __init__(self, app: bottle.Bottle = None):
         super().__init__(app)
         self._broker_service = services.Request('broker')
+        self._cache = TTLCache('broker', **settings.BROKER_CACHE)
+        self._disk_cache = None
+        if settings.BROKER_DISK_CACHE['enabled']:
+            disk_options = dict(settings.BROKER_DISK_CACHE)
+            del disk_options['enabled']
+            self._disk_cache = DiskCache('broker_disk', **disk_options)
+        # Callers with time left fetch again instead of sharing the
+        # deadline error of another request.
+        self._flight = SingleFlight(
+            'broker', retry_on=(services.DeadlineExceeded,),
+            timeout_error=lambda: services.DeadlineExceeded(
+                'broker', 'broker API request exceeded the request deadline'))
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.BROKER_BULK_WORKERS)
+        self._live = Subscriptions(
+            'broker', max_topics=settings.BROKER_LIVE['max_topics'])
+        job_options = dict(settings.BROKER_JOBS)
+        del job_options['max_wait']
+        self._jobs = JobQueue('broker', **job_options)
+        self._popularity = PopularityTracker(
+            'broker', maxsize=settings.BROKER_PREFETCH['max_tracked'],
+            half_life=settings.BROKER_PREFETCH['half_life'])
+        self._refresh_executor = ThreadPoolExecutor(
+            max_workers=settings.BROKER_PREFETCH['workers'])
+        self._refresh_lock = threading.Lock()
+        self._refreshing = set()
+        self._prefetcher = None
 
     @request_args({
-        'productCode': fields.Str(required=True),
-        'parameters': fields.Dict(required=True)
+        'productCode': str,
+        'parameters': dict
     })
     def fetch(self, args: dict) -> responses.JSONResponse:
         """Returns information from PoT translators.
 
+        Responses are cached by product code and parameters for the TTL
+        configured for the product code, in memory and in a database shared
+        by the worker processes. Stale responses are served while they are
+        refreshed in the background, the most requested ones are refreshed
+        before they go stale. Identical requests arriving while
+        the translator is still being called share its response. Responses
+        of products that aren't cached are streamed to the client if
+        streaming is enabled.
+
+        Requests with a `Prefer: respond-async` header that can't be
+        answered from the cache are run in the background. The response is
+        202 with the job, its result is returned by `job`.
+
+        The `fields` query parameter selects the returned fields. Streamed
+        responses are projected while they are read from the translator.
+
         :param args: The arguments passed.
             parameters: Any additional parameters to be sent to the translator.
         :type args: dict
@@ -232,21 +658,642 @@ class Broker(Base):
         :return: Data from the translator defined by the product code.
         :rtype: responses.JSONResponse
         """
-        json = {
-            'timestamp': rfc3339(),
-            'productCode': args['productCode'],
-            'parameters': args['parameters']
+        try:
+            tree = self._fields()
+        except ValueError as e:
+            return responses.JSONResponse(body={'message': str(e)},
+                                          status=400)
+
+        product_code = args['productCode']
+        parameters = args['parameters']
+        key = self._cache_key(product_code, parameters)
+        ttl = settings.BROKER_CACHE_TTLS.get(product_code, self._cache.ttl)
+
+        cached = self._cached(key, product_code, parameters, ttl)
+        if cached is not None:
+            return responses.JSONResponse(body=self._project(cached, tree),
+                                          status=200)
+
+        if self._prefers_async():
+            return self._enqueue(key, product_code, parameters, ttl, tree)
+
+        if ttl <= 0 and settings.STREAM_RESPONSES:
+            call = self._flight.begin(key)
+
+            if call is not None:
+                return self._stream(key, call, product_code, parameters,
+                                    tree)
+
+        status, body = self._flight.do(
+            key, self._fetch, key, self._request_body(product_code,
+                                                      parameters), ttl)
+
+        if status == 200:
+            body = self._project(body, tree)
+
+        return responses.JSONResponse(body=body, status=status)
+
+    def _stream(self, key: str, call, product_code: str,
+                parameters: dict, tree: dict) -> bottle.HTTPResponse:
+        """Returns a data product response streamed from the broker API.
+
+        Identical requests that are already waiting when the response
+        headers arrive share the relayed body, up to
+        STREAM_SHARE_MAX_BYTES. They fetch the data product themselves if
+        it is larger or isn't relayed completely. Without waiting requests
+        the body is relayed without being kept in memory.
+
+        :param key: Cache key of the request.
+        :type key: str
+        :param call: The call started for the key.
+        :type call: concurrent.futures.Future
+        :param product_code: Product code.
+        :type product_code: str
+        :param parameters: Parameters to be sent to the translator.
+        :type parameters: dict
+        :param tree: Selection tree, None for all fields.
+        :type tree: dict
+        :return: The streamed response.
+        :rtype: bottle.HTTPResponse
+        """
+        try:
+            response = self._post(
+                self._request_body(product_code, parameters), stream=True)
+        except BaseException as e:
+            self._flight.end(key, call, exception=e)
+            raise
+
+        if tree is not None and response.status_code == 200:
+            # Projected bodies aren't kept in memory to be shared.
+            self._flight.end(key, call, retry=True)
+            return self._project_response(response, tree)
+
+        if not self._flight.waiters(call):
+            # Nobody to share the body with, it is relayed as it is and
+            # identical requests arriving from now on fetch it themselves.
+            self._flight.end(key, call, retry=True)
+            return responses.ProxyResponse(
+                response, chunk_size=settings.STREAM_CHUNK_SIZE)
+
+        def complete(body: bytes):
+            if body is None:
+                self._flight.end(key, call, retry=True)
+            else:
+                self._flight.end(key, call, (
+                    response.status_code,
+                    body.decode(response.encoding or 'utf-8', 'replace')))
+
+        # The body is decoded for the waiting requests, the compression
+        # plugin encodes it for the client.
+        return responses.ProxyResponse(
+            response, chunk_size=settings.STREAM_CHUNK_SIZE, decode=True,
+            on_complete=complete, max_buffer=settings.STREAM_SHARE_MAX_BYTES)
+
+    @staticmethod
+    def _project_response(response: requests.Response,
+                          tree: dict) -> responses.JSONResponse:
+        """Returns the selected fields of a streamed broker API response.
+
+        The body is parsed while it is read, unselected fields are dropped
+        without building them in memory.
+
+        :param response: The streamed response.
+        :type response: requests.Response
+        :param tree: Selection tree.
+        :type tree: dict
+        :return: The projected response.
+        :rtype: responses.JSONResponse
+        """
+        try:
+            response.raw.decode_content = True
+            body = project_stream(response.raw, tree)
+        except ValueError:
+            return responses.JSONResponse(
+                body={'message': 'broker API returned invalid JSON'},
+                status=502
+            )
+        finally:
+            response.close()
+
+        return responses.JSONResponse(body=json.dumps(body), status=200)
+
+    def _cached(self, key: str, product_code: str, parameters: dict,
+                ttl: float) -> str:
+        """Returns the cached response of a data product request.
+
+        Stale responses are returned for up to BROKER_MAX_STALE seconds
+        after they expired, while they are refreshed in the background.
+
+        :param key: Cache key of the request.
+        :type key: str
+        :param product_code: Product code
+        :type product_code: str
+        :param parameters: Parameters to be sent to the translator.
+        :type parameters: dict
+        :param ttl: Cache TTL of the response in seconds.
+        :type ttl: float
+        :return: The response body, None if it has to be fetched.
+        :rtype: str
+        """
+        if ttl <= 0:
+            return None
+
+        if settings.BROKER_PREFETCH['enabled']:
+            self._popularity.hit(key, (product_code, parameters))
+            self._start_prefetcher()
+
+        cached, fresh = self._cache.lookup(key)
+
+        if cached is None or fresh:
+            return cached
+
+        expires_in = self._cache.expires_in(key)
+        if expires_in is None or -expires_in > settings.BROKER_MAX_STALE:
+            return None
+
+        self._refresh(key, product_code, parameters, ttl)
+
+        return cached
+
+    def _refresh(self, key: str, product_code: str, parameters: dict,
+                 ttl: float):
+        """Fetch a data product again in the background, unless it is being
+        refreshed already.
+
+        :return: None
+        :rtype: None
+        """
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                # Disk cache entries about to expire are no better than the
+                # entry being refreshed.
+                self._flight.do(
+                    key, self._fetch, key,
+                    self._request_body(product_code, parameters), ttl,
+                    min_ttl=settings.BROKER_PREFETCH['refresh_ahead'])
+            except services.UpstreamError:
+                # The stale response is served until BROKER_MAX_STALE.
+                pass
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_executor.submit(run)
+
+    def _start_prefetcher(self):
+        """Start the prefetcher thread if it isn't running yet.
+
+        :return: None
+        :rtype: None
+        """
+        if self._prefetcher is not None:
+            return
+
+        with self._refresh_lock:
+            if self._prefetcher is None:
+                self._prefetcher = threading.Thread(
+                    target=self._prefetch, name='prefetcher', daemon=True)
+                self._prefetcher.start()
+
+    def _prefetch(self):
+        """Refresh the most requested data products shortly before they
+        expire, so they are always served from the cache.
+
+        :return: None
+        :rtype: None
+        """
+        options = settings.BROKER_PREFETCH
+
+        while True:
+            time.sleep(options['interval'])
+
+            for key, (product_code, parameters), rate in \
+                    self._popularity.top(options['top_k']):
+                ttl = settings.BROKER_CACHE_TTLS.get(product_code,
+                                                     self._cache.ttl)
+
+                if rate < options['min_requests'] or ttl <= 0:
+                    continue
+
+                expires_in = self._cache.expires_in(key)
+                if expires_in is None or \
+                        expires_in < min(options['refresh_ahead'], ttl / 2):
+                    self._refresh(key, product_code, parameters, ttl)
+
+    def job(self, id: str) -> responses.JSONResponse:
+        """Returns the state of a background fetch and its result.
+
+        With a `wait` query parameter the response is delayed until the job
+        has finished, for at most `wait` seconds (long polling).
+
+        :param id: The job's ID.
+        :type id: str
+        :return: ID, state and, once done, the result of the job.
+        :rtype: responses.JSONResponse
+        """
+        job = self._jobs.get(id)
+
+        if job is None:
+            return responses.JSONResponse(
+                body={'message': 'Job not found'},
+                status=404
+            )
+
+        try:
+            wait = float(bottle.request.query.get('wait') or 0)
+        except ValueError:
+            wait = 0
+
+        wait = min(wait, settings.BROKER_JOBS['max_wait'])
+        left = deadlines.remaining()
+        if left is not None:
+            wait = min(wait, left)
+
+        if wait > 0:
+            job.wait(wait)
+
+        return responses.JSONResponse(body=self._job_body(job))
+
+    @staticmethod
+    def _prefers_async() -> bool:
+        """Returns whether the client asked for an asynchronous response.
+
+        :return: True if the Prefer header contains respond-async.
+        :rtype: bool
+        """
+        prefer = bottle.request.get_header('Prefer') or ''
+
+        return any(preference.split(';')[0].strip().lower() ==
+                   'respond-async' for preference in prefer.split(','))
+
+    def _enqueue(self, key: str, product_code: str, parameters: dict,
+                 ttl: float, tree: dict = None) -> responses.JSONResponse:
+        """Sign a data product request and fetch it in the background.
+
+        :param key: Cache key of the request.
+        :type key: str
+        :param product_code: Product code
+        :type product_code: str
+        :param parameters: Parameters to be sent to the translator.
+        :type parameters: dict
+        :param ttl: Cache TTL of the response in seconds.
+        :type ttl: float
+        :param tree: Selection tree of the returned fields.
+        :type tree: dict
+        :return: 202 with the job, 503 if too many jobs are pending.
+        :rtype: responses.JSONResponse
+        """
+        body = self._request_body(product_code, parameters)
+        signature = generate_signature(settings.ACCESS_TOKEN, body)
+
+        def run():
+            try:
+                status, text = self._flight.do(key, self._fetch, key, body,
+                                               ttl, signature)
+            except services.UpstreamError as e:
+                status, text = e.status, json.dumps({'message': str(e)})
+
+            if status == 200:
+                text = self._project(text, tree)
+
+            return self._result(product_code, status, text)
+
+        job = self._jobs.submit(run)
+
+        if job is None:
+            return responses.JSONResponse(
+                body={'message': 'Too many pending jobs'},
+                status=503,
+                headers={'Retry-After': '1'}
+            )
+
+        return responses.JSONResponse(
+            body=self._job_body(job),
+            status=202,
+            headers={
+                'Location': f'/fetch-data-product/jobs/{job.id}',
+                'Preference-Applied': 'respond-async'
+            }
+        )
+
+    @staticmethod
+    def _job_body(job: Job) -> dict:
+        """Returns the representation of a background fetch.
+
+        :return: ID, state and, once done, the result of the job.
+        :rtype: dict
+        """
+        body = {
+            'id': job.id,
+            'state': job.state
         }
 
-        access_token = settings.ACCESS_TOKEN
+        if job.state == Job.DONE:
+            body['result'] = job.result
+        elif job.state == Job.FAILED:
+            body['result'] = {'message': 'Fetching the data product failed'}
+
+        return body
+
+    @request_args(lambda fields: {
+        'products': fields.List(fields.Nested({
+            'productCode': fields.Str(required=True),
+            'parameters': fields.Dict(required=True)
+        }), required=True)
+    })
+    def fetch_many(self, args: dict) -> bottle.HTTPResponse:
+        """Returns information from many PoT translators at once.
+
+        The requests are signed in one pass and sent concurrently. Each
+        result is streamed to the client as a line of NDJSON as soon as it
+        is available, so results arrive in completion order.
+
+        :param args: The arguments passed.
+            products: List of productCode and parameters objects.
+        :type args: dict
+        :return: One line per product with its index in the request,
+            product code, status and body.
+        :rtype: responses.NDJSONResponse
+        """
+        products = args['products']
+
+        if len(products) > settings.BROKER_BULK_MAX_PRODUCTS:
+            return responses.JSONResponse(
+                body={'message': f'Too many products, max '
+                                 f'{settings.BROKER_BULK_MAX_PRODUCTS}'},
+                status=400
+            )
+
+        # The body is produced after this handler has returned, outside of
+        # the scope of the request deadline.
+        deadline = deadlines.current()
+        cached = {}
+        calls = []
+        timestamp = rfc3339()
+
+        for index, product in enumerate(products):
+            product_code = product['productCode']
+            key = self._cache_key(product_code, product['parameters'])
+            ttl = settings.BROKER_CACHE_TTLS.get(product_code,
+                                                 self._cache.ttl)
+            body = self._cached(key, product_code, product['parameters'],
+                                ttl)
+
+            if body is not None:
+                cached[index] = body
+            else:
+                calls.append((index, key, ttl, self._request_body(
+                    product_code, product['parameters'], timestamp)))
+
+        signatures = get_signer(settings.ACCESS_TOKEN).sign_many(
+            [body for _, _, _, body in calls])
+
+        def call(key, ttl, body, signature):
+            try:
+                with deadlines.scope(deadline):
+                    return self._flight.do(key, self._fetch, key, body, ttl,
+                                           signature)
+            except services.UpstreamError as e:
+                return e.status, json.dumps({'message': str(e)})
+
+        def results():
+            for index, body in cached.items():
+                yield self._result(products[index]['productCode'], 200, body,
+                                   index)
+
+            queue = iter(zip(calls, signatures))
+            pending = {}
+
+            def submit():
+                # At most BROKER_BULK_CONCURRENCY calls in flight at once.
+                item = next(queue, None)
+
+                if item is not None:
+                    (index, key, ttl, body), signature = item
+                    pending[self._executor.submit(
+                        call, key, ttl, body, signature)] = index
+
+            try:
+                for _ in range(settings.BROKER_BULK_CONCURRENCY):
+                    submit()
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        index = pending.pop(future)
+                        submit()
+                        status, body = future.result()
+
+                        yield self._result(products[index]['productCode'],
+                                           status, body, index)
+            finally:
+                # The client went away, drop the requests not sent yet.
+                for future in pending:
+                    future.cancel()
+
+        return responses.NDJSONResponse(results())
+
+    @request_args(lambda fields: {
+        'productCode': fields.Str(required=True),
+        'parameters': fields.Str(missing='{}')
+    })
+    def live(self, args: dict) -> bottle.HTTPResponse:
+        """Streams a data product as server-sent events when it changes.
+
+        All subscribers of the same product code and parameters share one
+        poller, which fetches the data product at the interval configured
+        for the product code. An event is sent when the status or body of
+        the response differs from the previous one.
+
+        :param args: The arguments passed in the query string.
+            parameters: JSON object of the parameters to be sent to the
+            translator.
+        :type args: dict
+        :param productCode: Product code
+        :type productCode: str
+        :return: Events with the status and body of the data product.
+        :rtype: responses.EventStreamResponse
+        """
+        product_code = args['productCode']
+
+        try:
+            parameters = json.loads(args['parameters'])
+        except ValueError:
+            parameters = None
+
+        if not isinstance(parameters, dict):
+            return responses.JSONResponse(
+                body={'message': 'parameters must be a JSON object'},
+                status=400
+            )
+
+        key = self._cache_key(product_code, parameters)
+        ttl = settings.BROKER_CACHE_TTLS.get(product_code, self._cache.ttl)
+
+        def poll():
+            try:
+                return self._flight.do(
+                    key, self._fetch, key,
+                    self._request_body(product_code, parameters), ttl)
+            except services.UpstreamError as e:
+                return e.status, json.dumps({'message': str(e)})
+
+        topic = self._live.subscribe(
+            key, poll, settings.BROKER_LIVE_INTERVALS.get(
+                product_code, settings.BROKER_LIVE['interval']))
+
+        if topic is None:
+            return responses.JSONResponse(
+                body={'message': 'Too many live data products'},
+                status=503
+            )
+
+        def events():
+            version = 0
+
+            try:
+                while True:
+                    latest, value = topic.wait(
+                        version, settings.BROKER_LIVE['heartbeat'])
+
+                    if latest == version:
+                        yield None
+                        continue
+
+                    version = latest
+                    status, body = value
+                    yield version, self._result(product_code, status, body)
+            finally:
+                # The client went away, the poller stops with the last one.
+                self._live.unsubscribe(topic)
+
+        return responses.EventStreamResponse(events())
+
+    @staticmethod
+    def _result(product_code: str, status: int, body: str,
+                index: int = None) -> dict:
+        """Returns one result of a bulk fetch or a live data product.
+
+        :return: Index (bulk fetches only), product code, status and body
+            of a data product.
+        :rtype: dict
+        """
+        try:
+            body = json.loads(body)
+        except ValueError:
+            pass
+
+        result = {
+            'productCode': product_code,
+            'status': status,
+            'body': body
+        }
+
+        if index is not None:
+            result['index'] = index
+
+        return result
+
+    @staticmethod
+    def _cache_key(product_code: str, parameters: dict) -> str:
+        """Returns the cache key of a data product request.
+
+        The signature payload without the timestamp is a canonical
+        representation of the request.
+
+        :return: The cache key.
+        :rtype: str
+        """
+        return get_signature_payload({
+            'productCode': product_code,
+            'parameters': parameters
+        })
+
+    def _fetch(self, key: str, body: dict, ttl: float,
+               signature: str = None, min_ttl: float = 0) -> tuple:
+        """Fetch a data product from the disk cache or the broker API and
+        cache it.
+
+        :param key: Cache key of the request.
+        :type key: str
+        :param body: Request body.
+        :type body: dict
+        :param ttl: Cache TTL of the response in seconds.
+        :type ttl: float
+        :param signature: Signature of the body, signed if not given.
+        :type signature: str
+        :param min_ttl: Ignore disk cache entries expiring sooner.
+        :type min_ttl: float
+        :return: Status code and body of the response.
+        :rtype: tuple
+        """
+        if ttl > 0 and self._disk_cache is not None:
+            value, left = self._disk_cache.get(key)
+
+            if value is not None and left > min_ttl:
+                # JSON is always UTF-8 encoded.
+                text = value.decode('utf-8')
+                self._cache.set(key, text, ttl=left, size=len(value))
+                return 200, text
+
+        response = self._post(body, signature)
+
+        if response.status_code == 200:
+            self._cache.set(key, response.text, ttl=ttl,
+                            size=len(response.content))
+
+            if ttl > 0 and self._disk_cache is not None:
+                self._disk_cache.set(key, response.content, ttl)
+
+        return response.status_code, response.text
+
+    @staticmethod
+    def _request_body(product_code: str, parameters: dict,
+                      timestamp: str = None) -> dict:
+        """Returns the body of a data product request.
+
+        :param product_code: Product code
+        :type product_code: str
+        :param parameters: Parameters to be sent to the translator.
+        :type parameters: dict
+        :param timestamp: RFC 3339 timestamp, defaults to now.
+        :type timestamp: str
+        :return: The request body.
+        :rtype: dict
+        """
+        return {
+            'timestamp': timestamp or rfc3339(),
+            'productCode': product_code,
+            'parameters': parameters
+        }
+
+    def _post(self, body: dict, signature: str = None,
+              stream: bool = False) -> requests.Response:
+        """Send a signed data product request to the broker API.
+
+        :param body: Request body.
+        :type body: dict
+        :param signature: Signature of the body, signed if not given.
+        :type signature: str
+        :param stream: Don't read the response body before returning.
+        :type stream: bool
+        :return: The broker API response.
+        :rtype: requests.Response
+        """
+        if signature is None:
+            signature = generate_signature(settings.ACCESS_TOKEN, body)
 
         headers = {
             'x-pot-app': settings.CLIENT_ID,
-            'x-pot-signature': generate_signature(access_token, json)
+            'x-pot-signature': signature
         }
 
-        response = self._broker_service.post(f'/fetch-data-product', data=json,
-                                      headers=headers)
-
-        return responses.JSONResponse(body=response.text,
-                                      status=response.status_code)
+        return self._broker_service.post(f'/fetch-data-product', data=body,
+                                         headers=headers, stream=stream)
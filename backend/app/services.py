@@ -1,12 +1,752 @@
 """
 Application services are found in this file.
 """
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from common import deadlines, metrics
+from common.admission import ConcurrencyLimiter
 import settings
 
 
+class UpstreamError(Exception):
+    """Raised when an upstream API request fails without a response."""
+    status = 502
+
+    def __init__(self, api: str, message: str):
+        super().__init__(message)
+        self.api = api
+
+
+class UpstreamTimeout(UpstreamError):
+    """Raised when an upstream API doesn't respond in time."""
+    status = 504
+
+
+class DeadlineExceeded(UpstreamTimeout):
+    """Raised without calling the upstream API when the time left for the
+    request is too short.
+    """
+
+
+class UpstreamUnavailable(UpstreamError):
+    """Raised without calling the upstream API when its circuit is open."""
+    status = 503
+
+    def __init__(self, api: str, message: str, retry_after: float = None):
+        super().__init__(api, message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    """Circuit breaker for a single upstream API.
+
+    Tracks the outcome of the latest calls. When the share of failed calls
+    crosses the threshold the circuit opens and calls fail fast. After
+    `open_seconds` a limited number of probe calls are let through
+    (half-open), a successful probe closes the circuit again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, error_threshold: float = 0.5,
+                 window: int = 20, min_calls: int = 10,
+                 open_seconds: float = 30, half_open_probes: int = 1):
+        """Initialise CircuitBreaker class.
+
+        :param name: Name of the API.
+        :type name: str
+        :param error_threshold: Share of failed calls opening the circuit.
+        :type error_threshold: float
+        :param window: Number of latest calls tracked.
+        :type window: int
+        :param min_calls: Calls needed in the window before opening.
+        :type min_calls: int
+        :param open_seconds: Seconds to fail fast before probing.
+        :type open_seconds: float
+        :param half_open_probes: Concurrent probe calls when half-open.
+        :type half_open_probes: int
+        """
+        self.name = name
+        self._error_threshold = error_threshold
+        self._min_calls = min_calls
+        self._open_seconds = open_seconds
+        self._half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0
+        self._probes = 0
+        self._rejected = 0
+        self._trips = 0
+
+    @property
+    def state(self) -> str:
+        """Returns the current state of the circuit.
+
+        :return: closed, open or half_open
+        :rtype: str
+        """
+        with self._lock:
+            if self._state == self.OPEN and self._retry_after() <= 0:
+                return self.HALF_OPEN
+
+            return self._state
+
+    def _retry_after(self) -> float:
+        """Returns the seconds left until an open circuit is probed.
+
+        :return: Seconds.
+        :rtype: float
+        """
+        return self._opened_at + self._open_seconds - time.monotonic()
+
+    def allow(self):
+        """Check whether a call may be made.
+
+        :return: None
+        :rtype: None
+        :raise UpstreamUnavailable: If the circuit is open.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+
+            if self._state == self.OPEN:
+                retry_after = self._retry_after()
+
+                if retry_after > 0:
+                    self._rejected += 1
+                    raise UpstreamUnavailable(
+                        self.name, f'{self.name} API is unavailable',
+                        retry_after=retry_after)
+
+                self._state = self.HALF_OPEN
+                self._probes = 0
+
+            if self._probes >= self._half_open_probes:
+                self._rejected += 1
+                raise UpstreamUnavailable(
+                    self.name, f'{self.name} API is unavailable',
+                    retry_after=1)
+
+            self._probes += 1
+
+    def record(self, ok: bool):
+        """Record the outcome of a call.
+
+        :param ok: Whether the call succeeded.
+        :type ok: bool
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes -= 1
+
+                if ok:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    self._failures = 0
+                else:
+                    self._open()
+
+                return
+
+            if self._state == self.OPEN:
+                return
+
+            if len(self._outcomes) == self._outcomes.maxlen:
+                self._failures -= not self._outcomes[0]
+
+            self._outcomes.append(ok)
+            self._failures += not ok
+
+            if len(self._outcomes) >= self._min_calls and \
+                    self._failures / len(self._outcomes) >= \
+                    self._error_threshold:
+                self._open()
+
+    def release(self):
+        """Record a call that ended without telling anything about the
+        health of the API, e.g. because the caller gave up.
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes -= 1
+
+    def _open(self):
+        """Open the circuit, the lock has to be held by the caller.
+
+        :return: None
+        :rtype: None
+        """
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._failures = 0
+        self._trips += 1
+
+    def stats(self) -> dict:
+        """Returns the state and counters of the circuit.
+
+        :return: State, trip and rejection counts.
+        :rtype: dict
+        """
+        return {
+            'state': self.state,
+            'trips': self._trips,
+            'rejected': self._rejected
+        }
+
+
+class Hedger(object):
+    """Sends hedged requests to a single upstream API.
+
+    If the first attempt hasn't answered after the configured percentile of
+    the recent response times, a second attempt is sent and whichever
+    answers first is used. Hedges are limited by a budget that grows by
+    `budget` for every request, so they add at most that share of load.
+    """
+
+    def __init__(self, name: str, percentile: float = 95,
+                 min_delay: float = 0.05, budget: float = 0.05,
+                 samples: int = 1000, min_samples: int = 20):
+        """Initialise Hedger class.
+
+        :param name: Name of the API.
+        :type name: str
+        :param percentile: Percentile of recent response times to wait
+            before hedging.
+        :type percentile: float
+        :param min_delay: Min seconds to wait before hedging.
+        :type min_delay: float
+        :param budget: Max share of extra requests sent as hedges.
+        :type budget: float
+        :param samples: Number of recent response times tracked.
+        :type samples: int
+        :param min_samples: Response times needed before hedging.
+        :type min_samples: int
+        """
+        self.name = name
+        self._percentile = percentile
+        self._min_delay = min_delay
+        self._budget = budget
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=samples)
+        self._recorded = 0
+        self._delay = None
+        self._tokens = 0
+
+    def _record(self, seconds: float):
+        """Record the response time of an attempt.
+
+        :param seconds: Response time.
+        :type seconds: float
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._samples.append(seconds)
+            self._recorded += 1
+
+            # Sorting the samples on every request would be too costly.
+            if self._recorded % 50 == 0 or self._delay is None and \
+                    len(self._samples) >= self._min_samples:
+                ordered = sorted(self._samples)
+                index = int(len(ordered) * self._percentile / 100)
+                self._delay = max(ordered[min(index, len(ordered) - 1)],
+                                  self._min_delay)
+
+    def _timed(self, send):
+        """Call send and record its response time.
+
+        :param send: Function sending the request.
+        :type send: callable
+        :return: HTTP response
+        :rtype: requests.Response
+        """
+        start = time.perf_counter()
+        response = send()
+        self._record(time.perf_counter() - start)
+        return response
+
+    def _spend(self) -> bool:
+        """Take a hedge from the budget, if there is one left.
+
+        :return: True if a hedge may be sent.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            return True
+
+    def send(self, send) -> requests.Response:
+        """Call send, hedging it with a second call if it is slow.
+
+        :param send: Function sending the request.
+        :type send: callable
+        :return: The first successful response.
+        :rtype: requests.Response
+        """
+        with self._lock:
+            # Cap the budget, so an idle period can't save up a burst.
+            self._tokens = min(self._tokens + self._budget, 10)
+            delay = self._delay
+
+        if delay is None:
+            # Nothing to race against yet, skip the thread hop.
+            return self._timed(send)
+
+        first = _hedge_executor().submit(self._timed, send)
+
+        if wait([first], timeout=delay).done:
+            return first.result()
+
+        if not self._spend():
+            metrics.upstream_hedges.inc((self.name, 'denied'))
+            return first.result()
+
+        second = _hedge_executor().submit(self._timed, send)
+        pending = {first, second}
+
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = done.pop()
+
+            # Wait for the other attempt if the first one to finish failed.
+            if winner.exception() is None or not pending:
+                break
+
+        for loser in pending:
+            # Attempts can't be interrupted once started, responses of the
+            # losers are released back to the connection pool.
+            if not loser.cancel():
+                loser.add_done_callback(_close_response)
+
+        metrics.upstream_hedges.inc(
+            (self.name, 'hedge_won' if winner is second else 'primary_won'))
+
+        return winner.result()
+
+
+def _close_response(future):
+    """Close the response of a finished request future.
+
+    :param future: The future.
+    :type future: concurrent.futures.Future
+    :return: None
+    :rtype: None
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _release_on_close(response: requests.Response, release):
+    """Call release once the response is closed, at most once.
+
+    :param response: The response.
+    :type response: requests.Response
+    :param release: Function to call.
+    :type release: callable
+    :return: None
+    :rtype: None
+    """
+    close = response.close
+    released = False
+
+    def close_and_release():
+        nonlocal released
+
+        try:
+            close()
+        finally:
+            if not released:
+                released = True
+                release()
+
+    response.close = close_and_release
+
+
+_hedge_executor_instance = None
+_hedge_executor_lock = threading.Lock()
+
+
+def _hedge_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool running hedged requests.
+
+    :return: The executor.
+    :rtype: ThreadPoolExecutor
+    """
+    global _hedge_executor_instance
+
+    if _hedge_executor_instance is None:
+        with _hedge_executor_lock:
+            if _hedge_executor_instance is None:
+                _hedge_executor_instance = ThreadPoolExecutor(
+                    max_workers=_hedge_workers())
+
+    return _hedge_executor_instance
+
+
+def _hedge_workers() -> int:
+    """Returns the size of the thread pool running hedged requests.
+
+    Every running attempt holds an in-flight slot of its API, so a pool as
+    large as all in-flight limits together never makes attempts wait. APIs
+    without a limit count as ASYNC_MAX_CONNECTIONS, the threads are only
+    started when they are needed.
+
+    :return: Number of threads.
+    :rtype: int
+    """
+    workers = settings.HEDGING['workers']
+
+    if workers is None:
+        workers = sum(settings.ASYNC_MAX_CONNECTIONS if limit is None
+                      else limit
+                      for limit in settings.UPSTREAM_MAX_IN_FLIGHT.values())
+
+    return workers
+
+
+class ConnectionPool(object):
+    """Keep-alive connection pool for a single upstream API.
+
+    Wraps a `requests.Session` so TCP and TLS connections are reused between
+    requests instead of being set up for every call. If the pool has been
+    idle for longer than `idle_timeout` seconds, its connections are dropped
+    before the next request, as the upstream has most likely closed them.
+    """
+
+    def __init__(self, name: str, size: int = 10, block: bool = False,
+                 idle_timeout: float = 60):
+        """Initialise ConnectionPool class.
+
+        :param name: Name of the API the pool is used for.
+        :type name: str
+        :param size: Maximum number of connections kept open per host.
+        :type size: int
+        :param block: Wait for a free connection instead of opening
+            an extra one when the pool is exhausted.
+        :type block: bool
+        :param idle_timeout: Seconds of inactivity before the pooled
+            connections are closed. 0 disables idle eviction.
+        :type idle_timeout: float
+        """
+        self.name = name
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._requests = 0
+        self._errors = 0
+        self._evictions = 0
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size,
+                                    pool_block=block)
+        self._session = requests.Session()
+        self._session.headers['Connection'] = 'keep-alive'
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request using a pooled connection.
+
+        :param method: HTTP method.
+        :type method: str
+        :param url: Full URL of the request.
+        :type url: str
+        :return: HTTP response
+        :rtype: requests.Response
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if self._idle_timeout and \
+                    now - self._last_used > self._idle_timeout:
+                # Connections checked out by other threads are not affected,
+                # they are discarded when returned to the closed pool.
+                self._session.close()
+                self._evictions += 1
+
+            self._last_used = now
+            self._requests += 1
+
+        start = time.perf_counter()
+
+        try:
+            response = self._session.request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._errors += 1
+            metrics.upstream_errors.inc((self.name,))
+            raise
+        finally:
+            metrics.upstream_request_duration.observe(
+                (self.name,), time.perf_counter() - start)
+
+        metrics.upstream_requests.inc((self.name, response.status_code))
+
+        # Streamed bodies haven't been read yet, rely on the header.
+        if kwargs.get('stream'):
+            size = int(response.headers.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        metrics.upstream_response_bytes.inc((self.name,), size)
+
+        return response
+
+    def warm_up(self, url: str, connections: int = 1,
+                timeout: float = None) -> dict:
+        """Resolve the host of a URL and open keep-alive connections to it
+        before the first request needs them.
+
+        Failures, including changes of the private urllib3 pool API used
+        here, are not raised, the connections are opened on demand then.
+
+        :param url: URL on the host to connect to.
+        :type url: str
+        :param connections: Number of connections to open, at most the size
+            of the pool.
+        :type connections: int
+        :param timeout: Connect timeout in seconds.
+        :type timeout: float
+        :return: Resolved addresses, open connections, the seconds taken
+            and the error if one occurred.
+        :rtype: dict
+        """
+        start = time.perf_counter()
+        result = {'addresses': 0, 'opened': 0}
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        opened = []
+
+        try:
+            # Fills the resolver caches of the system, if there are any.
+            result['addresses'] = len(socket.getaddrinfo(
+                parts.hostname, port, type=socket.SOCK_STREAM))
+
+            # The same connection pool and certificate settings requests
+            # uses for the URL.
+            pool = self._adapter.get_connection(url)
+            self._adapter.cert_verify(pool, url, True, None)
+
+            for _ in range(min(connections, self._size)):
+                conn = pool._get_conn()
+                opened.append(conn)
+
+                # Connections opened before are kept as they are.
+                if conn.sock is None:
+                    conn.timeout = timeout
+                    conn.connect()
+
+                result['opened'] += 1
+        except Exception as e:
+            result['error'] = str(e)
+        finally:
+            # _get_conn() and _put_conn() are private urllib3 APIs, if they
+            # change the warm-up fails but the startup doesn't.
+            for conn in opened:
+                try:
+                    pool._put_conn(conn)
+                except Exception as e:
+                    conn.close()
+                    result.setdefault('error', str(e))
+
+        with self._lock:
+            self._last_used = time.monotonic()
+
+        result['seconds'] = round(time.perf_counter() - start, 3)
+
+        return result
+
+    def stats(self) -> dict:
+        """Returns usage statistics of the pool.
+
+        :return: Request, error and connection counters.
+        :rtype: dict
+        """
+        connections = {
+            'opened': 0,
+            'idle': 0
+        }
+
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+
+            connections['opened'] += pool.num_connections
+            # Free slots in the queue are filled with None placeholders.
+            if pool.pool is not None:
+                connections['idle'] += sum(
+                    1 for conn in list(pool.pool.queue) if conn is not None)
+
+        return {
+            'requests': self._requests,
+            'errors': self._errors,
+            'idle_evictions': self._evictions,
+            'idle_seconds': round(time.monotonic() - self._last_used, 3),
+            'connections': connections
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(api: str) -> ConnectionPool:
+    """Returns the shared connection pool of an API.
+
+    Pools are created on first use, so every process gets its own pools
+    when the application is run with forked workers.
+
+    :param api: API name
+    :type api: str
+    :return: The connection pool.
+    :rtype: ConnectionPool
+    """
+    pool = _pools.get(api)
+
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(api)
+
+            if pool is None:
+                options = dict(settings.UPSTREAM_POOL_DEFAULTS)
+                options.update(settings.UPSTREAM_POOLS.get(api, {}))
+
+                pool = _pools[api] = ConnectionPool(api, **options)
+
+    return pool
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(api: str) -> CircuitBreaker:
+    """Returns the shared circuit breaker of an API.
+
+    :param api: API name
+    :type api: str
+    :return: The circuit breaker.
+    :rtype: CircuitBreaker
+    """
+    breaker = _breakers.get(api)
+
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(api)
+
+            if breaker is None:
+                breaker = _breakers[api] = CircuitBreaker(
+                    api, **settings.CIRCUIT_BREAKER)
+
+    return breaker
+
+
+def breaker_stats() -> dict:
+    """Returns the state of all created circuit breakers.
+
+    :return: Statistics by API name.
+    :rtype: dict
+    """
+    return {name: breaker.stats()
+            for name, breaker in list(_breakers.items())}
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(api: str) -> Hedger:
+    """Returns the shared hedger of an API.
+
+    :param api: API name
+    :type api: str
+    :return: The hedger.
+    :rtype: Hedger
+    """
+    hedger = _hedgers.get(api)
+
+    if hedger is None:
+        with _hedgers_lock:
+            hedger = _hedgers.get(api)
+
+            if hedger is None:
+                options = dict(settings.HEDGING)
+                del options['enabled'], options['workers']
+
+                hedger = _hedgers[api] = Hedger(api, **options)
+
+    return hedger
+
+
+_in_flight_limiters = {}
+_in_flight_limiters_lock = threading.Lock()
+
+
+def get_in_flight_limiter(api: str) -> ConcurrencyLimiter:
+    """Returns the shared in-flight request limiter of an API.
+
+    :param api: API name
+    :type api: str
+    :return: The limiter.
+    :rtype: ConcurrencyLimiter
+    """
+    limiter = _in_flight_limiters.get(api)
+
+    if limiter is None:
+        with _in_flight_limiters_lock:
+            limiter = _in_flight_limiters.get(api)
+
+            if limiter is None:
+                limiter = _in_flight_limiters[api] = ConcurrencyLimiter(
+                    f'upstream_{api}',
+                    settings.UPSTREAM_MAX_IN_FLIGHT.get(api))
+
+    return limiter
+
+
+def pool_stats() -> dict:
+    """Returns the statistics of all created connection pools.
+
+    :return: Statistics by API name.
+    :rtype: dict
+    """
+    return {name: pool.stats() for name, pool in list(_pools.items())}
+
+
 class Request(object):
-    """Handles request forwarding to LE APIs."""
+    """Handles request forwarding to LE APIs.
+
+    Requests have connect and read timeouts, failed GET requests are retried
+    with a jittered exponential backoff. Requests fail fast while the
+    circuit breaker of the API is open or when too many requests to the API
+    are in flight already.
+    """
+
+    # Responses worth retrying, other errors are returned to the caller.
+    retry_statuses = (502, 503, 504)
 
     def __init__(self, api: str):
         """Initialise Request class.
@@ -21,10 +761,28 @@ class Request(object):
             'broker': settings.BROKER_API_URL
         }
 
+        self._api = api
         self._api_url = self._apis[api]
+        self._pool = get_pool(api)
+        self._breaker = get_breaker(api)
+        self._hedger = get_hedger(api)
+        self._in_flight = get_in_flight_limiter(api)
+        self._timeout = tuple(settings.UPSTREAM_TIMEOUTS[api])
+
+    def warm_up(self, connections: int = 1) -> dict:
+        """Open keep-alive connections to the API.
+
+        :param connections: Number of connections to open.
+        :type connections: int
+        :return: Warm-up results of the connection pool.
+        :rtype: dict
+        """
+        return self._pool.warm_up(self._api_url, connections,
+                                  self._timeout[0])
 
     def get(self, path: str, headers: dict = None,
-            authorization_token: str = None) -> requests.Response:
+            authorization_token: str = None,
+            stream: bool = False, hedge: bool = False) -> requests.Response:
         """Send GET request to API.
 
         :param path: API endpoint
@@ -33,8 +791,14 @@ class Request(object):
         :type path: dict
         :param authorization_token: Authorization token
         :type authorization_token: str
+        :param stream: Don't read the response body before returning.
+        :type stream: bool
+        :param hedge: Send a second request if the first one is slow,
+            when hedging is enabled in settings.
+        :type hedge: bool
         :return: 'GET' HTTP response
         :rtype: dict
+        :raise UpstreamError: If no response was received.
         """
 
         if not headers:
@@ -43,11 +807,24 @@ class Request(object):
         if authorization_token:
             headers['Authorization'] = authorization_token
 
-        return requests.get(f'{self._api_url}{path}', headers=headers)
+        # Hedged attempts run in other threads, pass the deadline along.
+        deadline = deadlines.current()
+
+        def send():
+            return self._send('GET', path,
+                              settings.UPSTREAM_RETRIES['attempts'],
+                              deadline=deadline, headers=dict(headers),
+                              stream=stream)
+
+        if hedge and settings.HEDGING['enabled']:
+            return self._hedger.send(send)
+
+        return send()
 
     def post(self, path: str, data: dict,
              headers: dict = None,
-             authorization_token: str = None) -> requests.Response:
+             authorization_token: str = None,
+             stream: bool = False) -> requests.Response:
         """Send POST request to API.
 
         :param path: API endpoint
@@ -58,8 +835,11 @@ class Request(object):
         :type headers: dict
         :param authorization_token: Authorization token
         :type authorization_token: str
+        :param stream: Don't read the response body before returning.
+        :type stream: bool
         :return: 'POST' HTTP response
         :rtype: dict
+        :raise UpstreamError: If no response was received.
         """
 
         if not headers:
@@ -68,5 +848,140 @@ class Request(object):
         if authorization_token:
             headers['Authorization'] = authorization_token
 
-        return requests.post(f'{self._api_url}{path}', json=data,
-                             headers=headers)
+        # POST requests aren't idempotent, they are never retried.
+        return self._send('POST', path, 0, deadline=deadlines.current(),
+                          json=data, headers=headers, stream=stream)
+
+    def _send(self, method: str, path: str, retries: int,
+              deadline: float = None, **kwargs) -> requests.Response:
+        """Send a request unless too many requests to the API are in flight.
+
+        Streamed responses count as in flight until they are closed.
+
+        :param method: HTTP method.
+        :type method: str
+        :param path: API endpoint
+        :type path: str
+        :param retries: Max number of retries.
+        :type retries: int
+        :param deadline: Deadline of the incoming request.
+        :type deadline: float
+        :return: HTTP response
+        :rtype: requests.Response
+        :raise UpstreamError: If no response was received.
+        :raise UpstreamUnavailable: If too many requests are in flight.
+        """
+        if not self._in_flight.acquire():
+            metrics.upstream_rejected.inc((self._api,))
+            raise UpstreamUnavailable(
+                self._api, f'Too many {self._api} API requests in flight',
+                retry_after=1)
+
+        try:
+            response = self._send_with_retries(method, path, retries,
+                                               deadline=deadline, **kwargs)
+        except BaseException:
+            self._in_flight.release()
+            raise
+
+        if kwargs.get('stream'):
+            # The body is still being read, the request stays in flight
+            # until the response is closed.
+            _release_on_close(response, self._in_flight.release)
+        else:
+            self._in_flight.release()
+
+        return response
+
+    def _send_with_retries(self, method: str, path: str, retries: int,
+                           deadline: float = None,
+                           **kwargs) -> requests.Response:
+        """Send a request through the circuit breaker, retrying on failure.
+
+        :param method: HTTP method.
+        :type method: str
+        :param path: API endpoint
+        :type path: str
+        :param retries: Max number of retries.
+        :type retries: int
+        :param deadline: Deadline of the incoming request, the timeouts are
+            shortened to the time left.
+        :type deadline: float
+        :return: HTTP response
+        :rtype: requests.Response
+        :raise UpstreamError: If no response was received.
+        """
+        url = f'{self._api_url}{path}'
+        attempt = 0
+
+        while True:
+            timeout = self._timeout
+
+            if deadline is not None:
+                left = deadlines.remaining(deadline)
+
+                if left < settings.REQUEST_DEADLINE_MIN_BUDGET:
+                    metrics.deadline_exceeded.inc((self._api,))
+                    raise DeadlineExceeded(
+                        self._api, f'No time left for {self._api} API request')
+
+                timeout = tuple(min(t, left) for t in timeout)
+
+            self._breaker.allow()
+
+            try:
+                response = self._pool.request(method, url, timeout=timeout,
+                                              **kwargs)
+            except requests.Timeout:
+                if timeout != self._timeout:
+                    # Timed out because of the deadline, not the upstream.
+                    self._breaker.release()
+                    metrics.deadline_exceeded.inc((self._api,))
+                    raise DeadlineExceeded(
+                        self._api, f'{self._api} API request exceeded the '
+                                   f'request deadline')
+
+                self._breaker.record(False)
+                error = UpstreamTimeout(
+                    self._api, f'{self._api} API request timed out')
+            except requests.RequestException:
+                self._breaker.record(False)
+                error = UpstreamError(
+                    self._api, f'{self._api} API request failed')
+            else:
+                self._breaker.record(response.status_code < 500)
+
+                if attempt >= retries or \
+                        response.status_code not in self.retry_statuses:
+                    return response
+
+                response.close()
+                error = None
+
+            if attempt >= retries:
+                raise error
+
+            attempt += 1
+            time.sleep(random.uniform(0, min(
+                settings.UPSTREAM_RETRIES['max_backoff'],
+                settings.UPSTREAM_RETRIES['backoff'] * 2 ** attempt)))
+
+
+def warm_up(apis: tuple, connections: int = 1) -> dict:
+    """Open keep-alive connections to the upstream APIs in parallel.
+
+    :param apis: API names.
+    :type apis: tuple
+    :param connections: Number of connections to open per API.
+    :type connections: int
+    :return: Warm-up results by API name.
+    :rtype: dict
+    """
+    if not apis:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(apis)) as executor:
+        results = executor.map(
+            lambda api: Request(api).warm_up(connections), apis)
+
+        return dict(zip(apis, results))
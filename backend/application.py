@@ -1,9 +1,16 @@
 """
 Main application.
 """
-import bottle
-import routes
-import settings
+import time
+
+# Measure the startup of the process, from importing the application.
+started = time.perf_counter()
+
+import bottle  # noqa: E402
+import routes  # noqa: E402
+import settings  # noqa: E402
+from app import services  # noqa: E402
+from common import startup  # noqa: E402
 
 application = bottle.Bottle()
 application.catchall = True
@@ -13,6 +20,16 @@ bottle.debug(settings.DEBUG)
 # Set up routes for app.
 routes.setup_routing(application)
 
+startup.loaded(started)
+
+# Open the upstream connections in the background, /ready answers 503
+# until they are open.
+if settings.WARM_UP['enabled']:
+    startup.start(lambda: services.warm_up(
+        settings.WARM_UP['apis'], settings.WARM_UP['connections']))
+else:
+    startup.start()
+
 if __name__ == "__main__":
     bottle.run(
         application,
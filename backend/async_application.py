@@ -0,0 +1,56 @@
+"""
+Event loop entry point for the application.
+
+Serves the same Bottle application as `application.py`, but every request
+runs in a greenlet instead of a thread. Sockets are monkey patched, so the
+upstream calls made by `app.services.Request` yield to the event loop
+while waiting and one process can keep thousands of upstream requests in
+flight.
+"""
+from gevent import monkey
+
+# Sockets, ssl and thread locals have to be patched before bottle, requests
+# or any of the application modules are imported.
+monkey.patch_all()
+
+import bottle  # noqa: E402
+import settings  # noqa: E402
+
+# Requests don't wait for a worker thread here, split the connections
+# between the long-lived and the other routes and keep one free for the
+# exempt routes instead.
+settings.MAX_LONG_LIVED_REQUESTS = settings.ASYNC_MAX_CONNECTIONS // 2
+settings.MAX_IN_FLIGHT_REQUESTS = settings.ASYNC_MAX_CONNECTIONS - \
+    settings.MAX_LONG_LIVED_REQUESTS - 1
+
+from application import application  # noqa: E402
+
+
+class GeventServer(bottle.ServerAdapter):
+    """Bottle server adapter for the gevent WSGI server.
+
+    Concurrent connections are limited by a greenlet pool, so a flood of
+    slow requests can't exhaust the process memory.
+    """
+
+    def run(self, handler):
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+
+        server = WSGIServer(
+            (self.host, self.port),
+            handler,
+            spawn=Pool(settings.ASYNC_MAX_CONNECTIONS),
+            log=None if self.quiet else 'default',
+            **self.options
+        )
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    bottle.run(
+        application,
+        server=GeventServer,
+        host=settings.HOST,
+        port=settings.PORT
+    )
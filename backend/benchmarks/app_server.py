@@ -0,0 +1,78 @@
+"""
+Runs the application against the fake upstream.
+
+The upstream URLs in `settings` have to be replaced before the application
+modules are imported, as they are read when the routes are set up. Other
+settings can be replaced with NAME=<json value> arguments. Usage:
+
+    python -m benchmarks.app_server <upstream url> <port> [server] \\
+        [NAME=<json value> ...]
+"""
+import json
+import sys
+
+
+def main(upstream_url: str, port: int, server: str = None,
+         overrides: dict = None):
+    """Point the settings at the fake upstream and run the application.
+
+    :param upstream_url: Base URL of the fake upstream.
+    :type upstream_url: str
+    :param port: Port to listen on.
+    :type port: int
+    :param server: Bottle server backend, `gevent` for the event loop
+        entry point. Defaults to the server in settings.
+    :type server: str
+    :param overrides: Settings replaced by name.
+    :type overrides: dict
+    :return: None
+    :rtype: None
+    """
+    if server == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    import settings
+    from benchmarks import fake_upstream
+
+    settings.LOGIN_APP_API_URL = upstream_url + fake_upstream.LOGIN_API_PATH
+    settings.IDENTITY_API_URL = upstream_url + fake_upstream.IDENTITY_API_PATH
+    settings.BROKER_API_URL = upstream_url + fake_upstream.BROKER_API_PATH
+    settings.ACCESS_TOKEN = 'benchmark-access-token'
+    settings.CLIENT_ID = 'benchmark-client'
+
+    # The load generator sends every request with the same cookie, the
+    # suite would mostly measure the rate limiter otherwise.
+    settings.RATE_LIMIT = dict(settings.RATE_LIMIT, enabled=False)
+
+    # The in-flight limits of the server mode, as set by
+    # async_application.py for gevent. Bottle's threaded servers aren't
+    # bound to WORKER_THREADS.
+    if server == 'gevent':
+        settings.MAX_LONG_LIVED_REQUESTS = \
+            settings.ASYNC_MAX_CONNECTIONS // 2
+        settings.MAX_IN_FLIGHT_REQUESTS = settings.ASYNC_MAX_CONNECTIONS - \
+            settings.MAX_LONG_LIVED_REQUESTS - 1
+    else:
+        settings.MAX_LONG_LIVED_REQUESTS = None
+        settings.MAX_IN_FLIGHT_REQUESTS = None
+
+    for name, value in (overrides or {}).items():
+        setattr(settings, name, value)
+
+    import bottle
+    from application import application
+
+    if server == 'gevent':
+        from async_application import GeventServer
+        server = GeventServer
+
+    bottle.run(application, server=server or settings.SERVER,
+               host='127.0.0.1', port=port, quiet=True)
+
+
+if __name__ == '__main__':
+    options = [arg for arg in sys.argv[3:] if '=' not in arg]
+    main(sys.argv[1], int(sys.argv[2]), *options, overrides={
+        name: json.loads(value) for name, value in (
+            arg.split('=', 1) for arg in sys.argv[3:] if '=' in arg)})
@@ -0,0 +1,148 @@
+"""
+Local stand-in for the login, identity and broker APIs.
+
+Serves the endpoints the application calls with a configurable latency,
+payload size and error rate, so the application can be benchmarked without
+the `*.oftrust.net` sandbox.
+"""
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# Path prefixes of the APIs, appended to the fake upstream URL.
+LOGIN_API_PATH = '/api'
+IDENTITY_API_PATH = '/identities/v1'
+BROKER_API_PATH = '/broker/v1'
+
+
+class FakeUpstreamServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server with the fake upstream options."""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, latency: float = 0,
+                 payload_size: int = 1024, error_rate: float = 0):
+        """Initialise FakeUpstreamServer class.
+
+        :param address: Host and port to listen on.
+        :type address: tuple
+        :param latency: Seconds to wait before responding.
+        :type latency: float
+        :param payload_size: Approximate size of the response bodies in bytes.
+        :type payload_size: int
+        :param error_rate: Share of requests answered with a 500 error.
+        :type error_rate: float
+        """
+        super().__init__(address, FakeUpstreamHandler)
+        self.latency = latency
+        self.payload_size = payload_size
+        self.error_rate = error_rate
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server.
+
+        :return: The URL.
+        :rtype: str
+        """
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """Answers the login, identity and broker API requests."""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, avoid delayed ACK stalls.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == f'{LOGIN_API_PATH}/me':
+            return self._respond({
+                '@id': 'benchmark-user',
+                'name': 'Benchmark User'
+            })
+
+        if self.path.startswith(f'{IDENTITY_API_PATH}/'):
+            return self._respond({
+                '@id': self.path.rsplit('/', 1)[-1],
+                '@type': 'Identity'
+            })
+
+        self._respond({'message': 'Not found'}, status=404, wait=False)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path == f'{LOGIN_API_PATH}/exchangeToken':
+            return self._respond({
+                'access_token': 'benchmark-token',
+                'expires_in': 3600,
+                'state': body.get('state')
+            })
+
+        if self.path == f'{BROKER_API_PATH}/fetch-data-product':
+            return self._respond({
+                '@type': 'DataProduct',
+                'productCode': body.get('productCode'),
+                'parameters': body.get('parameters')
+            })
+
+        self._respond({'message': 'Not found'}, status=404, wait=False)
+
+    def _respond(self, data: dict, status: int = 200, wait: bool = True):
+        """Send a JSON response padded to the configured payload size.
+
+        :param data: Response data.
+        :type data: dict
+        :param status: HTTP status code.
+        :type status: int
+        :param wait: Apply the configured latency.
+        :type wait: bool
+        :return: None
+        :rtype: None
+        """
+        if wait and self.server.latency:
+            time.sleep(self.server.latency)
+
+        if wait and random.random() < self.server.error_rate:
+            status, data = 500, {'message': 'Fake upstream error'}
+        else:
+            data['data'] = 'x' * max(self.server.payload_size - 100, 0)
+
+        body = json.dumps(data).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host: str, port: int, latency: float = 0, payload_size: int = 1024,
+          error_rate: float = 0):
+    """Run the fake upstream until the process is stopped.
+
+    :param host: Host to listen on.
+    :type host: str
+    :param port: Port to listen on.
+    :type port: int
+    :param latency: Seconds to wait before responding.
+    :type latency: float
+    :param payload_size: Approximate size of the response bodies in bytes.
+    :type payload_size: int
+    :param error_rate: Share of requests answered with a 500 error.
+    :type error_rate: float
+    :return: None
+    :rtype: None
+    """
+    server = FakeUpstreamServer((host, port), latency=latency,
+                                payload_size=payload_size,
+                                error_rate=error_rate)
+    server.serve_forever()
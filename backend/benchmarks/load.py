@@ -0,0 +1,121 @@
+"""
+Closed-loop HTTP load generator.
+
+Every worker thread keeps one keep-alive connection open and sends the next
+request as soon as the previous one has been answered.
+"""
+import http.client
+import statistics
+import threading
+import time
+
+
+def percentile(values: list, percent: float) -> float:
+    """Returns the percentile of sorted values (nearest rank).
+
+    :param values: Sorted values.
+    :type values: list
+    :param percent: The percentile, 0-100.
+    :type percent: float
+    :return: The value, 0 if there are no values.
+    :rtype: float
+    """
+    if not values:
+        return 0
+
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def run(host: str, port: int, method: str, path, body: bytes = None,
+        headers: dict = None, concurrency: int = 10,
+        duration: float = 5) -> dict:
+    """Send requests to one route and measure the latency.
+
+    :param host: Host of the application.
+    :type host: str
+    :param port: Port of the application.
+    :type port: int
+    :param method: HTTP method.
+    :type method: str
+    :param path: Request path, or a callable returning the next path.
+    :type path: str|callable
+    :param body: Request body.
+    :type body: bytes
+    :param headers: Request headers.
+    :type headers: dict
+    :param concurrency: Number of concurrent connections.
+    :type concurrency: int
+    :param duration: Seconds to run.
+    :type duration: float
+    :return: Request counts, requests per second and latencies in ms.
+    :rtype: dict
+    """
+    latencies = []
+    statuses = {}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        own_latencies = []
+        own_statuses = {}
+        own_errors = 0
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+
+        while time.monotonic() < deadline:
+            next_path = path() if callable(path) else path
+            start = time.perf_counter()
+
+            try:
+                connection.request(method, next_path, body=body,
+                                   headers=headers or {})
+                response = connection.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                own_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection(host, port,
+                                                        timeout=30)
+                continue
+
+            own_latencies.append(time.perf_counter() - start)
+            own_statuses[response.status] = \
+                own_statuses.get(response.status, 0) + 1
+
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+
+        connection.close()
+
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+            for status, count in own_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - started
+    latencies.sort()
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'rps': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies) * 1000, 3)
+            if latencies else 0,
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3) if latencies else 0
+        }
+    }
@@ -0,0 +1,131 @@
+"""
+Microbenchmarks for the signing and OAuth state helpers in `common.utils` and
+the request body parsing of POST /fetch-data-product.
+"""
+import io
+import json
+import timeit
+
+import bottle
+from common import body, utils
+from common.cache import TTLCache
+from webargs import fields
+from webargs.bottleparser import parser
+
+SECRET = 'benchmark-secret'
+SALT = 'benchmark-salt'
+
+
+def _sample_body(parameters: int) -> dict:
+    """Returns a broker request body with the given number of parameters.
+
+    :param parameters: Number of parameters.
+    :type parameters: int
+    :return: The body.
+    :rtype: dict
+    """
+    return {
+        'timestamp': utils.rfc3339(),
+        'productCode': 'benchmark-product',
+        'parameters': {f'parameter-{i}': i for i in range(parameters)}
+    }
+
+
+def _body_parser(parse, data: bytes):
+    """Returns a function parsing the body of a fresh request.
+
+    :param parse: Function parsing `bottle.request`.
+    :type parse: callable
+    :param data: The request body.
+    :type data: bytes
+    :return: The function to time.
+    :rtype: callable
+    """
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(data))
+    }
+
+    def run():
+        bottle.request.bind(dict(environ, **{'wsgi.input': io.BytesIO(data)}))
+        return parse()
+
+    return run
+
+
+def _measure(func, number: int) -> dict:
+    """Time a function, best of three runs.
+
+    :param func: The function to time.
+    :type func: callable
+    :param number: Calls per run.
+    :type number: int
+    :return: Microseconds per call and calls per second.
+    :rtype: dict
+    """
+    best = min(timeit.repeat(func, number=number, repeat=3))
+
+    return {
+        'us_per_op': round(best / number * 1e6, 3),
+        'ops_per_sec': round(number / best, 1)
+    }
+
+
+def run(number: int = 10000) -> dict:
+    """Run the microbenchmarks.
+
+    :param number: Calls per benchmark run.
+    :type number: int
+    :return: Results by benchmark name.
+    :rtype: dict
+    """
+    small = _sample_body(3)
+    large = _sample_body(500)
+    bodies = [_sample_body(3) for _ in range(100)]
+    signer = utils.get_signer(SECRET)
+    state = utils.generate_state(SALT)
+    nonces = TTLCache('benchmark_nonces', maxsize=number * 4, ttl=60)
+
+    webargs_args = {
+        'productCode': fields.Str(required=True),
+        'parameters': fields.Dict(required=True)
+    }
+    validate = body.compile_schema({'productCode': str, 'parameters': dict})
+    limits = {'max_bytes': 1024 * 1024, 'max_depth': 16, 'max_keys': 10000}
+    small_body = json.dumps(small).encode('utf-8')
+    large_body = json.dumps(large).encode('utf-8')
+
+    def parse_webargs():
+        return parser.parse(webargs_args, bottle.request)
+
+    def parse_bounded():
+        return validate(body.read_json(bottle.request, **limits))
+
+    return {
+        'get_signature_payload_small': _measure(
+            lambda: utils.get_signature_payload(small), number),
+        'get_signature_payload_large': _measure(
+            lambda: utils.get_signature_payload(large), number // 100),
+        'generate_signature_small': _measure(
+            lambda: utils.generate_signature(SECRET, small), number),
+        'generate_signature_large': _measure(
+            lambda: utils.generate_signature(SECRET, large), number // 100),
+        'signer_sign_many_100': _measure(
+            lambda: signer.sign_many(bodies), number // 100),
+        'generate_state': _measure(
+            lambda: utils.generate_state(SALT), number),
+        'validate_state': _measure(
+            lambda: utils.validate_state(state, SALT, 60), number),
+        'validate_state_with_nonce_store': _measure(
+            lambda: utils.validate_state(utils.generate_state(SALT), SALT,
+                                         60, nonce_store=nonces), number),
+        'parse_body_webargs_small': _measure(
+            _body_parser(parse_webargs, small_body), number),
+        'parse_body_bounded_small': _measure(
+            _body_parser(parse_bounded, small_body), number),
+        'parse_body_webargs_large': _measure(
+            _body_parser(parse_webargs, large_body), number // 100),
+        'parse_body_bounded_large': _measure(
+            _body_parser(parse_bounded, large_body), number // 100),
+    }
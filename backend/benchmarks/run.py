@@ -0,0 +1,206 @@
+"""
+Runs the benchmark suite and writes the results as JSON.
+
+Starts the fake upstream and the application in their own processes, drives
+the routes with the load generator and runs the microbenchmarks. Usage:
+
+    python -m benchmarks.run --help
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks import fake_upstream, load, micro
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = BACKEND_DIR / 'benchmarks' / 'results'
+COOKIE = 'Authorization=benchmark-token'
+
+
+def free_port() -> int:
+    """Returns a free local TCP port.
+
+    :return: The port.
+    :rtype: int
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process=None, timeout: float = 30):
+    """Wait until a local TCP port accepts connections.
+
+    :param port: The port.
+    :type port: int
+    :param process: Process expected to open the port.
+    :type process: subprocess.Popen|multiprocessing.Process
+    :param timeout: Seconds to wait.
+    :type timeout: float
+    :return: None
+    :rtype: None
+    :raise RuntimeError: If the port isn't opened in time.
+    """
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if process is not None and (
+                process.poll() is not None if hasattr(process, 'poll')
+                else not process.is_alive()):
+            raise RuntimeError(f'Process for port {port} exited')
+
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+    raise RuntimeError(f'Nothing is listening on port {port}')
+
+
+def git_commit() -> str:
+    """Returns the current git commit, if available.
+
+    :return: The commit hash or an empty string.
+    :rtype: str
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=str(BACKEND_DIR),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def routes(identities: int) -> dict:
+    """Returns the load generator arguments of the benchmarked routes.
+
+    :param identities: Number of distinct identity IDs requested.
+    :type identities: int
+    :return: Arguments by route name.
+    :rtype: dict
+    """
+    counter = iter(range(sys.maxsize))
+
+    def identity_path():
+        return f'/identities/identity-{next(counter) % identities}'
+
+    return {
+        'health': {'method': 'GET', 'path': '/health'},
+        'me': {
+            'method': 'GET',
+            'path': '/me',
+            'headers': {'Cookie': COOKIE}
+        },
+        'identity': {
+            'method': 'GET',
+            'path': identity_path,
+            'headers': {'Cookie': COOKIE}
+        },
+        'fetch_data_product': {
+            'method': 'POST',
+            'path': '/fetch-data-product',
+            'body': json.dumps({
+                'productCode': 'benchmark-product',
+                'parameters': {'id': 'benchmark'}
+            }).encode(),
+            'headers': {'Content-Type': 'application/json'}
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--server', default=None,
+                        help='Bottle server backend or "gevent", '
+                             'defaults to settings.SERVER')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='fake upstream latency in seconds')
+    parser.add_argument('--payload-size', type=int, default=1024,
+                        help='fake upstream response size in bytes')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of failing fake upstream requests')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='concurrent connections per route')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds to load each route')
+    parser.add_argument('--identities', type=int, default=1000,
+                        help='distinct identity IDs requested')
+    parser.add_argument('--routes', nargs='*',
+                        help='routes to benchmark, defaults to all')
+    parser.add_argument('--skip-micro', action='store_true',
+                        help="don't run the microbenchmarks")
+    parser.add_argument('--output', help='result file, defaults to '
+                                         'benchmarks/results/<time>.json')
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    app_port = free_port()
+
+    upstream = multiprocessing.Process(
+        target=fake_upstream.serve,
+        args=('127.0.0.1', upstream_port, args.latency, args.payload_size,
+              args.error_rate),
+        daemon=True
+    )
+    upstream.start()
+
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.app_server',
+         f'http://127.0.0.1:{upstream_port}', str(app_port)] +
+        ([args.server] if args.server else []),
+        cwd=str(BACKEND_DIR)
+    )
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'options': vars(args)
+        },
+        'routes': {},
+        'micro': {}
+    }
+
+    try:
+        wait_for_port(upstream_port, upstream)
+        wait_for_port(app_port, app)
+
+        for name, options in routes(args.identities).items():
+            if args.routes and name not in args.routes:
+                continue
+
+            print(f'Benchmarking {name}...', file=sys.stderr)
+            results['routes'][name] = load.run(
+                '127.0.0.1', app_port, concurrency=args.concurrency,
+                duration=args.duration, **options)
+    finally:
+        app.terminate()
+        app.wait()
+        upstream.terminate()
+
+    if not args.skip_micro:
+        print('Running microbenchmarks...', file=sys.stderr)
+        results['micro'] = micro.run()
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    print(json.dumps(results, indent=2))
+    print(f'Results written to {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
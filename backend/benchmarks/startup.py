@@ -0,0 +1,207 @@
+"""
+Startup benchmarks.
+
+Starts the application against the fake upstream in a new process for
+every startup mode and measures the time until it listens and until /ready
+reports it as ready, then the latency of the first and second request of
+every route. Usage:
+
+    python -m benchmarks.startup --help
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import subprocess
+import sys
+import time
+
+from benchmarks import fake_upstream
+from benchmarks.run import BACKEND_DIR, free_port, routes, wait_for_port
+
+# Settings of the compared startup modes.
+MODES = {
+    'eager': {
+        'LAZY_CONTROLLERS': False,
+        'WARM_UP': {'enabled': False}
+    },
+    'lazy': {
+        'LAZY_CONTROLLERS': True,
+        'WARM_UP': {'enabled': False}
+    },
+    'lazy_warm_up': {
+        'LAZY_CONTROLLERS': True,
+        'WARM_UP': {
+            'enabled': True,
+            'apis': ['login', 'identity', 'broker'],
+            'connections': 2
+        }
+    }
+}
+
+
+def request(port: int, method: str, path: str, body: bytes = None,
+            headers: dict = None) -> tuple:
+    """Send one request on a new connection.
+
+    :param port: Port of the application.
+    :type port: int
+    :param method: HTTP method.
+    :type method: str
+    :param path: Request path.
+    :type path: str
+    :param body: Request body.
+    :type body: bytes
+    :param headers: Request headers.
+    :type headers: dict
+    :return: The status, body and latency in ms.
+    :rtype: tuple
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    start = time.perf_counter()
+
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+
+    return (response.status, data,
+            round((time.perf_counter() - start) * 1000, 3))
+
+
+def wait_ready(port: int, timeout: float = 30) -> dict:
+    """Wait until /ready answers 200.
+
+    :param port: Port of the application.
+    :type port: int
+    :param timeout: Seconds to wait.
+    :type timeout: float
+    :return: The startup statistics reported by /ready.
+    :rtype: dict
+    :raise RuntimeError: If the application isn't ready in time.
+    """
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        status, data, _ = request(port, 'GET', '/ready')
+
+        if status == 200:
+            return json.loads(data.decode('utf-8'))
+
+        time.sleep(0.01)
+
+    raise RuntimeError('The application did not become ready')
+
+
+def measure(upstream_url: str, overrides: dict, server: str = None) -> dict:
+    """Start the application once and measure its startup.
+
+    :param upstream_url: Base URL of the fake upstream.
+    :type upstream_url: str
+    :param overrides: Settings replaced by name.
+    :type overrides: dict
+    :param server: Bottle server backend or "gevent".
+    :type server: str
+    :return: Seconds until listening and ready, the startup statistics
+        of the application and the first and second request latencies in
+        ms by route.
+    :rtype: dict
+    """
+    port = free_port()
+    start = time.perf_counter()
+    app = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.app_server', upstream_url,
+         str(port)] + ([server] if server else []) +
+        [f'{name}={json.dumps(value)}' for name, value in overrides.items()],
+        cwd=str(BACKEND_DIR)
+    )
+
+    try:
+        wait_for_port(port, app)
+        listening = time.perf_counter() - start
+        stats = wait_ready(port)
+        ready = time.perf_counter() - start
+
+        requests = {}
+        for name, options in routes(1).items():
+            path = options['path']
+            path = path() if callable(path) else path
+            latencies = [request(port, options['method'], path,
+                                 options.get('body'),
+                                 options.get('headers'))[2]
+                         for _ in range(2)]
+
+            requests[name] = {
+                'first_ms': latencies[0],
+                'second_ms': latencies[1]
+            }
+    finally:
+        app.terminate()
+        app.wait()
+
+    return {
+        'listening_seconds': round(listening, 3),
+        'ready_seconds': round(ready, 3),
+        'load_seconds': stats['load_seconds'],
+        'warm_up_seconds': stats['warm_up_seconds'],
+        'requests': requests
+    }
+
+
+def run(upstream_url: str, server: str = None, repeat: int = 3) -> dict:
+    """Measure the startup of every mode.
+
+    :param upstream_url: Base URL of the fake upstream.
+    :type upstream_url: str
+    :param server: Bottle server backend or "gevent".
+    :type server: str
+    :param repeat: Number of starts per mode, the fastest start is kept.
+    :type repeat: int
+    :return: Startup measurements by mode name.
+    :rtype: dict
+    """
+    results = {}
+
+    for name, overrides in MODES.items():
+        print(f'Measuring {name} startup...', file=sys.stderr)
+        results[name] = min(
+            (measure(upstream_url, overrides, server)
+             for _ in range(repeat)),
+            key=lambda result: result['ready_seconds'])
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--server', default=None,
+                        help='Bottle server backend or "gevent", '
+                             'defaults to settings.SERVER')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='fake upstream latency in seconds')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='starts per mode, the fastest one is reported')
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream = multiprocessing.Process(
+        target=fake_upstream.serve,
+        args=('127.0.0.1', upstream_port, args.latency),
+        daemon=True
+    )
+    upstream.start()
+
+    try:
+        wait_for_port(upstream_port, upstream)
+        results = run(f'http://127.0.0.1:{upstream_port}', args.server,
+                      args.repeat)
+    finally:
+        upstream.terminate()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""
+Admission control is defined in this file.
+
+Every client gets a token bucket, requests are rejected with 429 right away
+when the bucket of the client is empty instead of being queued behind the
+requests of other clients. Requests above the in-flight limit of the process
+are rejected with 503, so the exempt routes, e.g. the health check, always
+find a free worker. Long-lived requests have an in-flight limit of their
+own.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import bottle
+import settings
+import common.responses as responses
+from common import metrics
+from common.utils import hash_token
+
+_limiters = {}
+
+
+class RateLimiter(object):
+    """Thread-safe token bucket rate limiter per key.
+
+    Buckets refill at `rate` tokens per second up to `burst` tokens. The
+    number of tracked keys is bounded, the least recently seen keys are
+    forgotten first, which gives them a full bucket if they come back.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float,
+                 maxsize: int = 10000):
+        """Initialise RateLimiter class.
+
+        :param name: Name of the limiter, used for reporting statistics.
+        :type name: str
+        :param rate: Tokens added per second.
+        :type rate: float
+        :param burst: Max tokens of a bucket.
+        :type burst: float
+        :param maxsize: Max number of tracked keys.
+        :type maxsize: int
+        """
+        self.name = name
+        self._rate = rate
+        self._burst = burst
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._allowed = 0
+        self._rejected = 0
+
+        _limiters[name] = self
+
+    def acquire(self, key) -> float:
+        """Take a token from the bucket of the key.
+
+        :param key: Key of the bucket, e.g. the client.
+        :type key: hashable
+        :return: 0 if a token was taken, otherwise the seconds until the
+            next token is available.
+        :rtype: float
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self._burst, now))
+            tokens = min(self._burst, tokens + (now - updated) * self._rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+                self._allowed += 1
+            else:
+                wait = (1 - tokens) / self._rate
+                self._rejected += 1
+
+            self._buckets[key] = (tokens, now)
+
+            if len(self._buckets) > self._maxsize:
+                self._buckets.popitem(last=False)
+
+        return wait
+
+    def stats(self) -> dict:
+        """Returns usage statistics of the limiter.
+
+        :return: Tracked keys and allowed/rejected counters.
+        :rtype: dict
+        """
+        return {
+            'clients': len(self._buckets),
+            'allowed': self._allowed,
+            'rejected': self._rejected
+        }
+
+
+class ConcurrencyLimiter(object):
+    """Thread-safe limit of the calls in progress at once.
+
+    Calls above the limit are rejected instead of waiting for a free slot.
+    """
+
+    def __init__(self, name: str, limit: int = None):
+        """Initialise ConcurrencyLimiter class.
+
+        :param name: Name of the limiter, used for reporting statistics.
+        :type name: str
+        :param limit: Max calls in progress, None for no limit.
+        :type limit: int
+        """
+        self.name = name
+        self._limit = limit
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+
+        _limiters[name] = self
+
+    def acquire(self) -> bool:
+        """Take a slot unless the limit has been reached.
+
+        :return: False if all slots are taken.
+        :rtype: bool
+        """
+        with self._lock:
+            if self._limit is not None and self._in_flight >= self._limit:
+                self._rejected += 1
+                return False
+
+            self._in_flight += 1
+
+        return True
+
+    def release(self):
+        """Give back a slot taken with acquire.
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self) -> dict:
+        """Returns usage statistics of the limiter.
+
+        :return: Calls in progress, the limit and the rejected calls.
+        :rtype: dict
+        """
+        return {
+            'in_flight': self._in_flight,
+            'limit': self._limit,
+            'rejected': self._rejected
+        }
+
+
+def limiter_stats() -> dict:
+    """Returns the statistics of all rate and concurrency limiters.
+
+    :return: Statistics by limiter name.
+    :rtype: dict
+    """
+    return {name: limiter.stats()
+            for name, limiter in list(_limiters.items())}
+
+
+def client_key() -> str:
+    """Returns the key identifying the client of the current request.
+
+    Clients are told apart by their Authorization cookie, anonymous clients
+    by their IP address.
+
+    :return: The key.
+    :rtype: str
+    """
+    token = bottle.request.get_cookie('Authorization')
+
+    if token:
+        return hash_token(token)
+
+    return bottle.request.remote_addr or ''
+
+
+class AdmissionPlugin(object):
+    """Bottle plugin rejecting requests right away when the process is
+    handling too many requests already (503) or when the client exceeds its
+    rate limit (429), with a Retry-After header.
+
+    Exempt routes, e.g. the health check, are not wrapped at all.
+    Long-lived routes, e.g. server-sent events, are limited separately, so
+    they can't take the slots of the other requests.
+    """
+    name = 'admission'
+    api = 2
+
+    def __init__(self):
+        options = settings.RATE_LIMIT
+        self._limiter = RateLimiter('clients', options['rate'],
+                                    options['burst'], options['maxsize'])
+        self._requests = ConcurrencyLimiter(
+            'requests', settings.MAX_IN_FLIGHT_REQUESTS)
+        self._long_lived = ConcurrencyLimiter(
+            'long_lived_requests', settings.MAX_LONG_LIVED_REQUESTS)
+
+    def apply(self, callback, route):
+        if route.rule in settings.ADMISSION_EXEMPT_ROUTES:
+            return callback
+
+        rule = route.rule
+        in_flight = self._long_lived \
+            if rule in settings.LONG_LIVED_ROUTES else self._requests
+
+        def wrapper(*args, **kwargs):
+            if not in_flight.acquire():
+                metrics.requests_rejected.inc((rule, 'overloaded'))
+
+                return responses.JSONResponse(
+                    body={'message': 'Server is busy'},
+                    status=503,
+                    headers={'Retry-After': '1'}
+                )
+
+            try:
+                wait = self._limiter.acquire(client_key()) \
+                    if settings.RATE_LIMIT['enabled'] else 0
+
+                if wait:
+                    metrics.requests_rejected.inc((rule, 'rate_limited'))
+
+                    rv = responses.JSONResponse(
+                        body={'message': 'Too many requests'},
+                        status=429,
+                        headers={'Retry-After': str(math.ceil(wait))}
+                    )
+                else:
+                    rv = callback(*args, **kwargs)
+            except BaseException:
+                in_flight.release()
+                raise
+
+            # Streamed bodies keep their worker busy until they are sent.
+            if isinstance(rv, bottle.HTTPResponse) and _streamed(rv.body):
+                rv.body = _ReleasingBody(rv.body, in_flight.release)
+            else:
+                in_flight.release()
+
+            return rv
+
+        return wrapper
+
+
+def _streamed(body) -> bool:
+    """Returns whether a response body is sent after the callback returns.
+
+    :param body: The response body.
+    :type body: object
+    :return: Whether the body is an iterable produced while it is sent.
+    :rtype: bool
+    """
+    return hasattr(body, '__iter__') and not isinstance(
+        body, (str, bytes, bytearray, dict, list, tuple))
+
+
+class _ReleasingBody(object):
+    """Streamed response body giving back the in-flight slot of its request
+    once it has been sent, or closed because the client went away.
+    """
+
+    def __init__(self, body, release):
+        self._body = body
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        try:
+            yield from self._body
+        finally:
+            self.close()
+
+    def close(self):
+        if self._released:
+            return
+
+        self._released = True
+
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._release()
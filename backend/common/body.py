@@ -0,0 +1,324 @@
+"""
+Bounded JSON request body parsing is defined in this file.
+
+The body is read in chunks and scanned while it is read, so oversized and
+too deeply nested or too large documents are rejected before the rest of
+the body is read. The scanned body is parsed once and validated against a
+schema compiled when the route is set up.
+"""
+import functools
+import json
+import re
+
+import bottle
+import settings
+
+CHUNK_SIZE = 16 * 1024
+
+# Complete strings, the rest of a string continued from the previous chunk
+# and the brackets changing the nesting depth.
+_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+_STRING_END = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"')
+_BRACKETS = re.compile(rb'[{}\[\]]')
+
+_TYPE_ERRORS = {
+    str: 'Not a valid string.',
+    dict: 'Not a valid mapping type.',
+    list: 'Not a valid list.',
+    bool: 'Not a valid boolean.'
+}
+
+
+class BodyError(Exception):
+    """Raised when a request body is rejected."""
+
+    def __init__(self, status: int, message: str, errors: dict = None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+
+
+class InvalidJSONError(BodyError):
+    """Raised when a request body isn't valid JSON."""
+
+
+class _Scanner(object):
+    """Tracks the nesting depth and number of keys of a JSON document fed
+    in chunks.
+    """
+
+    def __init__(self, max_depth: int, max_keys: int):
+        self._max_depth = max_depth
+        self._max_keys = max_keys
+        self._depth = 0
+        self._keys = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: bytes):
+        """Scan the next chunk of the document.
+
+        :param chunk: The chunk.
+        :type chunk: bytes
+        :return: None
+        :rtype: None
+        :raise BodyError: If a limit is exceeded.
+        """
+        if not chunk:
+            return
+
+        if self._escaped:
+            # The escaped character is the first one of this chunk.
+            self._escaped = False
+            chunk = chunk[1:]
+
+        if self._in_string:
+            match = _STRING_END.match(chunk)
+            if match is None:
+                self._escaped = self._ends_escaped(chunk)
+                return
+
+            self._in_string = False
+            chunk = chunk[match.end():]
+
+        # Strings are removed in one pass, what is left of a string running
+        # into the next chunk starts at the first remaining quote.
+        structure = _STRING.sub(b'', chunk)
+        start = structure.find(b'"')
+
+        if start >= 0:
+            structure = structure[:start]
+            self._in_string = True
+            self._escaped = self._ends_escaped(chunk)
+
+        self._keys += structure.count(b':')
+        if self._keys > self._max_keys:
+            raise BodyError(400, f'Request body has more than '
+                                 f'{self._max_keys} keys')
+
+        opened = structure.count(b'{') + structure.count(b'[')
+
+        if self._depth + opened > self._max_depth:
+            # Only follow the brackets in order if the limit can be hit.
+            for match in _BRACKETS.finditer(structure):
+                if match.group() in (b'{', b'['):
+                    self._depth += 1
+
+                    if self._depth > self._max_depth:
+                        raise BodyError(400, f'Request body is nested deeper '
+                                             f'than {self._max_depth} levels')
+                else:
+                    self._depth -= 1
+        else:
+            self._depth += opened - structure.count(b'}') - \
+                structure.count(b']')
+
+    @staticmethod
+    def _ends_escaped(chunk: bytes) -> bool:
+        """Returns whether a chunk ending inside of a string ends with an
+        unescaped backslash.
+        """
+        return (len(chunk) - len(chunk.rstrip(b'\\'))) % 2 == 1
+
+
+def _iter_length(stream, length: int):
+    """Yields the parts of a request body of a known length.
+
+    :return: Generator of body parts.
+    :rtype: generator
+    """
+    while length > 0:
+        part = stream.read(min(CHUNK_SIZE, length))
+        if not part:
+            return
+
+        length -= len(part)
+        yield part
+
+
+def _iter_until_eof(stream, max_bytes: int):
+    """Yields the parts of a request body ended by the server.
+
+    :return: Generator of body parts.
+    :rtype: generator
+    :raise BodyError: If the body is larger than max_bytes.
+    """
+    size = 0
+
+    while True:
+        # One byte more than allowed tells an oversized body apart.
+        part = stream.read(min(CHUNK_SIZE, max_bytes + 1 - size))
+        if not part:
+            return
+
+        size += len(part)
+        if size > max_bytes:
+            raise BodyError(
+                413, f'Request body is larger than {max_bytes} bytes')
+
+        yield part
+
+
+def _iter_chunked(stream, max_bytes: int):
+    """Yields the decoded parts of a chunked request body.
+
+    :return: Generator of body parts.
+    :rtype: generator
+    :raise BodyError: If the body is larger than max_bytes or isn't
+        chunked correctly.
+    """
+    invalid = BodyError(400, 'Request body is not chunked correctly')
+    size = 0
+
+    while True:
+        line = stream.readline(1024)
+        if not line.endswith(b'\n'):
+            raise invalid
+
+        try:
+            length = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise invalid
+
+        if length == 0:
+            # Skip the trailer fields.
+            while stream.readline(1024).strip():
+                pass
+
+            return
+
+        size += length
+        if size > max_bytes:
+            raise BodyError(
+                413, f'Request body is larger than {max_bytes} bytes')
+
+        for part in _iter_length(stream, length):
+            length -= len(part)
+            yield part
+
+        if length or stream.read(2) != b'\r\n':
+            raise invalid
+
+
+def read_json(request: bottle.BaseRequest, max_bytes: int, max_depth: int,
+              max_keys: int):
+    """Read and parse the JSON body of a request within limits.
+
+    :param request: The request.
+    :type request: bottle.BaseRequest
+    :param max_bytes: Max size of the body.
+    :type max_bytes: int
+    :param max_depth: Max nesting depth of objects and arrays.
+    :type max_depth: int
+    :param max_keys: Max number of object keys in the whole document.
+    :type max_keys: int
+    :return: The parsed body.
+    :rtype: object
+    :raise BodyError: If the body is too large, InvalidJSONError if it isn't
+        valid JSON.
+    """
+    length = request.content_length
+
+    if length > max_bytes:
+        raise BodyError(413, f'Request body is larger than {max_bytes} bytes')
+
+    stream = request.environ['wsgi.input']
+
+    if request.environ.get('wsgi.input_terminated'):
+        # The server has decoded the body already, e.g. a chunked one, and
+        # ends the input after it.
+        parts = _iter_until_eof(stream, max_bytes)
+    elif 'chunked' in request.environ.get(
+            'HTTP_TRANSFER_ENCODING', '').lower():
+        parts = _iter_chunked(stream, max_bytes)
+    else:
+        parts = _iter_length(stream, length)
+
+    scanner = _Scanner(max_depth, max_keys)
+    chunks = []
+
+    for part in parts:
+        scanner.feed(part)
+        chunks.append(part)
+
+    try:
+        return json.loads(b''.join(chunks).decode('utf-8'))
+    except ValueError:
+        raise InvalidJSONError(400, 'Request body is not valid JSON')
+
+
+def compile_schema(schema: dict):
+    """Returns a validator for JSON objects with the given required fields.
+
+    :param schema: Type of each required field by name.
+    :type schema: dict
+    :return: Function returning the fields of a parsed body, raising
+        BodyError with the errors by field name if the body is invalid. A
+        body that isn't an object is missing all fields, like in webargs.
+    :rtype: callable
+    """
+    fields = tuple((name, type_, _TYPE_ERRORS.get(
+        type_, f'Not a valid {type_.__name__}.'))
+        for name, type_ in schema.items())
+
+    def validate(body) -> dict:
+        if not isinstance(body, dict):
+            body = {}
+
+        args = {}
+        errors = {}
+
+        for name, type_, type_error in fields:
+            value = body.get(name)
+
+            if value is None:
+                errors[name] = ['Missing data for required field.']
+            elif not isinstance(value, type_):
+                errors[name] = [type_error]
+            else:
+                args[name] = value
+
+        if errors:
+            raise BodyError(422, 'Invalid request body', errors)
+
+        return args
+
+    return validate
+
+
+def json_args(schema: dict):
+    """Route decorator passing the validated fields of the JSON request body
+    to the callback as its first argument, like `webargs.use_args`.
+
+    Invalid bodies are answered like webargs does, with a 422 error of the
+    messages by field name, and a body that isn't valid JSON is missing all
+    fields. Bodies over the limits configured in settings.REQUEST_BODY_LIMITS
+    are answered with a 400 or 413 error.
+
+    :param schema: Type of each required field by name.
+    :type schema: dict
+    :return: The decorator.
+    :rtype: callable
+    """
+    validate = compile_schema(schema)
+
+    def decorator(callback):
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            try:
+                try:
+                    body = read_json(
+                        bottle.request, **settings.REQUEST_BODY_LIMITS)
+                except InvalidJSONError:
+                    body = None
+
+                body_args = validate(body)
+            except BodyError as e:
+                raise bottle.HTTPError(status=e.status,
+                                       body=e.errors or str(e), exception=e)
+
+            return callback(body_args, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
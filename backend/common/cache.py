@@ -0,0 +1,704 @@
+"""
+In-process and on-disk caches are defined in this file.
+"""
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+
+from common import deadlines
+
+_caches = {}
+_flights = {}
+
+
+class TTLCache(object):
+    """Thread-safe cache with a TTL per entry and LRU eviction.
+
+    The cache is bounded both by the number of entries and by the total size
+    of the entries. Expired entries are kept until evicted, so they can still
+    be looked up and revalidated against the upstream.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 60,
+                 max_bytes: int = None):
+        """Initialise TTLCache class.
+
+        :param name: Name of the cache, used for reporting statistics.
+        :type name: str
+        :param maxsize: Max number of entries.
+        :type maxsize: int
+        :param ttl: Default time to live of the entries in seconds.
+        :type ttl: float
+        :param max_bytes: Max total size of the entries, None for no limit.
+        :type max_bytes: int
+        """
+        self.name = name
+        self.ttl = ttl
+        self._maxsize = maxsize
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._refreshes = 0
+
+        _caches[name] = self
+
+    def lookup(self, key) -> tuple:
+        """Returns the cached value and whether it is still fresh.
+
+        :param key: Cache key.
+        :type key: hashable
+        :return: Tuple of the value (None on a miss) and freshness.
+        :rtype: tuple
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                self._misses += 1
+                return None, False
+
+            self._data.move_to_end(key)
+            value, expires, size = entry
+
+            if expires > now:
+                self._hits += 1
+                return value, True
+
+            self._stale_hits += 1
+            return value, False
+
+    def get(self, key):
+        """Returns the cached value if it is fresh.
+
+        :param key: Cache key.
+        :type key: hashable
+        :return: The value or None.
+        :rtype: object
+        """
+        value, fresh = self.lookup(key)
+        return value if fresh else None
+
+    def expires_in(self, key) -> float:
+        """Returns the seconds until an entry expires, without counting it
+        as a lookup.
+
+        :param key: Cache key.
+        :type key: hashable
+        :return: Seconds left, negative if the entry is stale, None if there
+            is no entry.
+        :rtype: float
+        """
+        with self._lock:
+            entry = self._data.get(key)
+
+        if entry is None:
+            return None
+
+        return entry[1] - time.monotonic()
+
+    def set(self, key, value, ttl: float = None, size: int = 0) -> bool:
+        """Store a value, evicting least recently used entries if needed.
+
+        :param key: Cache key.
+        :type key: hashable
+        :param value: The value to cache.
+        :type value: object
+        :param ttl: Time to live in seconds, defaults to the cache TTL.
+        :type ttl: float
+        :param size: Size of the value in bytes.
+        :type size: int
+        :return: False if the value is too large to be cached.
+        :rtype: bool
+        """
+        with self._lock:
+            return self._set(key, value, ttl, size)
+
+    def _set(self, key, value, ttl: float, size: int) -> bool:
+        """Store a value, the lock has to be held by the caller.
+
+        :return: False if the value is too large to be cached.
+        :rtype: bool
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        if ttl <= 0 or self._max_bytes is not None and size > self._max_bytes:
+            return False
+
+        old = self._data.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+
+        self._data[key] = (value, time.monotonic() + ttl, size)
+        self._bytes += size
+
+        while len(self._data) > self._maxsize or \
+                self._max_bytes is not None and \
+                self._bytes > self._max_bytes:
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self._evictions += 1
+
+        return True
+
+    def add(self, key, value, ttl: float = None, size: int = 0) -> bool:
+        """Store a value unless a fresh entry already exists for the key.
+
+        :param key: Cache key.
+        :type key: hashable
+        :param value: The value to cache.
+        :type value: object
+        :param ttl: Time to live in seconds, defaults to the cache TTL.
+        :type ttl: float
+        :param size: Size of the value in bytes.
+        :type size: int
+        :return: False if a fresh entry exists or the value wasn't cached.
+        :rtype: bool
+        """
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is not None and entry[1] > time.monotonic():
+                return False
+
+            return self._set(key, value, ttl, size)
+
+    def refresh(self, key, ttl: float = None) -> bool:
+        """Renew the TTL of an entry, e.g. after a successful revalidation.
+
+        :param key: Cache key.
+        :type key: hashable
+        :param ttl: Time to live in seconds, defaults to the cache TTL.
+        :type ttl: float
+        :return: False if the entry doesn't exist anymore.
+        :rtype: bool
+        """
+        if ttl is None:
+            ttl = self.ttl
+
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                return False
+
+            value, _, size = entry
+            self._data[key] = (value, time.monotonic() + ttl, size)
+            self._data.move_to_end(key)
+            self._refreshes += 1
+
+        return True
+
+    def delete(self, key) -> bool:
+        """Remove an entry from the cache.
+
+        :param key: Cache key.
+        :type key: hashable
+        :return: False if the entry didn't exist.
+        :rtype: bool
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+            if entry is None:
+                return False
+
+            self._bytes -= entry[2]
+
+        return True
+
+    def clear(self):
+        """Remove all entries from the cache.
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns usage statistics of the cache.
+
+        :return: Size and hit/miss/eviction counters.
+        :rtype: dict
+        """
+        return {
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'hits': self._hits,
+            'stale_hits': self._stale_hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'refreshes': self._refreshes
+        }
+
+
+class DiskCache(object):
+    """Cache of byte strings in an SQLite database shared by processes.
+
+    Values are stored zlib compressed with an absolute expiry time, so the
+    entries outlive restarts and are shared by all worker processes of the
+    host. The database is written in WAL mode, every write is a single
+    transaction, so a crashed process never leaves a partial entry behind.
+    Entries are evicted in least recently used order when the total size of
+    the stored values exceeds `max_bytes`.
+
+    The cache never fails the caller, database errors (e.g. a lock held for
+    too long by another process) count as misses and skipped writes, and
+    entries that can't be decompressed are deleted and count as misses.
+    """
+
+    def __init__(self, name: str, path: str, max_bytes: int,
+                 compress_level: int = 6, timeout: float = 1):
+        """Initialise DiskCache class.
+
+        :param name: Name of the cache, used for reporting statistics.
+        :type name: str
+        :param path: Path of the database file.
+        :type path: str
+        :param max_bytes: Max total size of the stored (compressed) values.
+        :type max_bytes: int
+        :param compress_level: zlib compression level.
+        :type compress_level: int
+        :param timeout: Seconds to wait for a lock held by another process.
+        :type timeout: float
+        """
+        self.name = name
+        self._path = path
+        self._max_bytes = max_bytes
+        self._compress_level = compress_level
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._errors = 0
+
+        _caches[name] = self
+
+    def _connect(self) -> sqlite3.Connection:
+        """Returns the connection of this process, the lock has to be held
+        by the caller.
+
+        Connections are opened on first use, so forked worker processes
+        don't share the connection of their parent.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+
+            connection = sqlite3.connect(self._path, timeout=self._timeout,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS entries ('
+                    'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                    'size INTEGER NOT NULL, expires REAL NOT NULL, '
+                    'accessed REAL NOT NULL)')
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS entries_accessed '
+                    'ON entries (accessed)')
+
+                # The total size is kept up to date by triggers, so writes
+                # don't have to sum up the sizes of all entries. It is only
+                # summed up when the table is created.
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS total ('
+                    'id INTEGER PRIMARY KEY CHECK (id = 0), '
+                    'size INTEGER NOT NULL)')
+                connection.execute(
+                    'INSERT OR IGNORE INTO total (id, size) '
+                    'SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+                connection.execute(
+                    'CREATE TRIGGER IF NOT EXISTS entries_insert '
+                    'AFTER INSERT ON entries BEGIN '
+                    'UPDATE total SET size = size + NEW.size; END')
+                connection.execute(
+                    'CREATE TRIGGER IF NOT EXISTS entries_update '
+                    'AFTER UPDATE OF size ON entries BEGIN '
+                    'UPDATE total SET size = size - OLD.size + NEW.size; END')
+                connection.execute(
+                    'CREATE TRIGGER IF NOT EXISTS entries_delete '
+                    'AFTER DELETE ON entries BEGIN '
+                    'UPDATE total SET size = size - OLD.size; END')
+
+            self._connection = connection
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def get(self, key: str) -> tuple:
+        """Returns a fresh value and its remaining time to live.
+
+        :param key: Cache key.
+        :type key: str
+        :return: Tuple of the value (None on a miss) and the seconds left.
+        :rtype: tuple
+        """
+        now = time.time()
+
+        with self._lock:
+            try:
+                connection = self._connect()
+                row = connection.execute(
+                    'SELECT value, expires FROM entries WHERE key = ?',
+                    (key,)).fetchone()
+
+                if row is None or row[1] <= now:
+                    self._misses += 1
+                    return None, 0
+
+                value = zlib.decompress(row[0])
+                connection.execute(
+                    'UPDATE entries SET accessed = ? WHERE key = ?',
+                    (now, key))
+            except zlib.error:
+                # A corrupt entry would fail every later read, drop it.
+                self._errors += 1
+                self._delete(key)
+                return None, 0
+            except sqlite3.Error:
+                self._errors += 1
+                return None, 0
+
+            self._hits += 1
+
+        return value, row[1] - now
+
+    def _delete(self, key: str):
+        """Delete an entry, the lock has to be held by the caller.
+
+        :param key: Cache key.
+        :type key: str
+        :return: None
+        :rtype: None
+        """
+        try:
+            self._connect().execute('DELETE FROM entries WHERE key = ?',
+                                    (key,))
+        except sqlite3.Error:
+            pass
+
+    def set(self, key: str, value: bytes, ttl: float) -> bool:
+        """Store a value, evicting least recently used entries if needed.
+
+        :param key: Cache key.
+        :type key: str
+        :param value: The value to cache.
+        :type value: bytes
+        :param ttl: Time to live in seconds.
+        :type ttl: float
+        :return: False if the value wasn't stored.
+        :rtype: bool
+        """
+        if ttl <= 0:
+            return False
+
+        compressed = zlib.compress(value, self._compress_level)
+
+        if len(compressed) > self._max_bytes:
+            return False
+
+        now = time.time()
+
+        with self._lock:
+            try:
+                connection = self._connect()
+
+                with connection:
+                    # IMMEDIATE takes the write lock up front, so two
+                    # processes can't evict on the same stale total size.
+                    connection.execute('BEGIN IMMEDIATE')
+                    # An upsert instead of INSERT OR REPLACE, whose
+                    # deletes don't fire the triggers.
+                    connection.execute(
+                        'INSERT INTO entries '
+                        '(key, value, size, expires, accessed) '
+                        'VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT (key) DO UPDATE SET '
+                        'value = excluded.value, size = excluded.size, '
+                        'expires = excluded.expires, '
+                        'accessed = excluded.accessed',
+                        (key, compressed, len(compressed), now + ttl, now))
+                    self._evict(connection, now)
+            except sqlite3.Error:
+                self._errors += 1
+                return False
+
+        return True
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        """Delete expired entries and the least recently used ones above the
+        size limit, inside the caller's transaction.
+
+        :return: None
+        :rtype: None
+        """
+        if self._total(connection) <= self._max_bytes:
+            return
+
+        self._evictions += connection.execute(
+            'DELETE FROM entries WHERE expires <= ?', (now,)).rowcount
+        total = self._total(connection)
+
+        rows = connection.execute(
+            'SELECT key, size FROM entries ORDER BY accessed')
+
+        evicted = []
+        for key, size in rows:
+            if total <= self._max_bytes:
+                break
+
+            evicted.append((key,))
+            total -= size
+
+        rows.close()
+        connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+        self._evictions += len(evicted)
+
+    @staticmethod
+    def _total(connection: sqlite3.Connection) -> int:
+        """Returns the total size of the stored values.
+
+        :return: Size in bytes.
+        :rtype: int
+        """
+        return connection.execute(
+            'SELECT size FROM total WHERE id = 0').fetchone()[0]
+
+    def delete(self, key: str) -> bool:
+        """Remove an entry from the cache.
+
+        :param key: Cache key.
+        :type key: str
+        :return: False if the entry didn't exist.
+        :rtype: bool
+        """
+        with self._lock:
+            try:
+                return self._connect().execute(
+                    'DELETE FROM entries WHERE key = ?',
+                    (key,)).rowcount > 0
+            except sqlite3.Error:
+                self._errors += 1
+                return False
+
+    def stats(self) -> dict:
+        """Returns usage statistics of the cache.
+
+        The size is shared by all processes, the counters are per process.
+
+        :return: Size and hit/miss/eviction/error counters.
+        :rtype: dict
+        """
+        entries = size = None
+
+        with self._lock:
+            try:
+                connection = self._connect()
+                entries = connection.execute(
+                    'SELECT COUNT(*) FROM entries').fetchone()[0]
+                size = self._total(connection)
+            except sqlite3.Error:
+                self._errors += 1
+
+        return {
+            'entries': entries,
+            'bytes': size,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'errors': self._errors
+        }
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key into a single call.
+
+    The first caller runs the function, callers arriving while it is
+    running wait for and share its result (or exception). Waiting callers
+    give up at the deadline of their own request. If the call fails with
+    one of the `retry_on` exceptions, e.g. because the deadline of the first
+    caller has passed, the exception isn't shared and the next waiting
+    caller runs the function again.
+    """
+
+    def __init__(self, name: str, retry_on: tuple = (),
+                 timeout_error=None):
+        """Initialise SingleFlight class.
+
+        :param name: Name of the group, used for reporting statistics.
+        :type name: str
+        :param retry_on: Exceptions of the calling request only, which are
+            not shared with the waiting callers.
+        :type retry_on: tuple
+        :param timeout_error: Function returning the exception raised when
+            the deadline of a waiting caller passes, defaults to
+            `concurrent.futures.TimeoutError`.
+        :type timeout_error: callable
+        """
+        self.name = name
+        self._retry_on = retry_on
+        self._timeout_error = timeout_error or TimeoutError
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+        _flights[name] = self
+
+    def do(self, key, func, *args, **kwargs):
+        """Run the function unless a call with the same key is in flight.
+
+        :param key: Key identifying identical calls.
+        :type key: hashable
+        :param func: The function to call.
+        :type func: callable
+        :return: The return value of the function.
+        :rtype: object
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    self.coalesced += 1
+                    call.waiters += 1
+
+            if leader:
+                break
+
+            try:
+                # A negative timeout times out right away.
+                result = call.result(timeout=deadlines.remaining())
+            except TimeoutError:
+                if call.done():
+                    raise
+
+                raise self._timeout_error()
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+
+            if result is not _RETRY:
+                return result
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.end(key, call, exception=e)
+            raise
+
+        self.end(key, call, result)
+
+        return result
+
+    def begin(self, key) -> Future:
+        """Start a call completed by the caller with `end`, e.g. one whose
+        result is only known once it has been streamed, unless a call with
+        the same key is in flight.
+
+        :param key: Key identifying identical calls.
+        :type key: hashable
+        :return: The call, None if a call with the key is in flight.
+        :rtype: Future
+        """
+        with self._lock:
+            if key in self._calls:
+                return None
+
+            call = self._calls[key] = _Call()
+
+        return call
+
+    def waiters(self, call: Future) -> int:
+        """Returns the number of callers waiting for a call.
+
+        :param call: The call.
+        :type call: concurrent.futures.Future
+        :return: Number of waiting callers.
+        :rtype: int
+        """
+        with self._lock:
+            return call.waiters
+
+    def end(self, key, call: Future, result=None, exception=None,
+            retry: bool = False):
+        """Complete a call and hand its outcome to the waiting callers.
+
+        :param key: Key of the call.
+        :type key: hashable
+        :param call: The call.
+        :type call: Future
+        :param result: The result of the call.
+        :type result: object
+        :param exception: The exception of a failed call.
+        :type exception: BaseException
+        :param retry: Make the waiting callers run the function themselves,
+            also done for the `retry_on` exceptions.
+        :type retry: bool
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            del self._calls[key]
+
+        if retry or isinstance(exception, self._retry_on):
+            call.set_result(_RETRY)
+        elif exception is not None:
+            call.set_exception(exception)
+        else:
+            call.set_result(result)
+
+
+class _Call(Future):
+    """Call of a SingleFlight group with the number of waiting callers."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiters = 0
+
+
+# Result of a call the waiting callers have to repeat.
+_RETRY = object()
+
+
+def cache_stats() -> dict:
+    """Returns the statistics of all caches.
+
+    :return: Statistics by cache name.
+    :rtype: dict
+    """
+    return {name: cache.stats() for name, cache in list(_caches.items())}
+
+
+def coalesced_stats() -> dict:
+    """Returns the number of coalesced calls of all single flight groups.
+
+    :return: Coalesced calls by group name.
+    :rtype: dict
+    """
+    return {name: flight.coalesced for name, flight in list(_flights.items())}
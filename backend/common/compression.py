@@ -0,0 +1,285 @@
+"""
+Response compression is defined in this file.
+
+The encoding is negotiated from the Accept-Encoding request header. gzip is
+always available, brotli and zstd are used if the `brotli` and `zstandard`
+packages are installed.
+"""
+import json
+import time
+import zlib
+
+import bottle
+import settings
+from common import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+class GzipCompressor(object):
+    """Incremental gzip compressor."""
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.compress(data)
+
+        if flush:
+            out += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        return out
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(object):
+    """Incremental brotli compressor."""
+
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.process(data)
+
+        if flush:
+            out += self._compressor.flush()
+
+        return out
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdCompressor(object):
+    """Incremental zstd compressor."""
+
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        out = self._compressor.compress(data)
+
+        if flush:
+            out += self._compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+        return out
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+COMPRESSORS = {'gzip': GzipCompressor}
+
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Returns the quality values of the encodings accepted by the client.
+
+    :param accept_encoding: Value of the Accept-Encoding header.
+    :type accept_encoding: str
+    :return: Quality value by lowercase encoding name.
+    :rtype: dict
+    """
+    accepted = {}
+
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+
+        accepted[name.strip().lower()] = q
+
+    return accepted
+
+
+def accepts(accept_encoding: str, encoding: str) -> bool:
+    """Returns whether the client accepts an encoding.
+
+    :param accept_encoding: Value of the Accept-Encoding header.
+    :type accept_encoding: str
+    :param encoding: The encoding.
+    :type encoding: str
+    :return: Whether the encoding is acceptable.
+    :rtype: bool
+    """
+    accepted = accepted_encodings(accept_encoding)
+
+    return accepted.get(encoding.lower(), accepted.get('*', 0)) > 0
+
+
+def negotiate(accept_encoding: str) -> str:
+    """Returns the preferred available encoding accepted by the client.
+
+    :param accept_encoding: Value of the Accept-Encoding header.
+    :type accept_encoding: str
+    :return: The encoding, None if no encoding is acceptable.
+    :rtype: str
+    """
+    accepted = accepted_encodings(accept_encoding)
+
+    for encoding in settings.COMPRESSION['encodings']:
+        q = accepted.get(encoding, accepted.get('*', 0))
+
+        if encoding in COMPRESSORS and q > 0:
+            return encoding
+
+    return None
+
+
+def _record(rule: str, encoding: str, seconds: float, size_in: int,
+            size_out: int):
+    """Record the time spent and the bytes saved by compression.
+
+    :return: None
+    :rtype: None
+    """
+    labels = (rule, encoding)
+    metrics.compression_seconds.inc(labels, seconds)
+    metrics.compression_input_bytes.inc(labels, size_in)
+    metrics.compression_output_bytes.inc(labels, size_out)
+
+
+def _compress_stream(chunks, compressor, rule: str, encoding: str):
+    """Compress a streamed body chunk by chunk.
+
+    Every chunk is flushed, so the client receives data as soon as it
+    is produced.
+
+    :return: Generator of compressed chunks.
+    :rtype: generator
+    """
+    seconds = 0
+    size_in = 0
+    size_out = 0
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+
+            if not chunk:
+                continue
+
+            start = time.perf_counter()
+            out = compressor.compress(chunk, flush=True)
+            seconds += time.perf_counter() - start
+            size_in += len(chunk)
+            size_out += len(out)
+
+            yield out
+
+        start = time.perf_counter()
+        out = compressor.finish()
+        seconds += time.perf_counter() - start
+        size_out += len(out)
+
+        yield out
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+        _record(rule, encoding, seconds, size_in, size_out)
+
+
+def compress_response(rv: bottle.HTTPResponse, encoding: str, rule: str):
+    """Compress the body of a response in place, if it is worth it.
+
+    :param rv: The response.
+    :type rv: bottle.HTTPResponse
+    :param encoding: Content encoding to use.
+    :type encoding: str
+    :param rule: Route rule, used for recording metrics.
+    :type rule: str
+    :return: None
+    :rtype: None
+    """
+    options = settings.COMPRESSION
+    body = rv.body
+
+    if isinstance(body, dict):
+        # Bottle's JSON plugin would dump the body after this plugin.
+        body = json.dumps(body)
+
+    if isinstance(body, str):
+        body = body.encode(rv.charset)
+
+    length = len(body) if isinstance(body, bytes) else \
+        int(rv.get_header('Content-Length') or options['min_size'])
+
+    if length < options['min_size']:
+        return
+
+    compressor = COMPRESSORS[encoding](options['levels'][encoding])
+
+    if isinstance(body, bytes):
+        start = time.perf_counter()
+        compressed = compressor.compress(body) + compressor.finish()
+        _record(rule, encoding, time.perf_counter() - start, len(body),
+                len(compressed))
+
+        rv.body = compressed
+    else:
+        rv.body = _compress_stream(body, compressor, rule, encoding)
+
+    # Bottle sets the length of byte bodies, streamed ones have no length.
+    if 'Content-Length' in rv.headers:
+        del rv.headers['Content-Length']
+
+    rv.set_header('Content-Encoding', encoding)
+
+
+class CompressionPlugin(object):
+    """Bottle plugin compressing response bodies above a size threshold
+    with the encoding negotiated from Accept-Encoding.
+    """
+    name = 'compression'
+    api = 2
+
+    def apply(self, callback, route):
+        rule = route.rule
+
+        def wrapper(*args, **kwargs):
+            rv = callback(*args, **kwargs)
+
+            if not settings.COMPRESSION['enabled'] or \
+                    not isinstance(rv, bottle.HTTPResponse) or \
+                    rv.status_code in (204, 304) or \
+                    'Content-Encoding' in rv.headers or \
+                    not (rv.content_type or '').startswith(
+                        settings.COMPRESSION['types']):
+                return rv
+
+            rv.add_header('Vary', 'Accept-Encoding')
+            encoding = negotiate(
+                bottle.request.get_header('Accept-Encoding'))
+
+            if encoding is not None:
+                compress_response(rv, encoding, rule)
+
+            return rv
+
+        return wrapper
@@ -0,0 +1,95 @@
+"""
+End-to-end request deadlines are defined in this file.
+
+Every incoming request gets a deadline, taken from the request header or the
+route default in settings. Upstream calls made while handling the request
+size their timeouts by the time left.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import bottle
+import settings
+
+_local = threading.local()
+
+
+def current() -> float:
+    """Returns the deadline of the current request.
+
+    :return: Deadline as a `time.monotonic()` value, None if there is none.
+    :rtype: float
+    """
+    return getattr(_local, 'deadline', None)
+
+
+def remaining(deadline: float = None) -> float:
+    """Returns the seconds left until the deadline.
+
+    :param deadline: The deadline, defaults to the current request's.
+    :type deadline: float
+    :return: Seconds left, None if there is no deadline.
+    :rtype: float
+    """
+    if deadline is None:
+        deadline = current()
+
+    if deadline is None:
+        return None
+
+    return deadline - time.monotonic()
+
+
+@contextmanager
+def scope(deadline: float):
+    """Use a deadline in the current thread, e.g. in a thread pool worker
+    handling a part of a request.
+
+    :param deadline: The deadline.
+    :type deadline: float
+    """
+    previous = current()
+    _local.deadline = deadline
+
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def _request_timeout(rule: str) -> float:
+    """Returns the timeout of the current request in seconds.
+
+    :param rule: Route rule.
+    :type rule: str
+    :return: Requested timeout, capped at the max, or the route default.
+    :rtype: float
+    """
+    header = bottle.request.get_header(settings.REQUEST_DEADLINE_HEADER)
+
+    if header:
+        try:
+            return min(max(float(header), 0), settings.REQUEST_DEADLINE_MAX)
+        except ValueError:
+            pass
+
+    return settings.REQUEST_DEADLINES.get(
+        rule, settings.REQUEST_DEADLINE_DEFAULT)
+
+
+class DeadlinePlugin(object):
+    """Bottle plugin setting the deadline of every request."""
+    name = 'deadlines'
+    api = 2
+
+    def apply(self, callback, route):
+        rule = route.rule
+
+        def wrapper(*args, **kwargs):
+            deadline = time.monotonic() + _request_timeout(rule)
+
+            with scope(deadline):
+                return callback(*args, **kwargs)
+
+        return wrapper
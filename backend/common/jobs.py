@@ -0,0 +1,185 @@
+"""
+Background jobs are defined in this file.
+
+Jobs run in a bounded thread pool, their results are kept in an expiring
+store until they are collected, so a slow call doesn't hold the worker
+handling the request that started it.
+"""
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.cache import TTLCache
+
+_queues = {}
+
+
+class Job(object):
+    """A call run in the background and its outcome."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self):
+        self.id = secrets.token_urlsafe(16)
+        self.state = self.PENDING
+        self.result = None
+        self._finished = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def finish(self, state: str, result):
+        """Store the outcome and wake up the waiting callers.
+
+        :param state: DONE or FAILED.
+        :type state: str
+        :param result: Return value or exception of the call.
+        :type result: object
+        :return: None
+        :rtype: None
+        """
+        self.result = result
+        self.state = state
+        self._finished.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until the job has finished.
+
+        :param timeout: Max seconds to wait, None to wait forever.
+        :type timeout: float
+        :return: Whether the job has finished.
+        :rtype: bool
+        """
+        return self._finished.wait(timeout)
+
+
+class JobQueue(object):
+    """Runs jobs in a thread pool of a fixed size.
+
+    At most `max_pending` jobs wait for a free thread, more are rejected.
+    Pending and running jobs are always kept. Finished jobs are kept for
+    `ttl` seconds, in a store of at most `maxsize` jobs.
+    """
+
+    def __init__(self, name: str, workers: int = 10, max_pending: int = 100,
+                 maxsize: int = 1000, ttl: float = 300):
+        """Initialise JobQueue class.
+
+        :param name: Name of the queue, used for reporting statistics.
+        :type name: str
+        :param workers: Number of threads running the jobs.
+        :type workers: int
+        :param max_pending: Max number of jobs waiting for a thread.
+        :type max_pending: int
+        :param maxsize: Max number of finished jobs kept.
+        :type maxsize: int
+        :param ttl: Seconds a job is kept after it has finished.
+        :type ttl: float
+        """
+        self.name = name
+        self._max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = TTLCache(f'{name}_jobs', maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        # Jobs that haven't finished yet, never evicted. There are at most
+        # `max_pending` plus `workers` of them.
+        self._unfinished = {}
+        self._pending = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+        _queues[name] = self
+
+    def submit(self, func, *args, **kwargs) -> Job:
+        """Run a function in the background.
+
+        :param func: The function to call, its return value is the result
+            of the job.
+        :type func: callable
+        :return: The job, None if too many jobs are pending.
+        :rtype: Job
+        """
+        with self._lock:
+            if self._pending >= self._max_pending:
+                self._rejected += 1
+                return None
+
+            self._pending += 1
+            job = Job()
+            self._unfinished[job.id] = job
+
+        self._executor.submit(self._run, job, func, args, kwargs)
+
+        return job
+
+    def get(self, id: str) -> Job:
+        """Returns a job that hasn't expired yet.
+
+        :param id: ID of the job.
+        :type id: str
+        :return: The job or None.
+        :rtype: Job
+        """
+        job = self._unfinished.get(id)
+
+        if job is None:
+            job = self._jobs.get(id)
+
+        return job
+
+    def _run(self, job: Job, func, args: tuple, kwargs: dict):
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+
+        job.state = Job.RUNNING
+        state = Job.FAILED
+        result = None
+
+        try:
+            result = func(*args, **kwargs)
+            state = Job.DONE
+        except Exception as e:
+            result = e
+        finally:
+            with self._lock:
+                self._running -= 1
+
+                if state == Job.DONE:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+                # Stored before it is removed, so get() always finds it.
+                self._jobs.set(job.id, job)
+                del self._unfinished[job.id]
+
+            job.finish(state, result)
+
+    def stats(self) -> dict:
+        """Returns the numbers of pending, running and finished jobs.
+
+        :return: Job counters.
+        :rtype: dict
+        """
+        return {
+            'pending': self._pending,
+            'running': self._running,
+            'completed': self._completed,
+            'failed': self._failed,
+            'rejected': self._rejected
+        }
+
+
+def job_stats() -> dict:
+    """Returns the statistics of all job queues.
+
+    :return: Statistics by queue name.
+    :rtype: dict
+    """
+    return {name: queue.stats() for name, queue in list(_queues.items())}
@@ -0,0 +1,353 @@
+"""
+Prometheus style metrics are defined in this file.
+
+Metric values are spread over a fixed number of stripes, each with its own
+lock. Threads are assigned to the stripes round-robin when they first
+record a metric, so threads recording metrics at the same time rarely wait
+for each other, and the stripes are only merged when the metrics are
+scraped.
+"""
+import bisect
+import itertools
+import threading
+import time
+
+import bottle
+import settings
+
+STRIPES = 16
+
+_metrics = []
+
+# Stripe index of the current thread, assigned on its first use.
+_local = threading.local()
+_next_stripe = itertools.count()
+
+
+def _stripe_index() -> int:
+    """Returns the stripe index of the current thread.
+
+    Thread idents are aligned addresses on most platforms, so they can't be
+    used as the index directly.
+
+    :return: Index in [0, STRIPES).
+    :rtype: int
+    """
+    try:
+        return _local.stripe
+    except AttributeError:
+        _local.stripe = next(_next_stripe) % STRIPES
+        return _local.stripe
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    """Returns the label set in the exposition format.
+
+    :param names: Label names.
+    :type names: tuple
+    :param values: Label values.
+    :type values: tuple
+    :param extra: Additional formatted label, e.g. le="0.1".
+    :type extra: str
+    :return: Formatted labels, e.g. {route="/me",method="GET"}.
+    :rtype: str
+    """
+    labels = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+
+    if extra:
+        labels.append(extra)
+
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Metric(object):
+    """Base class of the metric types."""
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        """Initialise Metric class.
+
+        :param name: Metric name.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :param labels: Label names.
+        :type labels: tuple
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._stripes = [({}, threading.Lock()) for _ in range(STRIPES)]
+
+        _metrics.append(self)
+
+    def _stripe(self) -> tuple:
+        """Returns the values and lock of the current thread's stripe.
+
+        :return: Tuple of the values dict and the lock.
+        :rtype: tuple
+        """
+        return self._stripes[_stripe_index()]
+
+    def render(self) -> list:
+        """Returns the metric in the exposition format.
+
+        :return: Lines of text.
+        :rtype: list
+        """
+        return [f'# HELP {self.name} {self.help}',
+                f'# TYPE {self.name} {self.type}']
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+    type = 'counter'
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        """Increment the counter.
+
+        :param labels: Label values.
+        :type labels: tuple
+        :param amount: Amount to add.
+        :type amount: float
+        :return: None
+        :rtype: None
+        """
+        values, lock = self._stripe()
+
+        with lock:
+            values[labels] = values.get(labels, 0) + amount
+
+    def collect(self) -> dict:
+        """Returns the counter values merged from all stripes.
+
+        :return: Values by label values.
+        :rtype: dict
+        """
+        merged = {}
+
+        for values, lock in self._stripes:
+            with lock:
+                items = list(values.items())
+
+            for labels, value in items:
+                merged[labels] = merged.get(labels, 0) + value
+
+        return merged
+
+    def render(self) -> list:
+        lines = super().render()
+
+        for labels, value in sorted(self.collect().items()):
+            lines.append(
+                f'{self.name}{_format_labels(self.labels, labels)} {value}')
+
+        return lines
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (),
+                 buckets: tuple = None):
+        """Initialise Histogram class.
+
+        :param name: Metric name.
+        :type name: str
+        :param help: Description of the metric.
+        :type help: str
+        :param labels: Label names.
+        :type labels: tuple
+        :param buckets: Upper bounds of the buckets.
+        :type buckets: tuple
+        """
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets or settings.METRICS_BUCKETS))
+
+    def observe(self, labels: tuple, value: float):
+        """Record an observation.
+
+        :param labels: Label values.
+        :type labels: tuple
+        :param value: The observed value.
+        :type value: float
+        :return: None
+        :rtype: None
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        values, lock = self._stripe()
+
+        with lock:
+            counts = values.get(labels)
+
+            if counts is None:
+                # Bucket counts followed by the +Inf bucket and the sum.
+                counts = values[labels] = [0] * (len(self.buckets) + 2)
+
+            counts[index] += 1
+            counts[-1] += value
+
+    def collect(self) -> dict:
+        """Returns the bucket counts and sums merged from all stripes.
+
+        :return: Non-cumulative counts and sum by label values.
+        :rtype: dict
+        """
+        merged = {}
+
+        for values, lock in self._stripes:
+            with lock:
+                items = [(labels, list(counts))
+                         for labels, counts in values.items()]
+
+            for labels, counts in items:
+                total = merged.get(labels)
+
+                if total is None:
+                    merged[labels] = counts
+                else:
+                    for i, count in enumerate(counts):
+                        total[i] += count
+
+        return merged
+
+    def render(self) -> list:
+        lines = super().render()
+
+        for labels, counts in sorted(self.collect().items()):
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+
+            formatted = _format_labels(self.labels, labels)
+            lines.append(f'{self.name}_sum{formatted} {counts[-1]}')
+            lines.append(f'{self.name}_count{formatted} {cumulative}')
+
+        return lines
+
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text exposition format.
+
+    :return: The metrics.
+    :rtype: str
+    """
+    lines = []
+
+    for metric in list(_metrics):
+        lines.extend(metric.render())
+
+    return '\n'.join(lines) + '\n'
+
+
+http_requests = Counter(
+    'http_requests_total',
+    'HTTP requests by route, method and status code.',
+    ('route', 'method', 'status'))
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request handling time by route and method.',
+    ('route', 'method'))
+
+upstream_requests = Counter(
+    'upstream_requests_total',
+    'Upstream API requests by API and status code.',
+    ('api', 'status'))
+
+upstream_request_duration = Histogram(
+    'upstream_request_duration_seconds',
+    'Time until the upstream API response headers were received.',
+    ('api',))
+
+upstream_response_bytes = Counter(
+    'upstream_response_bytes_total',
+    'Upstream API response body bytes by API.',
+    ('api',))
+
+upstream_errors = Counter(
+    'upstream_errors_total',
+    'Upstream API requests that failed without a response, by API.',
+    ('api',))
+
+upstream_hedges = Counter(
+    'upstream_hedges_total',
+    'Hedged upstream requests by API and outcome '
+    '(primary_won, hedge_won, denied by the budget).',
+    ('api', 'outcome'))
+
+deadline_exceeded = Counter(
+    'upstream_deadline_exceeded_total',
+    'Upstream API requests skipped or cut short because of the request '
+    'deadline, by API.',
+    ('api',))
+
+requests_rejected = Counter(
+    'http_requests_rejected_total',
+    'HTTP requests rejected by admission control, by route and reason.',
+    ('route', 'reason'))
+
+upstream_rejected = Counter(
+    'upstream_rejected_total',
+    'Upstream API requests rejected because too many were in flight, '
+    'by API.',
+    ('api',))
+
+compression_seconds = Counter(
+    'compression_seconds_total',
+    'Time spent compressing response bodies by route and encoding.',
+    ('route', 'encoding'))
+
+compression_input_bytes = Counter(
+    'compression_input_bytes_total',
+    'Response body bytes before compression by route and encoding.',
+    ('route', 'encoding'))
+
+compression_output_bytes = Counter(
+    'compression_output_bytes_total',
+    'Response body bytes after compression by route and encoding.',
+    ('route', 'encoding'))
+
+
+class MetricsPlugin(object):
+    """Bottle plugin recording request counts, status codes and latency
+    of every route.
+    """
+    name = 'metrics'
+    api = 2
+
+    def apply(self, callback, route):
+        rule = route.rule
+        method = route.method
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 500
+
+            try:
+                rv = callback(*args, **kwargs)
+
+                if isinstance(rv, bottle.HTTPResponse):
+                    status = rv.status_code
+                else:
+                    status = bottle.response.status_code
+
+                return rv
+            except bottle.HTTPResponse as e:
+                # Redirects and aborts are raised.
+                status = e.status_code
+                raise
+            finally:
+                http_request_duration.observe(
+                    (rule, method), time.perf_counter() - start)
+                http_requests.inc((rule, method, status))
+
+        return wrapper
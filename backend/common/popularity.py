@@ -0,0 +1,214 @@
+"""
+Request popularity tracking is defined in this file.
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+
+_trackers = {}
+
+
+class PopularityTracker(object):
+    """Thread-safe, exponentially decaying request counts per key.
+
+    Counts halve every `half_life` seconds, so the ranking follows the
+    current traffic. The number of tracked keys is bounded. Requests of
+    untracked keys are counted approximately in a count-min sketch, a key
+    only replaces the least popular tracked key once its approximate count
+    is higher. New keys can't push out popular ones, and they aren't
+    forgotten right away before they could build up a count.
+    """
+
+    # Rows of the count-min sketch, each with `4 * maxsize` counters, at
+    # least `sketch_min_width`.
+    sketch_depth = 4
+    sketch_min_width = 1024
+
+    def __init__(self, name: str, maxsize: int = 1000,
+                 half_life: float = 300):
+        """Initialise PopularityTracker class.
+
+        :param name: Name of the tracker, used for reporting statistics.
+        :type name: str
+        :param maxsize: Max number of tracked keys.
+        :type maxsize: int
+        :param half_life: Seconds after which a count has halved.
+        :type half_life: float
+        """
+        self.name = name
+        self._maxsize = maxsize
+        self._half_life = half_life
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        # Scores are stored relative to the start time, which saves
+        # decaying all of them on every hit.
+        self._scores = {}
+        self._data = {}
+        # Min-heap of (score, order, key), entries of keys whose score has
+        # grown since are skipped when the least popular key is looked up.
+        self._heap = []
+        self._order = itertools.count()
+        self._width = max(4 * maxsize, self.sketch_min_width)
+        self._sketch = [[0.0] * self._width
+                        for _ in range(self.sketch_depth)]
+        self._rejected = 0
+
+        _trackers[name] = self
+
+    def _weight(self, now: float) -> float:
+        return math.pow(2, (now - self._start) / self._half_life)
+
+    def hit(self, key, data=None):
+        """Count a request.
+
+        :param key: Key of the request.
+        :type key: hashable
+        :param data: Data stored with the key, e.g. what is needed to
+            repeat the request.
+        :type data: object
+        :return: None
+        :rtype: None
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if now - self._start > self._half_life * 64:
+                self._rebase(now)
+
+            weight = self._weight(now)
+            estimate = self._count(key, weight)
+            score = self._scores.get(key)
+
+            if score is not None:
+                score += weight
+            elif len(self._scores) < self._maxsize:
+                score = estimate
+            else:
+                least, least_score = self._least()
+
+                if estimate <= least_score:
+                    self._rejected += 1
+                    return
+
+                del self._scores[least], self._data[least]
+                score = estimate
+
+            self._scores[key] = score
+            self._data[key] = data
+            self._push(key, score)
+
+    def _count(self, key, weight: float) -> float:
+        """Add a request to the sketch, the lock has to be held by the
+        caller.
+
+        :return: The approximate score of the key, never less than the
+            real one.
+        :rtype: float
+        """
+        estimate = None
+
+        for seed, row in enumerate(self._sketch):
+            index = hash((seed, key)) % self._width
+            row[index] += weight
+
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+
+        return estimate
+
+    def _least(self) -> tuple:
+        """Returns the least popular tracked key and its score, the lock
+        has to be held by the caller.
+
+        :return: Tuple of the key and its score.
+        :rtype: tuple
+        """
+        while True:
+            score, _, key = self._heap[0]
+
+            if self._scores.get(key) == score:
+                return key, score
+
+            heapq.heappop(self._heap)
+
+    def _push(self, key, score: float):
+        """Add the current score of a key to the heap, the lock has to be
+        held by the caller.
+
+        :return: None
+        :rtype: None
+        """
+        if len(self._heap) > 4 * self._maxsize:
+            # Drop the outdated entries once they make up most of the heap.
+            self._heapify()
+
+        heapq.heappush(self._heap, (score, next(self._order), key))
+
+    def _heapify(self):
+        """Rebuild the heap from the current scores, the lock has to be
+        held by the caller.
+
+        :return: None
+        :rtype: None
+        """
+        self._heap = [(score, next(self._order), key)
+                      for key, score in self._scores.items()]
+        heapq.heapify(self._heap)
+
+    def _rebase(self, now: float):
+        """Move the start time to now before the weights get too large,
+        the lock has to be held by the caller.
+
+        :return: None
+        :rtype: None
+        """
+        factor = self._weight(now)
+        self._scores = {key: score / factor
+                        for key, score in self._scores.items()}
+        self._sketch = [[count / factor for count in row]
+                        for row in self._sketch]
+        self._start = now
+        self._heapify()
+
+    def top(self, k: int) -> list:
+        """Returns the most popular keys.
+
+        :param k: Number of keys.
+        :type k: int
+        :return: List of (key, data, requests per half-life) tuples, most
+            popular first.
+        :rtype: list
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            weight = self._weight(now)
+            ranked = heapq.nlargest(k, self._scores.items(),
+                                    key=lambda item: item[1])
+
+            return [(key, self._data[key], score / weight)
+                    for key, score in ranked]
+
+    def stats(self) -> dict:
+        """Returns the statistics of the tracker.
+
+        :return: Tracked keys and the requests of untracked keys that
+            didn't replace a tracked one.
+        :rtype: dict
+        """
+        return {
+            'tracked': len(self._scores),
+            'rejected': self._rejected
+        }
+
+
+def popularity_stats() -> dict:
+    """Returns the statistics of all popularity trackers.
+
+    :return: Statistics by tracker name.
+    :rtype: dict
+    """
+    return {name: tracker.stats()
+            for name, tracker in list(_trackers.items())}
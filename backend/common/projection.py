@@ -0,0 +1,187 @@
+"""
+Field projection of JSON documents is defined in this file.
+
+Fields are selected with comma separated dotted paths, e.g.
+`@id,data.name,data.items.value`. Paths go through arrays, selecting the
+field from every element. Documents are parsed with the streaming `ijson`
+parser if it is installed, so only the selected parts of a document are
+ever built in memory, otherwise they are parsed with `json`.
+"""
+import functools
+import io
+import json
+
+# Selection of a whole subtree.
+ALL = True
+
+
+@functools.lru_cache(maxsize=None)
+def _ijson():
+    """Returns the ijson module, imported on first use as most requests
+    don't select fields.
+
+    :return: The module, None if it isn't installed.
+    :rtype: module
+    """
+    try:
+        import ijson
+    except ImportError:  # pragma: no cover
+        return None
+
+    return ijson
+
+
+def parse_fields(spec: str) -> dict:
+    """Returns the selection tree of a fields parameter.
+
+    :param spec: Comma separated dotted paths.
+    :type spec: str
+    :return: Nested dicts of the selected names, ALL for whole subtrees.
+    :rtype: dict
+    :raise ValueError: If a path is empty or has an empty name.
+    """
+    tree = {}
+
+    for path in spec.split(','):
+        names = path.strip().split('.')
+
+        if not all(names):
+            raise ValueError(f'Invalid field path: {path.strip()!r}')
+
+        node = tree
+        for name in names[:-1]:
+            child = node.get(name)
+
+            if child is ALL:
+                break
+
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = ALL
+
+    return tree
+
+
+def project(value, tree):
+    """Returns the selected fields of a parsed document.
+
+    :param value: The document.
+    :type value: object
+    :param tree: Selection tree returned by parse_fields.
+    :type tree: dict
+    :return: The projected document.
+    :rtype: object
+    """
+    if tree is ALL:
+        return value
+
+    if isinstance(value, list):
+        return [project(item, tree) for item in value
+                if isinstance(item, (dict, list))]
+
+    if isinstance(value, dict):
+        # Scalars are only kept if selected as a whole.
+        return {name: project(value[name], child)
+                for name, child in tree.items()
+                if name in value and (child is ALL or isinstance(
+                    value[name], (dict, list)))}
+
+    return None
+
+
+def _project_events(events, tree):
+    """Build the selected fields from ijson parser events.
+
+    Containers outside of the selection are skipped without being built.
+
+    :return: The projected document.
+    :rtype: object
+    """
+    # Frames of (container, selection), both None while skipping an
+    # unselected container.
+    stack = []
+    key = None
+    root = None
+
+    for _, event, value in events:
+        if event == 'map_key':
+            key = value
+            continue
+
+        if event in ('end_map', 'end_array'):
+            stack.pop()
+            continue
+
+        start = event in ('start_map', 'start_array')
+
+        if not stack:
+            container, selection = None, tree
+        else:
+            container, selection = stack[-1]
+
+            # Arrays pass the selection on to their elements.
+            if isinstance(container, dict) and selection is not ALL:
+                selection = selection.get(key)
+
+        if start:
+            if selection is None:
+                stack.append((None, None))
+                continue
+
+            new = {} if event == 'start_map' else []
+        elif selection is ALL:
+            new = value
+        else:
+            # Scalars are only kept if selected as a whole.
+            continue
+
+        if not stack:
+            root = new
+        elif isinstance(container, list):
+            container.append(new)
+        else:
+            container[key] = new
+
+        if start:
+            stack.append((new, selection))
+
+    return root
+
+
+def project_stream(stream, tree):
+    """Returns the selected fields of a JSON document read from a stream.
+
+    :param stream: Binary file-like object, e.g. a raw upstream response.
+    :type stream: io.RawIOBase
+    :param tree: Selection tree returned by parse_fields.
+    :type tree: dict
+    :return: The projected document.
+    :rtype: object
+    :raise ValueError: If the document isn't valid JSON.
+    """
+    ijson = _ijson()
+
+    if ijson is None:
+        return project(json.loads(stream.read().decode('utf-8')), tree)
+
+    try:
+        return _project_events(ijson.parse(stream, use_float=True), tree)
+    except ijson.JSONError as e:
+        raise ValueError(str(e))
+
+
+def project_text(text: str, tree):
+    """Returns the selected fields of a JSON document.
+
+    :param text: The document.
+    :type text: str
+    :param tree: Selection tree returned by parse_fields.
+    :type tree: dict
+    :return: The projected document.
+    :rtype: object
+    :raise ValueError: If the document isn't valid JSON.
+    """
+    if _ijson() is None:
+        return project(json.loads(text), tree)
+
+    return project_stream(io.BytesIO(text.encode('utf-8')), tree)
@@ -1,7 +1,11 @@
 """
 Responses the API uses can be defined here.
 """
+import json
+
+import bottle
 from bottle import HTTPResponse
+from common.compression import accepts
 
 
 class JSONResponse(HTTPResponse):
@@ -20,3 +24,194 @@ class JSONResponse(HTTPResponse):
 
         super(JSONResponse, self).__init__(body, status, headers,
                                            **more_headers)
+
+
+class TextResponse(HTTPResponse):
+    """TextResponse class.
+
+    Content-Type defaults to text/plain.
+    """
+
+    def __init__(self, body='', status=None, headers=None, **more_headers):
+        if headers is None:
+            headers = dict()
+
+        if 'Content-Type' not in headers:
+            headers['Content-Type'] = 'text/plain; charset=utf-8'
+
+        super(TextResponse, self).__init__(body, status, headers,
+                                           **more_headers)
+
+
+class NDJSONResponse(HTTPResponse):
+    """NDJSONResponse class.
+
+    Streams an iterable of JSON serializable items, one JSON document per
+    line, sending each line as soon as it has been produced.
+    """
+
+    def __init__(self, items, status=None, headers=None, **more_headers):
+        if headers is None:
+            headers = dict()
+
+        if 'Content-Type' not in headers:
+            headers['Content-Type'] = 'application/x-ndjson'
+
+        super(NDJSONResponse, self).__init__(
+            self._iter_lines(items), status, headers, **more_headers)
+
+    @staticmethod
+    def _iter_lines(items):
+        try:
+            for item in items:
+                yield (json.dumps(item) + '\n').encode('utf-8')
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+
+class EventStreamResponse(HTTPResponse):
+    """EventStreamResponse class.
+
+    Streams server-sent events from an iterable of (id, data) tuples, the
+    data is sent as JSON. None items are sent as comments, which keep the
+    connection open without triggering an event on the client.
+    """
+
+    def __init__(self, events, status=None, headers=None, **more_headers):
+        if headers is None:
+            headers = dict()
+
+        headers.setdefault('Content-Type', 'text/event-stream')
+        headers.setdefault('Cache-Control', 'no-cache')
+        # Don't let reverse proxies buffer the events.
+        headers.setdefault('X-Accel-Buffering', 'no')
+
+        super(EventStreamResponse, self).__init__(
+            self._iter_events(events), status, headers, **more_headers)
+
+    @staticmethod
+    def _iter_events(events):
+        try:
+            for event in events:
+                if event is None:
+                    yield b': keep-alive\n\n'
+                else:
+                    id, data = event
+                    yield f'id: {id}\ndata: {json.dumps(data)}\n\n'.encode(
+                        'utf-8')
+        finally:
+            if hasattr(events, 'close'):
+                events.close()
+
+
+class ProxyResponse(JSONResponse):
+    """ProxyResponse class.
+
+    Relays a streamed upstream response to the client chunk by chunk.
+    The body is passed through as raw bytes, without decoding or buffering
+    it, together with the upstream content headers. Bodies in an encoding
+    the client doesn't accept are decoded while they are relayed, which
+    leaves the encoding to the compression plugin.
+    """
+
+    relayed_headers = ('Content-Type', 'Content-Length', 'Content-Encoding')
+
+    def __init__(self, upstream, chunk_size=64 * 1024, headers=None,
+                 decode=None, on_complete=None, max_buffer=None,
+                 **more_headers):
+        """Initialise ProxyResponse class.
+
+        :param upstream: The streamed upstream response.
+        :type upstream: requests.Response
+        :param chunk_size: Max size of the relayed chunks.
+        :type chunk_size: int
+        :param decode: Whether to decode the body, by default only if the
+            client doesn't accept its encoding.
+        :type decode: bool
+        :param on_complete: Function called with the relayed body once it
+            has been sent completely, or with None if it wasn't.
+        :type on_complete: callable
+        :param max_buffer: Max size of the body kept for `on_complete`, it
+            is called with None as soon as the body is larger.
+        :type max_buffer: int
+        """
+        if headers is None:
+            headers = dict()
+
+        encoding = upstream.headers.get('Content-Encoding', '').strip()
+
+        if encoding.lower() in ('', 'identity'):
+            decode = False
+        elif decode is None:
+            decode = not accepts(
+                bottle.request.get_header('Accept-Encoding'), encoding)
+
+        relayed = ('Content-Type',) if decode else self.relayed_headers
+
+        for name in relayed:
+            if name in upstream.headers:
+                headers[name] = upstream.headers[name]
+
+        if encoding and not decode:
+            headers['Vary'] = 'Accept-Encoding'
+
+        super(ProxyResponse, self).__init__(
+            _Relay(upstream, chunk_size, decode, on_complete, max_buffer),
+            upstream.status_code, headers, **more_headers)
+
+
+class _Relay(object):
+    """Body of a ProxyResponse.
+
+    The upstream connection is released back to its pool once the body has
+    been relayed, or when the body is closed because the client went away.
+    """
+
+    def __init__(self, upstream, chunk_size, decode, on_complete,
+                 max_buffer=None):
+        self._upstream = upstream
+        self._chunk_size = chunk_size
+        self._decode = decode
+        self._on_complete = on_complete
+        self._max_buffer = max_buffer
+        self._chunks = [] if on_complete is not None else None
+        self._buffered = 0
+        self._complete = False
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            for chunk in self._upstream.raw.stream(
+                    self._chunk_size, decode_content=self._decode):
+                if self._chunks is not None:
+                    self._buffer(chunk)
+
+                yield chunk
+
+            self._complete = True
+        finally:
+            self.close()
+
+    def _buffer(self, chunk: bytes):
+        self._buffered += len(chunk)
+
+        if self._max_buffer is None or self._buffered <= self._max_buffer:
+            self._chunks.append(chunk)
+            return
+
+        # Too large to be kept, the body is only relayed from now on.
+        self._chunks = None
+        on_complete, self._on_complete = self._on_complete, None
+        on_complete(None)
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._upstream.close()
+
+        if self._on_complete is not None:
+            self._on_complete(
+                b''.join(self._chunks) if self._complete else None)
@@ -0,0 +1,92 @@
+"""
+Startup timing and readiness are tracked in this file.
+
+The process is ready once the application has been loaded and the optional
+warm-up, e.g. opening the upstream connections, has finished. The warm-up
+runs in the background, so the server can answer the readiness probe with
+503 in the meantime.
+"""
+import threading
+import time
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_stats = {
+    'load_seconds': None,
+    'warm_up_seconds': None,
+    'warm_up': None
+}
+
+
+def loaded(started: float):
+    """Record the time taken to load the application.
+
+    :param started: `time.perf_counter()` before the application modules
+        were imported.
+    :type started: float
+    :return: None
+    :rtype: None
+    """
+    with _lock:
+        _stats['load_seconds'] = round(time.perf_counter() - started, 3)
+
+
+def start(warm_up=None):
+    """Run the warm-up in a background thread and report ready after it.
+
+    :param warm_up: Function returning the warm-up results, None to be
+        ready right away. Exceptions don't keep the process from being
+        ready.
+    :type warm_up: callable
+    :return: None
+    :rtype: None
+    """
+    if warm_up is None:
+        _ready.set()
+        return
+
+    def run():
+        start = time.perf_counter()
+
+        try:
+            results = warm_up()
+        except Exception as e:
+            results = {'error': str(e)}
+
+        with _lock:
+            _stats['warm_up'] = results
+            _stats['warm_up_seconds'] = round(time.perf_counter() - start, 3)
+
+        _ready.set()
+
+    threading.Thread(target=run, name='warm-up', daemon=True).start()
+
+
+def is_ready() -> bool:
+    """Returns whether the application is ready to serve requests.
+
+    :return: Whether the warm-up has finished.
+    :rtype: bool
+    """
+    return _ready.is_set()
+
+
+def wait_ready(timeout: float = None) -> bool:
+    """Wait until the application is ready.
+
+    :param timeout: Max seconds to wait, None to wait forever.
+    :type timeout: float
+    :return: Whether the application is ready.
+    :rtype: bool
+    """
+    return _ready.wait(timeout)
+
+
+def startup_stats() -> dict:
+    """Returns the startup timings and warm-up results.
+
+    :return: Startup statistics.
+    :rtype: dict
+    """
+    with _lock:
+        return dict(_stats, ready=_ready.is_set())
@@ -0,0 +1,210 @@
+"""
+Shared polling subscriptions are defined in this file.
+
+Subscribers of the same key share one poller thread, which calls the
+upstream every `interval` seconds and publishes the result only when it
+differs from the previous one. The poller stops when its last subscriber
+unsubscribes, so upstream load grows with the number of distinct keys and
+not with the number of subscribers.
+"""
+import logging
+import threading
+import time
+
+_groups = {}
+
+logger = logging.getLogger(__name__)
+
+
+class Topic(object):
+    """Latest result of a polled function and the subscribers waiting for
+    it.
+
+    Results are versioned, subscribers always get the latest version. A
+    slow subscriber skips intermediate results instead of buffering them.
+    """
+
+    def __init__(self, key, poll, interval: float):
+        """Initialise Topic class.
+
+        :param key: Key of the topic.
+        :type key: hashable
+        :param poll: Function returning the current result.
+        :type poll: callable
+        :param interval: Seconds between the starts of two polls.
+        :type interval: float
+        """
+        self.key = key
+        self.subscribers = 0
+        self.version = 0
+        self.value = None
+        self._poll = poll
+        self._interval = interval
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start polling in a daemon thread.
+
+        :return: None
+        :rtype: None
+        """
+        self._thread = threading.Thread(
+            target=self._run, name='poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling and wake up the waiting subscribers.
+
+        A poll in progress is completed but not published.
+
+        :return: None
+        :rtype: None
+        """
+        self._stop.set()
+
+        with self._changed:
+            self._changed.notify_all()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def wait(self, version: int, timeout: float) -> tuple:
+        """Wait for a result newer than the given version.
+
+        :param version: Version the subscriber has already seen.
+        :type version: int
+        :param timeout: Max seconds to wait.
+        :type timeout: float
+        :return: Tuple of the version and the result, the version is
+            unchanged if there was no new result in time.
+        :rtype: tuple
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self.version > version or self.stopped, timeout)
+
+            return self.version, self.value
+
+    def _publish(self, value):
+        """Publish a result if it differs from the previous one.
+
+        :return: None
+        :rtype: None
+        """
+        with self._changed:
+            if self.version and value == self.value:
+                return
+
+            self.version += 1
+            self.value = value
+            self._changed.notify_all()
+
+    def _run(self):
+        while not self.stopped:
+            start = time.monotonic()
+
+            try:
+                value = self._poll()
+            except Exception:
+                logger.exception('Polling %s failed', self.key)
+            else:
+                if not self.stopped:
+                    self._publish(value)
+
+            self._stop.wait(
+                max(self._interval - (time.monotonic() - start), 0))
+
+
+class Subscriptions(object):
+    """Group of topics polled on behalf of their subscribers."""
+
+    def __init__(self, name: str, max_topics: int = None):
+        """Initialise Subscriptions class.
+
+        :param name: Name of the group, used for reporting statistics.
+        :type name: str
+        :param max_topics: Max number of topics polled at once, None for no
+            limit.
+        :type max_topics: int
+        """
+        self.name = name
+        self._max_topics = max_topics
+        self._lock = threading.Lock()
+        self._topics = {}
+
+        _groups[name] = self
+
+    def subscribe(self, key, poll, interval: float) -> Topic:
+        """Subscribe to a topic, starting its poller if it isn't running.
+
+        :param key: Key of the topic.
+        :type key: hashable
+        :param poll: Function returning the current result, only used if
+            the topic has no poller yet.
+        :type poll: callable
+        :param interval: Seconds between polls, only used if the topic has
+            no poller yet.
+        :type interval: float
+        :return: The topic, None if too many topics are polled already.
+        :rtype: Topic
+        """
+        with self._lock:
+            topic = self._topics.get(key)
+
+            if topic is None:
+                if self._max_topics is not None and \
+                        len(self._topics) >= self._max_topics:
+                    return None
+
+                topic = self._topics[key] = Topic(key, poll, interval)
+                topic.start()
+
+            topic.subscribers += 1
+
+        return topic
+
+    def unsubscribe(self, topic: Topic):
+        """Unsubscribe from a topic, its poller is stopped when the last
+        subscriber leaves.
+
+        :param topic: The topic returned by subscribe.
+        :type topic: Topic
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            topic.subscribers -= 1
+
+            if topic.subscribers > 0:
+                return
+
+            if self._topics.get(topic.key) is topic:
+                del self._topics[topic.key]
+
+        topic.stop()
+
+    def stats(self) -> dict:
+        """Returns the number of polled topics and their subscribers.
+
+        :return: Topic and subscriber counts.
+        :rtype: dict
+        """
+        with self._lock:
+            topics = list(self._topics.values())
+
+        return {
+            'topics': len(topics),
+            'subscribers': sum(topic.subscribers for topic in topics)
+        }
+
+
+def subscription_stats() -> dict:
+    """Returns the statistics of all subscription groups.
+
+    :return: Statistics by group name.
+    :rtype: dict
+    """
+    return {name: group.stats() for name, group in list(_groups.items())}
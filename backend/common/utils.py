@@ -2,13 +2,16 @@
 Generic helper functions are defined in this file.
 """
 import base64
+import functools
 import hashlib
 import hmac
 import json
+import os
+import struct
+import threading
 import time
 
 from datetime import datetime, timezone
-from binascii import hexlify
 
 
 def rfc3339() -> str:
@@ -22,6 +25,75 @@ def rfc3339() -> str:
     return str(datetime.now(timezone.utc).isoformat(timespec='seconds'))
 
 
+# Shared encoder for signature payloads, building one per call is costly.
+_signature_encoder = json.JSONEncoder(
+    sort_keys=True,
+    indent=None,
+    separators=(',', ': ')
+)
+
+
+class Signer(object):
+    """HMAC-SHA256 signer for a shared secret.
+
+    The HMAC key is set up once, every signature starts from a copy of the
+    keyed state instead of hashing the secret again.
+    """
+
+    def __init__(self, secret: str):
+        """Initialise Signer class.
+
+        :param secret: The shared secret.
+        :type secret: str
+        """
+        self._hmac = hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+
+    def digest(self, body) -> bytes:
+        """Returns the HMAC-SHA256 digest for the given body.
+
+        :param body: The body to generate the digest for.
+        :type body: str|dict
+        :return: The digest.
+        :rtype: bytes
+        :raise RuntimeError: If the body is not a string or dictionary.
+        """
+        h = self._hmac.copy()
+        h.update(get_signature_payload_bytes(body))
+        return h.digest()
+
+    def sign(self, body) -> str:
+        """Returns the base64 encoded signature of the body.
+
+        :param body: The body to sign.
+        :type body: str|dict
+        :return: The generated base64 encoded signature
+        :rtype: str
+        """
+        return base64.b64encode(self.digest(body)).decode()
+
+    def sign_many(self, bodies) -> list:
+        """Returns the base64 encoded signatures of many bodies.
+
+        :param bodies: The bodies to sign.
+        :type bodies: list
+        :return: Signatures in the same order as the bodies.
+        :rtype: list
+        """
+        return [self.sign(body) for body in bodies]
+
+
+@functools.lru_cache(maxsize=8)
+def get_signer(secret: str) -> Signer:
+    """Returns the shared signer of a secret.
+
+    :param secret: The shared secret.
+    :type secret: str
+    :return: The signer.
+    :rtype: Signer
+    """
+    return Signer(secret)
+
+
 def generate_signature(secret: str, body: dict) -> str:
     """Returns the HMAC-SHA256 signature of the body.
 
@@ -32,11 +104,10 @@ def generate_signature(secret: str, body: dict) -> str:
     :return: The generated base64 encoded signature
     :rtype: str
     """
-    digest = get_digest(secret, body)
-    return base64.b64encode(digest).decode()
+    return get_signer(secret).sign(body)
 
 
-def get_digest(secret: str, body) -> str:
+def get_digest(secret: str, body) -> bytes:
     """Returns the HMAC-SHA256 digest for the given body.
 
     :param secret: The shared secret.
@@ -44,15 +115,10 @@ def get_digest(secret: str, body) -> str:
     :param body: The body to generate the digest for.
     :type body: str|dict
     :return: The digest.
-    :rtype: str
+    :rtype: bytes
     :raise RuntimeError: If the body is not a string or dictionary.
     """
-    payload = get_signature_payload(body)
-
-    # Create the HMAC digest with SHA-256.
-    return hmac.new(secret.encode('utf-8'),
-                    payload.encode('utf-8'),
-                    hashlib.sha256).digest()
+    return get_signer(secret).digest(body)
 
 
 def get_signature_payload(body) -> str:
@@ -72,25 +138,39 @@ def get_signature_payload(body) -> str:
 
     # Create the hash from the body dict.
     if isinstance(body, dict):
-        json_str = json.dumps(
-            body,
-            sort_keys=True,
-            indent=None,
-            separators=(',', ': ')
-        ).strip()
+        json_str = _signature_encoder.encode(body).strip()
     else:
         json_str = body.strip()  # Strip white space from start and end.
 
     return json_str
 
 
+def get_signature_payload_bytes(body) -> bytes:
+    """Returns the signature payload as UTF-8 encoded bytes.
+
+    :param body: The body to be hashed.
+    :type body: str|dict
+    :return: JSON formatted bytes.
+    :rtype: bytes
+    :raise RuntimeError: IF the body is not a string or dict.
+    """
+    if isinstance(body, dict):
+        # The encoder escapes all non-ASCII characters and never adds
+        # white space around the document, so no strip() is needed.
+        return _signature_encoder.encode(body).encode('ascii')
+
+    return get_signature_payload(body).encode('utf-8')
+
+
 def request_args(args):
     """Decorator for request arguments.
 
     Defines fields that should be passed to the controller action.
 
-    :param args: The arguments of the request.
-    :type args: dict
+    :param args: The arguments of the request, or a function returning them
+        from the `webargs.fields` module, which defers importing webargs
+        until the first request is parsed.
+    :type args: dict|callable
     :return: The decorator.
     :rtype:
     """
@@ -102,6 +182,43 @@ def request_args(args):
     return _decorator
 
 
+def use_args(args, **kwargs):
+    """Route decorator parsing the request arguments with webargs, like
+    `webargs.bottleparser.use_args`.
+
+    Webargs is imported and the arguments are created when the first
+    request is parsed, which keeps them out of the startup time.
+
+    :param args: The arguments of the request, or a function returning them
+        from the `webargs.fields` module.
+    :type args: dict|callable
+    :return: The decorator.
+    :rtype: callable
+    """
+
+    def _decorator(f):
+        parser = []
+        lock = threading.Lock()
+
+        @functools.wraps(f)
+        def wrapper(*a, **kw):
+            if not parser:
+                with lock:
+                    if not parser:
+                        from webargs import fields
+                        from webargs.bottleparser import use_args as parse
+
+                        argmap = args if isinstance(args, dict) \
+                            else args(fields)
+                        parser.append(parse(argmap, **kwargs)(f))
+
+            return parser[0](*a, **kw)
+
+        return wrapper
+
+    return _decorator
+
+
 def get_ts() -> int:
     """Return current time in milliseconds
 
@@ -111,88 +228,142 @@ def get_ts() -> int:
     return int(time.time())
 
 
-def generate_state(data: dict, salt: str) -> str:
-    """Generate oauth state base64 encoded string out of arbitrary data
+# OAuth state layout: 4 byte timestamp, random nonce and truncated HMAC.
+STATE_NONCE_BYTES = 12
+STATE_MAC_BYTES = 16
+_STATE_TS = struct.Struct('>I')
+_STATE_PAYLOAD_BYTES = _STATE_TS.size + STATE_NONCE_BYTES
+_STATE_BYTES = _STATE_PAYLOAD_BYTES + STATE_MAC_BYTES
+
+
+@functools.lru_cache(maxsize=8)
+def _state_hmac(salt: str):
+    """Returns the keyed HMAC-SHA256 state for the OAuth state salt.
 
-    :param data: Data to be encrypted
-    :type data: dict
-    :param salt: Salt for randomized hashing
+    :param salt: Salt for hashing
     :type salt: str
-    :return: Base64 encoded string
+    :return: HMAC object to be copied for every state.
+    :rtype: hmac.HMAC
+    """
+    return hmac.new(salt.encode(), digestmod=hashlib.sha256)
+
+
+def _state_mac(salt: str, payload: bytes) -> bytes:
+    """Returns the truncated HMAC of an OAuth state payload.
+
+    :param salt: Salt for hashing
+    :type salt: str
+    :param payload: Timestamp and nonce of the state.
+    :type payload: bytes
+    :return: The MAC.
+    :rtype: bytes
+    """
+    h = _state_hmac(salt).copy()
+    h.update(payload)
+    return h.digest()[:STATE_MAC_BYTES]
+
+
+def generate_state(salt: str, ts: int = None) -> str:
+    """Generate URL safe oauth state with a timestamp and a random nonce
+
+    :param salt: Salt for hashing
+    :type salt: str
+    :param ts: Timestamp of the state, defaults to the current time.
+    :type ts: int
+    :return: URL safe base64 encoded string
     :rtype: str
     """
-    data_bytes = json.dumps(data).encode()
-    hash = hash_sha1(salt, data_bytes)
+    if ts is None:
+        ts = get_ts()
 
-    state = {
-        'd': data,
-        'h': hash
-    }
+    payload = _STATE_TS.pack(ts) + os.urandom(STATE_NONCE_BYTES)
+    state = payload + _state_mac(salt, payload)
 
-    return encode_base64_dict(state)
+    return base64.urlsafe_b64encode(state).rstrip(b'=').decode()
 
 
-def validate_state(encoded_state: str, salt: str, expires_in: int) -> bool:
+def validate_state(encoded_state: str, salt: str, expires_in: int,
+                   nonce_store=None) -> bool:
     """Validate oauth state
 
-    :param encoded_state: Base64 encoded state
+    :param encoded_state: URL safe base64 encoded state
     :type encoded_state: str
-    :param salt: Salt for randomized hashing
+    :param salt: Salt for hashing
     :type salt: str
     :param expires_in: Validate timestamp against current time
     :type expires_in: int
+    :param nonce_store: Cache of used nonces. If given, a state is only
+        valid once per store, i.e. once per worker process for an
+        in-process cache.
+    :type nonce_store: common.cache.TTLCache
     :return: True or False
     :rtype: bool
     """
-    state = decode_base64_dict(encoded_state)
-    state_data = state.get('d', {})
+    if not encoded_state or len(encoded_state) > 2 * _STATE_BYTES:
+        return False
+
+    try:
+        state = base64.urlsafe_b64decode(
+            encoded_state + '=' * (-len(encoded_state) % 4))
+    except (TypeError, ValueError):
+        return False
+
+    if len(state) != _STATE_BYTES:
+        return False
+
+    payload = state[:_STATE_PAYLOAD_BYTES]
+    ts, = _STATE_TS.unpack_from(payload)
 
-    ts = state_data.get('ts', None)
-    now = get_ts()
+    if ts + expires_in < get_ts():
+        return False
 
-    if ts and ts + expires_in < now:
+    if not hmac.compare_digest(_state_mac(salt, payload),
+                               state[_STATE_PAYLOAD_BYTES:]):
         return False
 
-    if generate_state(state_data, salt) != encoded_state:
+    if nonce_store is not None and \
+            not nonce_store.add(payload[_STATE_TS.size:], True,
+                                ttl=expires_in):
         return False
 
     return True
 
 
-def decode_base64_dict(base64_str: str) -> dict:
-    """Decode Base64 string
+def hash_token(token: str) -> str:
+    """Hash a token so it can be used as a cache key without storing it.
 
-    :param base64_str: Base64 encoded data
-    :type base64_str: str
-    :return: Data
-    :rtype: dict
+    :param token: Token, e.g. the value of the Authorization cookie.
+    :type token: str
+    :return: Hex encoded SHA-256 hash
+    :rtype: str
     """
-    return json.loads(base64.b64decode(base64_str))
+    return hashlib.sha256((token or '').encode()).hexdigest()
+
 
+def token_expires_at(token: str) -> float:
+    """Returns the expiry time of a JWT from its `exp` claim.
 
-def encode_base64_dict(data: dict) -> str:
-    """Encode dict into base64
+    The token isn't verified, use the result only to expire data cached
+    for the token sooner.
 
-    :param base64_str: Base64 encoded data
-    :type base64_str: str
-    :return: Data
-    :rtype: dict
+    :param token: Token, optionally prefixed with its type, e.g. "Bearer".
+    :type token: str
+    :return: Unix time, None if the token isn't a JWT with an `exp` claim.
+    :rtype: float
     """
-    encode_data = base64.b64encode(json.dumps(data).encode())
-    encode_data = encode_data.decode()
+    parts = (token or '').rsplit(' ', 1)[-1].split('.')
 
-    return encode_data
+    if len(parts) != 3:
+        return None
 
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(
+            parts[1] + '=' * (-len(parts[1]) % 4)))
+        expires = claims.get('exp')
+    except (ValueError, TypeError, AttributeError):
+        return None
 
-def hash_sha1(salt: str, data_bytes: bytes) -> str:
-    """Hash data and return decoded string
+    if isinstance(expires, bool) or not isinstance(expires, (int, float)):
+        return None
 
-    :param salt: Salt for hashing
-    :type salt: str
-    :param data_bytes: Data in bytes
-    :type data_bytes: bytes
-    :return: Hash
-    :rtype: str
-    """
-    hash = hmac.new(salt.encode(), data_bytes, hashlib.sha1).digest()
-    return hexlify(hash).decode()
+    return float(expires)
@@ -1,6 +1,10 @@
 #!/usr/bin/env sh
 set -exuo pipefail
 
-set -- pipenv run invoke dev
+if [ "${ENV}" = "production" ]; then
+    set -- pipenv run invoke prod
+else
+    set -- pipenv run invoke dev
+fi
 
 exec "$@"
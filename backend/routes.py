@@ -5,34 +5,59 @@ JSONResponse class to send json responses
 """
 import app.controllers as controllers
 import bottle
-from webargs.bottleparser import use_args
+import settings
+from common.admission import AdmissionPlugin
+from common.body import json_args
+from common.compression import CompressionPlugin
+from common.deadlines import DeadlinePlugin
+from common.metrics import MetricsPlugin
+from common.utils import use_args
 
-# Instantiate the controllers here, for easy mocking.
+# Declare the controllers here, for easy mocking. They are created on their
+# first request unless settings.LAZY_CONTROLLERS is off.
 
-status = controllers.Status()
-login = controllers.Login()
-identity = controllers.Identity()
-broker = controllers.Broker()
+status = controllers.LazyController(controllers.Status)
+login = controllers.LazyController(controllers.Login)
+identity = controllers.LazyController(controllers.Identity)
+broker = controllers.LazyController(controllers.Broker)
 
 
 def setup_routing(app: bottle.Bottle):
-    status.set_app(app)
-    login.set_app(app)
-    identity.set_app(app)
-    broker.set_app(app)
+    for controller in (status, login, identity, broker):
+        controller.set_app(app)
+
+        if not settings.LAZY_CONTROLLERS:
+            controller.get()
+
+    app.install(MetricsPlugin())
+    app.install(AdmissionPlugin())
+    app.install(CompressionPlugin())
+    app.install(controllers.UpstreamErrorPlugin())
+    app.install(DeadlinePlugin())
 
     # index
-    app.route('/health', 'GET', status.health_check)
+    app.route('/health', 'GET', status.action('health_check'))
+    app.route('/ready', 'GET', status.action('ready'))
+    app.route('/stats', 'GET', status.action('stats'))
+    app.route('/metrics', 'GET', status.action('metrics'))
 
     # identities
-    app.route('/identities/<id>', 'GET', identity.read)
+    app.route('/identities/batch', 'POST', identity.action('batch'),
+              apply=use_args(controllers.Identity.batch.args))
+    app.route('/identities/<id>', 'GET', identity.action('read'))
 
     # login
-    app.route('/exchangeToken', 'GET', login.exchange_token)
-    app.route('/me', 'GET', login.me)
-    app.route('/login', 'GET', login.login)
-    app.route('/logout', 'GET', login.logout)
+    app.route('/exchangeToken', 'GET', login.action('exchange_token'))
+    app.route('/me', 'GET', login.action('me'))
+    app.route('/login', 'GET', login.action('login'))
+    app.route('/logout', 'GET', login.action('logout'))
 
     # broker
-    app.route('/fetch-data-product', 'POST', broker.fetch,
-              apply=use_args(broker.fetch.args))
+    app.route('/fetch-data-product', 'POST', broker.action('fetch'),
+              apply=json_args(controllers.Broker.fetch.args))
+    app.route('/fetch-data-product/jobs/<id>', 'GET', broker.action('job'))
+    app.route('/fetch-data-products', 'POST', broker.action('fetch_many'),
+              apply=use_args(controllers.Broker.fetch_many.args))
+    app.route('/fetch-data-product/live', 'GET', broker.action('live'),
+              apply=use_args(controllers.Broker.live.args,
+                             locations=('query',)))
@@ -1,11 +1,15 @@
+import os
+
 # One place to change the environment names.
 ENV_DEVELOPMENT = 'development'
+ENV_PRODUCTION = 'production'
 
 SUPPORTED_ENVIRONMENTS = [
     ENV_DEVELOPMENT,
+    ENV_PRODUCTION,
 ]
 
-ENV = ENV_DEVELOPMENT
+ENV = os.environ.get('ENV', ENV_DEVELOPMENT)
 
 # server backend (cherrypy, gunicorn, waitress, tornado, wsgiref, ...)
 # if set to '', a default server backend will be used
@@ -16,11 +20,38 @@ HOST = '0.0.0.0'
 # define port
 PORT = 8080
 
+# Max number of concurrent connections served by async_application.py.
+ASYNC_MAX_CONNECTIONS = 10000
+
+# Production server (`invoke prod`), pre-forked uWSGI workers.
+# Number of worker processes, defaults to the number of cores.
+WORKERS = os.cpu_count() or 1
+# Request handling threads per worker.
+WORKER_THREADS = 8
+# Recycle a worker after it has served this many requests.
+WORKER_MAX_REQUESTS = 10000
+# Seconds a recycled worker gets to finish its in-flight requests.
+WORKER_RELOAD_MERCY = 30
+# Writing `c` to the fifo restarts the workers one by one without downtime.
+WORKER_MASTER_FIFO = '/tmp/sample-app-uwsgi.fifo'
+
+# Startup. Controllers are created on their first request instead of when
+# the routes are set up, so new processes start serving sooner.
+LAZY_CONTROLLERS = True
+# Resolve the upstream hosts and open `connections` keep-alive connections
+# per API before /ready reports the process as ready. A failed warm-up
+# doesn't keep the process from becoming ready.
+WARM_UP = {
+    'enabled': ENV == ENV_PRODUCTION,
+    'apis': ('login', 'identity', 'broker'),
+    'connections': 2
+}
+
 # debug error messages
-DEBUG = True
+DEBUG = ENV == ENV_DEVELOPMENT
 
 # auto-reload
-RELOAD = True
+RELOAD = ENV == ENV_DEVELOPMENT
 
 GRANT_TYPES = {
     'authorization': 'authorization',
@@ -30,6 +61,10 @@ RESPONSE_TYPE = 'code'
 
 OAUTH_STATE_SALT = 'example-state-salt'
 OAUTH_STATE_EXPIRES_IN = 24 * 60 * 60
+# Max number of used OAuth state nonces remembered to prevent replays. The
+# nonces are remembered per worker process, so under uWSGI a state can be
+# replayed once on each of the other workers until it expires.
+OAUTH_STATE_NONCES = 100000
 
 SSL_ENABLED = False
 
@@ -39,6 +74,246 @@ BROKER_API_URL = 'https://api-sandbox.oftrust.net/broker/v1'
 IDENTITY_API_URL = 'https://api-sandbox.oftrust.net/identities/v1'
 LOGIN_APP_API_URL = 'https://login-sandbox.oftrust.net/api'
 
+# Keep-alive connection pools for the upstream APIs, one pool per API.
+# `size` is the max number of connections kept open, `block` makes requests
+# wait for a free connection instead of opening extra ones and idle pools
+# drop their connections after `idle_timeout` seconds.
+UPSTREAM_POOL_DEFAULTS = {
+    'size': 10,
+    'block': False,
+    'idle_timeout': 60
+}
+# Per API overrides for the defaults above.
+UPSTREAM_POOLS = {
+    'login': {},
+    'identity': {},
+    'broker': {}
+}
+
+# Upstream connect and read timeouts in seconds per API.
+UPSTREAM_TIMEOUTS = {
+    'login': (3.05, 10),
+    'identity': (3.05, 10),
+    'broker': (3.05, 30)
+}
+# Retries of failed idempotent (GET) upstream requests. The backoff before
+# retry n is random between 0 and min(max_backoff, backoff * 2 ** n).
+UPSTREAM_RETRIES = {
+    'attempts': 2,
+    'backoff': 0.05,
+    'max_backoff': 1
+}
+# Circuit breaker per upstream API. The circuit opens when `error_threshold`
+# of the latest `window` calls (at least `min_calls`) failed, and lets
+# `half_open_probes` calls through after `open_seconds`.
+CIRCUIT_BREAKER = {
+    'error_threshold': 0.5,
+    'window': 20,
+    'min_calls': 10,
+    'open_seconds': 30,
+    'half_open_probes': 1
+}
+
+# Upstream API requests in flight at once per process and API, more are
+# rejected with 503 right away instead of piling up behind a slow API.
+# Streamed responses count until their body has been relayed. None for no
+# limit.
+UPSTREAM_MAX_IN_FLIGHT = {
+    'login': 50,
+    'identity': 100,
+    'broker': 50
+}
+
+# Admission control. Every client (Authorization cookie or IP address) may
+# send `rate` requests per second with bursts of `burst` requests, more are
+# answered with 429. At most `maxsize` clients are tracked.
+RATE_LIMIT = {
+    'enabled': True,
+    'rate': 20,
+    'burst': 40,
+    'maxsize': 10000
+}
+# Long-lived requests, i.e. the live updates and long-polled jobs, held
+# open at once per process. They don't count against
+# MAX_IN_FLIGHT_REQUESTS, so idle subscribers can't make the other requests
+# shed. None for no limit.
+LONG_LIVED_ROUTES = ('/fetch-data-product/live',
+                     '/fetch-data-product/jobs/<id>')
+MAX_LONG_LIVED_REQUESTS = 2
+# Other requests handled at once per process, more are answered with 503
+# right away. Both limits together are kept below WORKER_THREADS, so the
+# exempt routes always find a free thread. Streamed responses hold their
+# slot until they have been sent. None for no limit.
+MAX_IN_FLIGHT_REQUESTS = WORKER_THREADS - MAX_LONG_LIVED_REQUESTS - 1
+# Routes without admission control.
+ADMISSION_EXEMPT_ROUTES = ('/health', '/ready', '/metrics')
+
+# End-to-end request deadlines in seconds. Clients can set their own with
+# the header, up to REQUEST_DEADLINE_MAX. Otherwise the route default is
+# used. Upstream timeouts are shortened to the time left and upstream calls
+# are skipped with a 504 when less than REQUEST_DEADLINE_MIN_BUDGET is left.
+REQUEST_DEADLINE_HEADER = 'X-Request-Timeout'
+REQUEST_DEADLINE_DEFAULT = 15
+REQUEST_DEADLINE_MAX = 60
+REQUEST_DEADLINE_MIN_BUDGET = 0.05
+REQUEST_DEADLINES = {
+    '/fetch-data-product': 30,
+    '/fetch-data-products': 30,
+    '/fetch-data-product/jobs/<id>': 30
+}
+
+# Hedged GET requests for Identity.read and Login.me. A second request is
+# sent if the first hasn't answered after the `percentile` of the recent
+# response times (at least `min_delay` seconds). Hedges are limited to
+# `budget` share of the requests. Until `min_samples` response times are
+# known, requests are sent without hedging on the calling thread. Otherwise
+# the attempts run in a pool of `workers` threads, None sizes it from
+# UPSTREAM_MAX_IN_FLIGHT, so the pool never limits the upstream requests
+# more than those limits do.
+HEDGING = {
+    'enabled': False,
+    'percentile': 95,
+    'min_delay': 0.05,
+    'budget': 0.05,
+    'samples': 1000,
+    'min_samples': 20,
+    'workers': None
+}
+
+# Relay upstream response bodies to the client chunk by chunk instead of
+# reading them into memory first. Cached responses are always buffered.
+STREAM_RESPONSES = True
+STREAM_CHUNK_SIZE = 64 * 1024
+# A streamed broker API response is only kept in memory when identical
+# requests are waiting for it, and only up to this size. Larger ones are
+# fetched again by the waiting requests.
+STREAM_SHARE_MAX_BYTES = 1024 * 1024
+
+# Response compression, negotiated from Accept-Encoding in the order of
+# `encodings`. br and zstd need the optional brotli and zstandard packages.
+# Bodies smaller than `min_size` bytes are sent uncompressed.
+COMPRESSION = {
+    'enabled': True,
+    'min_size': 1024,
+    'encodings': ('zstd', 'br', 'gzip'),
+    'levels': {
+        'gzip': 6,
+        'br': 4,
+        'zstd': 3
+    },
+    'types': ('application/json', 'application/x-ndjson', 'text/')
+}
+
+# Latency histogram buckets of the /metrics endpoint, in seconds.
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Per token cache for Login.me. Entries expire after `ttl` seconds, or
+# earlier when the token expires according to its `exp` claim or because it
+# was issued by this process. The cache is per worker process and logout
+# only clears it in the worker handling the logout, so other workers can
+# serve /me for up to `ttl` seconds after a logout. Keep it short.
+ME_CACHE = {
+    'maxsize': 10000,
+    'ttl': 60,
+    'max_bytes': 16 * 1024 * 1024
+}
+
+# Per user cache for Identity.read. Stale entries are revalidated with
+# If-None-Match/If-Modified-Since. `ttl` is in seconds.
+IDENTITY_CACHE = {
+    'maxsize': 10000,
+    'ttl': 30,
+    'max_bytes': 32 * 1024 * 1024
+}
+
+# POST /identities/batch, max number of ids per request, the max number of
+# identity API requests in flight per request and in total.
+IDENTITY_BATCH_MAX_IDS = 500
+IDENTITY_BATCH_CONCURRENCY = 10
+IDENTITY_BATCH_WORKERS = 50
+
+# Limits of the POST /fetch-data-product body. Larger bodies are rejected
+# with 413 as soon as the limit is exceeded, bodies nested deeper than
+# `max_depth` levels or with more than `max_keys` object keys with 400.
+REQUEST_BODY_LIMITS = {
+    'max_bytes': 64 * 1024,
+    'max_depth': 16,
+    'max_keys': 1000
+}
+
+# Cache for Broker.fetch responses, keyed by product code and parameters.
+# `ttl` is the default TTL in seconds, 0 disables caching.
+BROKER_CACHE = {
+    'maxsize': 1000,
+    'ttl': 0,
+    'max_bytes': 64 * 1024 * 1024
+}
+# Cache TTLs in seconds by product code, override the default TTL.
+BROKER_CACHE_TTLS = {}
+# Stale broker cache entries are served for up to this many seconds after
+# they expired, while they are refreshed in the background. 0 disables
+# serving stale responses.
+BROKER_MAX_STALE = 30
+# Requests are counted per product code and parameters, the counts halve
+# every `half_life` seconds. Every `interval` seconds, the `top_k` most
+# requested products with at least `min_requests` requests per half-life are
+# refreshed `refresh_ahead` seconds before they expire, by a pool of
+# `workers` threads. Only products with a cache TTL are prefetched.
+BROKER_PREFETCH = {
+    'enabled': True,
+    'top_k': 20,
+    'min_requests': 2,
+    'interval': 1,
+    'refresh_ahead': 5,
+    'half_life': 300,
+    'max_tracked': 1000,
+    'workers': 4
+}
+# Second tier of the broker cache, an SQLite database shared by the worker
+# processes, which survives restarts. Values are stored zlib compressed,
+# `max_bytes` is the max total compressed size.
+BROKER_DISK_CACHE = {
+    'enabled': True,
+    'path': os.path.join(
+        os.environ.get('CACHE_DIR', '/tmp/sample-app-cache'), 'broker.db'),
+    'max_bytes': 256 * 1024 * 1024,
+    'compress_level': 6
+}
+
+# POST /fetch-data-products, max number of products per request, the max
+# number of broker API requests in flight per request and in total.
+BROKER_BULK_MAX_PRODUCTS = 50
+BROKER_BULK_CONCURRENCY = 10
+BROKER_BULK_WORKERS = 50
+
+# Async mode of POST /fetch-data-product, used when the request has a
+# `Prefer: respond-async` header. Fetches run in a pool of `workers`
+# threads, at most `max_pending` wait for a thread, more are answered with
+# 503. Unfinished jobs are always kept, finished ones for `ttl` seconds, at
+# most `maxsize` of them. GET
+# /fetch-data-product/jobs/<id>?wait=<seconds> waits up to `max_wait`
+# seconds for the job to finish.
+BROKER_JOBS = {
+    'workers': 10,
+    'max_pending': 100,
+    'maxsize': 1000,
+    'ttl': 300,
+    'max_wait': 25
+}
+
+# GET /fetch-data-product/live, server-sent events pushed when the data
+# product changes. Each distinct product code and parameters is polled by
+# one thread every `interval` seconds (per product code in
+# BROKER_LIVE_INTERVALS) while it has subscribers. A comment is sent every
+# `heartbeat` seconds to keep idle connections open. Every subscriber holds
+# a worker thread, serve many subscribers with the gevent server.
+BROKER_LIVE = {
+    'interval': 5,
+    'heartbeat': 15,
+    'max_topics': 1000
+}
+BROKER_LIVE_INTERVALS = {}
+
 APP_HOST = 'sample-app.local:32600'
 
 APP_URL = f'{"https" if SSL_ENABLED else "http"}://{APP_HOST}'
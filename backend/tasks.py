@@ -1,5 +1,6 @@
 from pathlib import Path
 from invoke import task
+import settings
 
 # define projects directories
 app_dir = Path('.')
@@ -10,3 +11,65 @@ def dev(ctx):
     """Run the application (use when developing)."""
     ctx.run("pipenv install --dev")
     ctx.run("python application.py")
+
+
+@task
+def serve_async(ctx):
+    """Run the application on the gevent event loop."""
+    ctx.run("pipenv install --dev")
+    ctx.run("python async_application.py")
+
+
+@task
+def prod(ctx):
+    """Run the application with pre-forked uWSGI workers."""
+    # Apps are loaded lazily in every worker after the fork, so workers
+    # don't share upstream connection pools and can be reloaded one by one.
+    options = [
+        '--master',
+        '--die-on-term',
+        '--need-app',
+        '--lazy-apps',
+        f'--http-socket {settings.HOST}:{settings.PORT}',
+        '--wsgi-file application.py',
+        '--callable application',
+        f'--processes {settings.WORKERS}',
+        f'--threads {settings.WORKER_THREADS}',
+        f'--max-requests {settings.WORKER_MAX_REQUESTS}',
+        f'--worker-reload-mercy {settings.WORKER_RELOAD_MERCY}',
+        f'--master-fifo {settings.WORKER_MASTER_FIFO}',
+    ]
+
+    ctx.run(f"uwsgi {' '.join(options)}")
+
+
+@task
+def reload(ctx):
+    """Restart the production workers one by one without downtime."""
+    ctx.run(f"echo c > {settings.WORKER_MASTER_FIFO}")
+
+
+@task
+def test(ctx):
+    """Run the unit tests."""
+    ctx.run("python -m unittest discover -s tests -t .")
+
+
+@task
+def bench(ctx, server=None, duration=5, concurrency=10):
+    """Run the benchmark suite against a local fake upstream."""
+    options = f"--duration {duration} --concurrency {concurrency}"
+    if server:
+        options += f" --server {server}"
+
+    ctx.run(f"python -m benchmarks.run {options}")
+
+
+@task
+def bench_startup(ctx, server=None, repeat=3):
+    """Measure the startup and first requests of the application."""
+    options = f"--repeat {repeat}"
+    if server:
+        options += f" --server {server}"
+
+    ctx.run(f"python -m benchmarks.startup {options}")
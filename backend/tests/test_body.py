@@ -0,0 +1,230 @@
+"""
+Tests of the bounded JSON request body parsing.
+"""
+import io
+import json
+import unittest
+from unittest import mock
+
+import bottle
+import settings
+from common import body
+from common.body import BodyError
+
+LIMITS = {'max_bytes': 1024, 'max_depth': 4, 'max_keys': 10}
+
+
+def scan(document: bytes, chunk_size: int = None, max_depth: int = 4,
+         max_keys: int = 10) -> body._Scanner:
+    """Returns the scanner after feeding it the document in chunks."""
+    scanner = body._Scanner(max_depth, max_keys)
+    chunk_size = chunk_size or len(document) or 1
+
+    for i in range(0, len(document), chunk_size):
+        scanner.feed(document[i:i + chunk_size])
+
+    return scanner
+
+
+def chunked(*parts: bytes, trailer: bytes = b'') -> bytes:
+    """Returns the parts in the chunked transfer coding."""
+    return b''.join(b'%x\r\n%s\r\n' % (len(part), part)
+                    for part in parts) + b'0\r\n' + trailer + b'\r\n'
+
+
+def request(data: bytes, **environ) -> bottle.BaseRequest:
+    """Returns a request with the body data."""
+    environ.setdefault('CONTENT_LENGTH', str(len(data)))
+    environ['wsgi.input'] = io.BytesIO(data)
+
+    return bottle.BaseRequest(environ)
+
+
+class ScannerTest(unittest.TestCase):
+    DOCUMENT = json.dumps({
+        'a': [1, {'b': '{[:'}],
+        'c': 'quote \\" and slash \\\\',
+        'd\\"': {'e': None}
+    }).encode('utf-8')
+
+    def test_counts(self):
+        for chunk_size in (None, 1, 2, 3, 7):
+            with self.subTest(chunk_size=chunk_size):
+                scanner = scan(self.DOCUMENT, chunk_size)
+
+                self.assertEqual(scanner._depth, 0)
+                self.assertEqual(scanner._keys, 5)
+                self.assertFalse(scanner._in_string)
+
+    def test_escape_at_chunk_end(self):
+        scanner = scan(b'{"a": "x\\\\", "b": "y\\"}"}', 9)
+
+        self.assertEqual((scanner._depth, scanner._keys), (0, 2))
+
+    def test_max_depth(self):
+        scan(b'[[[[1]]]]', 1)
+
+        for chunk_size in (None, 1):
+            with self.subTest(chunk_size=chunk_size):
+                with self.assertRaises(BodyError) as context:
+                    scan(b'[[[[[1]]]]]', chunk_size)
+
+                self.assertEqual(context.exception.status, 400)
+
+    def test_max_keys(self):
+        document = json.dumps({str(i): i for i in range(11)}).encode()
+
+        with self.assertRaises(BodyError) as context:
+            scan(document, 5)
+
+        self.assertEqual(context.exception.status, 400)
+
+
+class ChunkedTest(unittest.TestCase):
+    def read(self, data: bytes, max_bytes: int = 1024) -> bytes:
+        return b''.join(body._iter_chunked(io.BytesIO(data), max_bytes))
+
+    def assertStatus(self, data: bytes, status: int, max_bytes: int = 1024):
+        with self.assertRaises(BodyError) as context:
+            self.read(data, max_bytes)
+
+        self.assertEqual(context.exception.status, status)
+
+    def test_good(self):
+        self.assertEqual(self.read(chunked(b'{"a"', b': 1}')), b'{"a": 1}')
+        self.assertEqual(self.read(chunked()), b'')
+
+    def test_extensions_and_trailer(self):
+        data = b'4;name=value\r\n{"a"\r\n4\r\n: 1}\r\n0\r\n' \
+               b'Checksum: x\r\n\r\n'
+
+        self.assertEqual(self.read(data), b'{"a": 1}')
+
+    def test_truncated(self):
+        data = chunked(b'{"a"', b': 1}')
+
+        for end in (3, 6, 10, 14, len(data) - 5):
+            with self.subTest(end=end):
+                self.assertStatus(data[:end], 400)
+
+    def test_invalid(self):
+        for data in (b'x\r\n{}\r\n0\r\n\r\n', b'2\r\n{}XX0\r\n\r\n',
+                     b'2\r\n{}}\r\n0\r\n\r\n', b'f' * 2000 + b'\r\n'):
+            with self.subTest(data=data[:20]):
+                self.assertStatus(data, 400)
+
+    def test_oversized(self):
+        self.assertStatus(chunked(b'x' * 600, b'x' * 600), 413)
+
+    def test_oversized_chunk_size(self):
+        # Rejected on the declared size, before the data is read.
+        self.assertStatus(b'fffffff\r\n', 413)
+
+
+class ReadJSONTest(unittest.TestCase):
+    def test_content_length(self):
+        self.assertEqual(body.read_json(request(b'{"a": [1]}'), **LIMITS),
+                         {'a': [1]})
+
+    def test_chunked(self):
+        req = request(chunked(b'{"a"', b': [1]}'),
+                      HTTP_TRANSFER_ENCODING='chunked', CONTENT_LENGTH='')
+
+        self.assertEqual(body.read_json(req, **LIMITS), {'a': [1]})
+
+    def test_dechunked_by_server(self):
+        req = request(b'{"a": [1]}', HTTP_TRANSFER_ENCODING='chunked',
+                      CONTENT_LENGTH='', **{'wsgi.input_terminated': True})
+
+        self.assertEqual(body.read_json(req, **LIMITS), {'a': [1]})
+
+    def test_dechunked_by_server_oversized(self):
+        req = request(b'"' + b'x' * 2000 + b'"',
+                      HTTP_TRANSFER_ENCODING='chunked', CONTENT_LENGTH='',
+                      **{'wsgi.input_terminated': True})
+
+        with self.assertRaises(BodyError) as context:
+            body.read_json(req, **LIMITS)
+
+        self.assertEqual(context.exception.status, 413)
+
+    def test_oversized_content_length(self):
+        with self.assertRaises(BodyError) as context:
+            body.read_json(request(b'[' + b'1,' * 600 + b'1]'), **LIMITS)
+
+        self.assertEqual(context.exception.status, 413)
+
+    def test_invalid_json(self):
+        for data in (b'{"a": }', b'\xff', b''):
+            with self.subTest(data=data):
+                with self.assertRaises(BodyError) as context:
+                    body.read_json(request(data), **LIMITS)
+
+                self.assertEqual(context.exception.status, 400)
+
+
+class SchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.validate = body.compile_schema({'code': str, 'params': dict})
+
+    def test_valid(self):
+        self.assertEqual(
+            self.validate({'code': 'a', 'params': {}, 'other': 1}),
+            {'code': 'a', 'params': {}})
+
+    def test_invalid(self):
+        with self.assertRaises(BodyError) as context:
+            self.validate({'code': 1})
+
+        self.assertEqual(context.exception.status, 422)
+        self.assertEqual(context.exception.errors, {
+            'code': ['Not a valid string.'],
+            'params': ['Missing data for required field.']
+        })
+
+    def test_not_an_object(self):
+        with self.assertRaises(BodyError) as context:
+            self.validate([1])
+
+        self.assertEqual(set(context.exception.errors), {'code', 'params'})
+
+
+class JSONArgsTest(unittest.TestCase):
+    def setUp(self):
+        self.callback = body.json_args({'code': str})(lambda args: args)
+        patcher = mock.patch.dict(settings.REQUEST_BODY_LIMITS, LIMITS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def call(self, data: bytes):
+        """Returns the result of the callback for a request body."""
+        bottle.request.bind(request(data).environ)
+
+        return self.callback()
+
+    def assertError(self, data: bytes, status: int, errors):
+        with self.assertRaises(bottle.HTTPError) as context:
+            self.call(data)
+
+        self.assertEqual(context.exception.status_code, status)
+        self.assertEqual(context.exception.body, errors)
+
+    def test_valid(self):
+        self.assertEqual(self.call(b'{"code": "a"}'), {'code': 'a'})
+
+    def test_invalid_like_webargs(self):
+        missing = {'code': ['Missing data for required field.']}
+
+        for data in (b'{}', b'[1]', b'{"code": }'):
+            with self.subTest(data=data):
+                self.assertError(data, 422, missing)
+
+    def test_limits(self):
+        self.assertError(b'[' * 5 + b']' * 5, 400,
+                         'Request body is nested deeper than 4 levels')
+        self.assertError(b'"' + b'x' * 2000 + b'"', 413,
+                         'Request body is larger than 1024 bytes')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,312 @@
+"""
+Tests of the in-process and on-disk caches and of call coalescing.
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from common import deadlines
+from common.cache import DiskCache, SingleFlight, TTLCache
+
+
+class Timeout(Exception):
+    pass
+
+
+class Retry(Exception):
+    pass
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flight = SingleFlight('test', retry_on=(Retry,),
+                                   timeout_error=Timeout)
+        self.calls = 0
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def blocked(self, value):
+        self.calls += 1
+        self.release.wait(5)
+
+        if isinstance(value, BaseException):
+            raise value
+
+        return value
+
+    def follow(self, key, value) -> tuple:
+        """Start a caller in a thread.
+
+        :return: Tuple of the thread and the list its outcome is appended
+            to.
+        """
+        outcomes = []
+
+        def run():
+            try:
+                outcomes.append(self.flight.do(key, self.blocked, value))
+            except Exception as e:
+                outcomes.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+
+        return thread, outcomes
+
+    def wait_for_waiters(self, call, waiters: int):
+        for _ in range(500):
+            if self.flight.waiters(call) == waiters:
+                return
+
+            time.sleep(0.01)
+
+        self.fail(f'{waiters} callers never waited')
+
+    def test_coalesced(self):
+        call = self.flight.begin('key')
+        followers = [self.follow('key', 'own') for _ in range(3)]
+        self.wait_for_waiters(call, 3)
+
+        self.flight.end('key', call, 'shared')
+
+        for thread, outcomes in followers:
+            thread.join(5)
+            self.assertEqual(outcomes, ['shared'])
+
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(self.flight.coalesced, 3)
+        self.assertEqual(self.flight.waiters(call), 0)
+
+    def test_do_runs_once(self):
+        leader, led = self.follow('key', 'value')
+
+        for _ in range(500):
+            if self.calls:
+                break
+
+            time.sleep(0.01)
+
+        follower, followed = self.follow('key', 'other')
+
+        for _ in range(500):
+            if self.flight.coalesced:
+                break
+
+            time.sleep(0.01)
+
+        self.release.set()
+        leader.join(5)
+        follower.join(5)
+
+        self.assertEqual(led, ['value'])
+        self.assertEqual(followed, ['value'])
+        self.assertEqual(self.calls, 1)
+
+    def test_begin_while_in_flight(self):
+        call = self.flight.begin('key')
+
+        self.assertIsNone(self.flight.begin('key'))
+        self.assertIsNotNone(self.flight.begin('other'))
+
+        self.flight.end('key', call, 'value')
+
+        self.assertEqual(call.result(), 'value')
+        self.assertIsNotNone(self.flight.begin('key'))
+
+    def test_exception_is_shared(self):
+        call = self.flight.begin('key')
+        follower, outcomes = self.follow('key', 'own')
+        self.wait_for_waiters(call, 1)
+
+        error = ValueError('failed')
+        self.flight.end('key', call, exception=error)
+        follower.join(5)
+
+        self.assertEqual(outcomes, [error])
+
+    def test_retry(self):
+        for kwargs in ({'retry': True}, {'exception': Retry()}):
+            with self.subTest(**kwargs):
+                self.release.set()
+                call = self.flight.begin('key')
+                follower, outcomes = self.follow('key', 'own')
+                self.wait_for_waiters(call, 1)
+
+                self.flight.end('key', call, **kwargs)
+                follower.join(5)
+
+                # The waiting caller ran the function itself.
+                self.assertEqual(outcomes, ['own'])
+
+    def test_deadline_of_waiting_caller(self):
+        call = self.flight.begin('key')
+
+        with deadlines.scope(time.monotonic() + 0.05):
+            with self.assertRaises(Timeout):
+                self.flight.do('key', self.blocked, 'own')
+
+        self.assertEqual(self.flight.waiters(call), 0)
+        self.assertEqual(self.calls, 0)
+
+
+class TTLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('common.cache.time.monotonic',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_expiry(self):
+        cache = TTLCache('test_expiry', ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=20)
+
+        self.now += 10
+        self.assertEqual(cache.get('a'), None)
+        # Expired entries can still be revalidated.
+        self.assertEqual(cache.lookup('a'), (1, False))
+        self.assertEqual(cache.lookup('b'), (2, True))
+        self.assertEqual(cache.expires_in('b'), 10)
+
+        self.assertTrue(cache.refresh('a'))
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_add_keeps_fresh_entries(self):
+        cache = TTLCache('test_add', ttl=10)
+
+        self.assertTrue(cache.add('a', 1))
+        self.assertFalse(cache.add('a', 2))
+
+        self.now += 10
+        self.assertTrue(cache.add('a', 3))
+        self.assertEqual(cache.get('a'), 3)
+
+    def test_lru_eviction(self):
+        cache = TTLCache('test_lru', maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_max_bytes(self):
+        cache = TTLCache('test_bytes', max_bytes=10)
+        cache.set('a', 1, size=4)
+        cache.set('b', 2, size=4)
+
+        self.assertFalse(cache.set('large', 0, size=11))
+
+        cache.set('a', 1, size=6)
+        cache.set('c', 3, size=4)
+
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['bytes'], 10)
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.db')
+
+        self.now = 1000.0
+        patcher = mock.patch('common.cache.time.time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache(self, max_bytes: int = 1024 * 1024) -> DiskCache:
+        cache = DiskCache('test', self.path, max_bytes)
+        self.addCleanup(lambda: cache._connection and
+                        cache._connection.close())
+
+        return cache
+
+    def set(self, cache: DiskCache, key: str, value: bytes, ttl: float = 60):
+        self.assertTrue(cache.set(key, value, ttl))
+        self.now += 1
+
+    def test_get(self):
+        cache = self.cache()
+        self.set(cache, 'a', b'value', ttl=10)
+
+        self.assertEqual(cache.get('a'), (b'value', 9))
+
+        self.now += 9
+        self.assertEqual(cache.get('a'), (None, 0))
+        self.assertEqual(cache.get('b'), (None, 0))
+
+    def test_lru_eviction(self):
+        # Random values don't compress, each takes a bit more than 100 bytes.
+        cache = self.cache(max_bytes=350)
+        values = {key: os.urandom(100) for key in 'abcd'}
+
+        for key in 'abc':
+            self.set(cache, key, values[key])
+
+        cache.get('a')
+        self.set(cache, 'd', values['d'])
+
+        self.assertEqual(cache.get('b'), (None, 0))
+
+        for key in 'acd':
+            self.assertEqual(cache.get(key)[0], values[key])
+
+        stats = cache.stats()
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_expired_entries_are_evicted_first(self):
+        cache = self.cache(max_bytes=350)
+        self.set(cache, 'a', os.urandom(100))
+        self.set(cache, 'b', os.urandom(100), ttl=1)
+        self.set(cache, 'c', os.urandom(100))
+        self.set(cache, 'd', os.urandom(100))
+
+        self.assertIsNotNone(cache.get('a')[0])
+        self.assertEqual(cache.stats()['entries'], 3)
+
+    def test_running_total(self):
+        cache = self.cache()
+        self.set(cache, 'a', os.urandom(100))
+        self.set(cache, 'b', os.urandom(200))
+        self.set(cache, 'a', os.urandom(50))
+        cache.delete('b')
+
+        with sqlite3.connect(self.path) as connection:
+            size = connection.execute(
+                'SELECT SUM(size) FROM entries').fetchone()[0]
+
+        self.assertEqual(cache.stats()['bytes'], size)
+
+        # The total of an existing database is summed up once.
+        cache._connection.execute('DROP TABLE total')
+        cache._connection.close()
+        cache._connection = None
+        self.assertEqual(self.cache().stats()['bytes'], size)
+
+    def test_corrupt_entry(self):
+        cache = self.cache()
+        self.set(cache, 'a', b'value')
+        cache._connection.execute(
+            "UPDATE entries SET value = X'00' WHERE key = 'a'")
+
+        self.assertEqual(cache.get('a'), (None, 0))
+
+        stats = cache.stats()
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['entries'], 0)
+        self.assertEqual(stats['bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
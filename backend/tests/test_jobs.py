@@ -0,0 +1,65 @@
+"""
+Tests of the background job queue.
+"""
+import threading
+import unittest
+
+from common.jobs import Job, JobQueue
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def blocked(self, value):
+        self.release.wait(5)
+        return value
+
+    def test_unfinished_jobs_are_not_evicted(self):
+        queue = JobQueue('test_unfinished', workers=2, max_pending=10,
+                         maxsize=2)
+        jobs = [queue.submit(self.blocked, i) for i in range(6)]
+
+        for job in jobs:
+            self.assertIs(queue.get(job.id), job)
+
+        self.release.set()
+
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+
+        self.assertEqual([job.result for job in jobs], list(range(6)))
+        # Only `maxsize` finished jobs are kept.
+        kept = [job for job in jobs if queue.get(job.id) is not None]
+        self.assertEqual(len(kept), 2)
+        self.assertTrue(all(job.state == Job.DONE for job in kept))
+
+    def test_pending_limit(self):
+        queue = JobQueue('test_pending', workers=1, max_pending=2)
+        started = threading.Event()
+
+        def first():
+            started.set()
+            return self.blocked(None)
+
+        queue.submit(first)
+        started.wait(5)
+
+        self.assertIsNotNone(queue.submit(self.blocked, 1))
+        self.assertIsNotNone(queue.submit(self.blocked, 2))
+        self.assertIsNone(queue.submit(self.blocked, 3))
+        self.assertEqual(queue.stats()['rejected'], 1)
+
+    def test_failed_job(self):
+        queue = JobQueue('test_failed', workers=1)
+        job = queue.submit(lambda: 1 / 0)
+
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.state, Job.FAILED)
+        self.assertIsInstance(job.result, ZeroDivisionError)
+        self.assertIs(queue.get(job.id), job)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Tests of the striped metrics.
+"""
+import threading
+import unittest
+
+from common import metrics
+
+
+class CounterTest(unittest.TestCase):
+    def setUp(self):
+        self.counter = metrics.Counter('test_total', 'Test counter.',
+                                       ('name',))
+        self.addCleanup(metrics._metrics.remove, self.counter)
+
+    def test_threads_spread_over_stripes(self):
+        threads_count = 8
+        increments = 1000
+        barrier = threading.Barrier(threads_count)
+
+        def count():
+            barrier.wait()
+            for _ in range(increments):
+                self.counter.inc(('a',))
+            self.counter.inc(('b',), 0.5)
+
+        threads = [threading.Thread(target=count)
+                   for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        used = [values for values, _ in self.counter._stripes if values]
+        self.assertEqual(len(used), threads_count)
+        self.assertEqual(self.counter.collect(), {
+            ('a',): threads_count * increments,
+            ('b',): threads_count * 0.5
+        })
+
+    def test_same_thread_same_stripe(self):
+        self.assertEqual(metrics._stripe_index(), metrics._stripe_index())
+
+    def test_render(self):
+        self.counter.inc(('x"y',), 2)
+
+        self.assertEqual(self.counter.render(), [
+            '# HELP test_total Test counter.',
+            '# TYPE test_total counter',
+            'test_total{name="x\\"y"} 2'
+        ])
+
+
+class HistogramTest(unittest.TestCase):
+    def setUp(self):
+        self.histogram = metrics.Histogram(
+            'test_seconds', 'Test histogram.', (), buckets=(0.1, 1))
+        self.addCleanup(metrics._metrics.remove, self.histogram)
+
+    def test_observe_from_threads(self):
+        def observe():
+            for value in (0.05, 0.5, 5):
+                self.histogram.observe((), value)
+
+        threads = [threading.Thread(target=observe) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        counts = self.histogram.collect()[()]
+        self.assertEqual(counts[:-1], [4, 4, 4])
+        self.assertAlmostEqual(counts[-1], 22.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tests of the popularity tracking.
+"""
+import unittest
+from unittest import mock
+
+from common.popularity import PopularityTracker
+
+
+class PopularityTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('common.popularity.time.monotonic',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hit(self, tracker, key, times=1):
+        for _ in range(times):
+            tracker.hit(key, f'data-{key}')
+
+    def test_top(self):
+        tracker = PopularityTracker('test_top', maxsize=10)
+        self.hit(tracker, 'a', 3)
+        self.hit(tracker, 'b', 5)
+        self.hit(tracker, 'c', 1)
+
+        self.assertEqual(tracker.top(2), [('b', 'data-b', 5),
+                                          ('a', 'data-a', 3)])
+
+    def test_decay(self):
+        tracker = PopularityTracker('test_decay', maxsize=10, half_life=10)
+        self.hit(tracker, 'a', 4)
+        self.now += 10
+        self.hit(tracker, 'b', 3)
+
+        self.assertEqual(tracker.top(2), [('b', 'data-b', 3),
+                                          ('a', 'data-a', 2)])
+
+        # Rebasing the start time keeps the counts.
+        self.now += 10 * 65
+        self.hit(tracker, 'b')
+        self.assertAlmostEqual(tracker.top(1)[0][2], 1)
+
+    def test_new_key_does_not_evict_popular_keys(self):
+        tracker = PopularityTracker('test_admission', maxsize=3)
+        self.hit(tracker, 'a', 5)
+        self.hit(tracker, 'b', 4)
+        self.hit(tracker, 'c', 3)
+
+        for key in range(20):
+            self.hit(tracker, key)
+
+        self.assertEqual([key for key, _, _ in tracker.top(3)],
+                         ['a', 'b', 'c'])
+        self.assertEqual(tracker.stats(), {'tracked': 3, 'rejected': 20})
+
+    def test_new_key_builds_up_count(self):
+        tracker = PopularityTracker('test_build_up', maxsize=3)
+        self.hit(tracker, 'a', 5)
+        self.hit(tracker, 'b', 4)
+        self.hit(tracker, 'c', 3)
+        self.hit(tracker, 'd', 4)
+
+        # Admitted on its 4th request, with the requests counted before.
+        self.assertEqual(tracker.top(3), [('a', 'data-a', 5),
+                                          ('b', 'data-b', 4),
+                                          ('d', 'data-d', 4)])
+
+    def test_many_hits(self):
+        tracker = PopularityTracker('test_many', maxsize=5)
+
+        for i in range(1000):
+            self.hit(tracker, i % 7, i % 7 + 1)
+
+        self.assertEqual([key for key, _, _ in tracker.top(5)],
+                         [6, 5, 4, 3, 2])
+        self.assertLessEqual(len(tracker._heap), 4 * 5 + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+Tests of the field projection of JSON documents.
+"""
+import io
+import json
+import unittest
+
+from common import projection
+from common.projection import ALL
+
+DOCUMENT = {
+    '@id': 'product',
+    'count': 2,
+    'data': {
+        'name': 'name',
+        'items': [
+            {'value': 1, 'unit': 'm', 'meta': {'source': 'a', 'rank': 1}},
+            {'value': 2, 'unit': 'm', 'meta': {'source': 'b', 'rank': 2}},
+            3
+        ],
+        'matrix': [[{'value': 1, 'other': 0}], [{'value': 2}]],
+        'empty': {}
+    }
+}
+
+
+def events(value, prefix: str = ''):
+    """Yields the ijson parser events of a parsed document."""
+    if isinstance(value, dict):
+        yield prefix, 'start_map', None
+
+        for key, item in value.items():
+            yield prefix, 'map_key', key
+            yield from events(item, f'{prefix}.{key}'.lstrip('.'))
+
+        yield prefix, 'end_map', None
+    elif isinstance(value, list):
+        yield prefix, 'start_array', None
+
+        for item in value:
+            yield from events(item, f'{prefix}.item'.lstrip('.'))
+
+        yield prefix, 'end_array', None
+    else:
+        yield prefix, 'number' if isinstance(value, int) else 'string', value
+
+
+class ParseFieldsTest(unittest.TestCase):
+    def test_nested(self):
+        self.assertEqual(
+            projection.parse_fields('@id, data.name,data.items.value'),
+            {'@id': ALL, 'data': {'name': ALL, 'items': {'value': ALL}}})
+
+    def test_whole_subtree_wins(self):
+        for spec in ('data.items.value,data', 'data,data.items.value'):
+            with self.subTest(spec=spec):
+                self.assertEqual(projection.parse_fields(spec),
+                                 {'data': ALL})
+
+    def test_invalid(self):
+        for spec in ('', 'a,', 'a..b', '.a'):
+            with self.subTest(spec=spec):
+                with self.assertRaises(ValueError):
+                    projection.parse_fields(spec)
+
+
+class ProjectTest(unittest.TestCase):
+    cases = [
+        ('@id', {'@id': 'product'}),
+        ('data.name,count', {'count': 2, 'data': {'name': 'name'}}),
+        # Paths go through arrays, scalar elements are dropped.
+        ('data.items.value', {'data': {'items': [{'value': 1},
+                                                 {'value': 2}]}}),
+        ('data.items.meta.source', {'data': {'items': [
+            {'meta': {'source': 'a'}}, {'meta': {'source': 'b'}}]}}),
+        ('data.matrix.value', {'data': {'matrix': [[{'value': 1}],
+                                                   [{'value': 2}]]}}),
+        ('data.items.meta,@id', {'@id': 'product', 'data': {'items': [
+            {'meta': {'source': 'a', 'rank': 1}},
+            {'meta': {'source': 'b', 'rank': 2}}]}}),
+        # Selecting into scalars or missing fields leaves empty containers.
+        ('count.value,data.missing', {'data': {}}),
+        ('data.empty', {'data': {'empty': {}}}),
+        ('data', {'data': DOCUMENT['data']})
+    ]
+
+    def test_project(self):
+        for spec, expected in self.cases:
+            with self.subTest(spec=spec):
+                self.assertEqual(projection.project(
+                    DOCUMENT, projection.parse_fields(spec)), expected)
+
+    def test_project_events(self):
+        # The streaming projection builds the same documents.
+        for spec, expected in self.cases:
+            with self.subTest(spec=spec):
+                self.assertEqual(projection._project_events(
+                    events(DOCUMENT), projection.parse_fields(spec)),
+                    expected)
+
+    def test_top_level_array(self):
+        tree = projection.parse_fields('a.b')
+        document = [{'a': {'b': 1, 'c': 2}}, {'a': [{'b': 2}]}, 'x']
+        expected = [{'a': {'b': 1}}, {'a': [{'b': 2}]}]
+
+        self.assertEqual(projection.project(document, tree), expected)
+        self.assertEqual(projection._project_events(events(document), tree),
+                         expected)
+
+    def test_project_text(self):
+        text = json.dumps(DOCUMENT)
+
+        for spec, expected in self.cases:
+            with self.subTest(spec=spec):
+                tree = projection.parse_fields(spec)
+
+                self.assertEqual(projection.project_text(text, tree),
+                                 expected)
+                self.assertEqual(projection.project_stream(
+                    io.BytesIO(text.encode('utf-8')), tree), expected)
+
+    def test_invalid_json(self):
+        tree = projection.parse_fields('a')
+
+        with self.assertRaises(ValueError):
+            projection.project_text('{"a": ', tree)
+
+        with self.assertRaises(ValueError):
+            projection.project_stream(io.BytesIO(b'{"a": '), tree)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Tests of the upstream API circuit breaker.
+"""
+import unittest
+from unittest import mock
+
+from app.services import CircuitBreaker, UpstreamUnavailable
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('app.services.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.breaker = CircuitBreaker('test', error_threshold=0.5, window=4,
+                                      min_calls=4, open_seconds=30)
+
+    def trip(self):
+        for ok in (True, False, True, False):
+            self.breaker.allow()
+            self.breaker.record(ok)
+
+    def assertRejected(self, retry_after: float):
+        with self.assertRaises(UpstreamUnavailable) as context:
+            self.breaker.allow()
+
+        self.assertEqual(context.exception.retry_after, retry_after)
+
+    def test_min_calls(self):
+        for _ in range(3):
+            self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_window(self):
+        for ok in (False, True, True, True, True, False):
+            self.breaker.record(ok)
+
+        # The first failure has left the window.
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_opens(self):
+        self.trip()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertRejected(30)
+
+        self.now += 10
+        self.assertRejected(20)
+        self.assertEqual(self.breaker.stats(), {
+            'state': CircuitBreaker.OPEN,
+            'trips': 1,
+            'rejected': 2
+        })
+
+    def test_probe_closes(self):
+        self.trip()
+        self.now += 30
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.allow()
+        # Only one probe at a time.
+        self.assertRejected(1)
+
+        self.breaker.record(True)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.allow()
+
+    def test_failed_probe_opens_again(self):
+        self.trip()
+        self.now += 30
+        self.breaker.allow()
+
+        self.breaker.record(False)
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertRejected(30)
+        self.assertEqual(self.breaker.stats()['trips'], 2)
+
+    def test_released_probe(self):
+        self.trip()
+        self.now += 30
+        self.breaker.allow()
+
+        # A probe ending without an outcome lets the next one through.
+        self.breaker.release()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.allow()
+
+
+if __name__ == '__main__':
+    unittest.main()
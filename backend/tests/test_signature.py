@@ -0,0 +1,81 @@
+"""
+Tests of the request signatures against the original implementation.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import unittest
+
+from common import utils
+
+SECRET = 'shared-secret'
+
+
+def reference_signature(secret: str, body) -> str:
+    """Returns the signature as computed before the Signer was introduced.
+
+    :param secret: The shared secret.
+    :type secret: str
+    :param body: The body to sign.
+    :type body: str|dict
+    :return: The base64 encoded signature.
+    :rtype: str
+    """
+    if isinstance(body, dict):
+        payload = json.dumps(
+            body,
+            sort_keys=True,
+            indent=None,
+            separators=(',', ': ')
+        ).strip()
+    else:
+        payload = body.strip()
+
+    digest = hmac.new(secret.encode('utf-8'), payload.encode('utf-8'),
+                      hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+class SignatureTest(unittest.TestCase):
+    BODIES = [
+        {},
+        {'b': 1, 'a': [1, 2.5, None, True], 'c': {'z': 'x', 'y': ''}},
+        {'name': 'Jürgen Müller', 'city': '東京', 'emoji': '\U0001f600'},
+        {'text': '  padded value \n', 'escaped': 'quote " slash \\ tab \t'},
+        '',
+        '{"a": 1}',
+        '  \n\t{"padded": true}  \r\n',
+        'Jürgen 東京 \U0001f600',
+        '  Müller  '
+    ]
+
+    def test_generate_signature(self):
+        for body in self.BODIES:
+            with self.subTest(body=body):
+                self.assertEqual(utils.generate_signature(SECRET, body),
+                                 reference_signature(SECRET, body))
+
+    def test_signer(self):
+        signer = utils.Signer(SECRET)
+
+        self.assertEqual(
+            signer.sign_many(self.BODIES),
+            [reference_signature(SECRET, body) for body in self.BODIES])
+
+    def test_payload_bytes(self):
+        for body in self.BODIES:
+            with self.subTest(body=body):
+                self.assertEqual(
+                    utils.get_signature_payload_bytes(body),
+                    utils.get_signature_payload(body).encode('utf-8'))
+
+    def test_invalid_body(self):
+        for body in (None, 1, ['a'], b'{}'):
+            with self.subTest(body=body):
+                with self.assertRaises(RuntimeError):
+                    utils.generate_signature(SECRET, body)
+
+
+if __name__ == '__main__':
+    unittest.main()